@@ -0,0 +1,181 @@
+# audio/codecs.py
+#
+# Voice codecs for the UDP path. Every codec turns one 20 ms frame of 48 kHz
+# mono 16-bit little-endian PCM (FRAME_BYTES) into a payload and back:
+#
+#     opus       ~32 kbit/s     needs opuslib (and libopus)
+#     mulaw16k   128 kbit/s     G.711 u-law at 16 kHz; needs numpy
+#     mulaw      384 kbit/s     G.711 u-law at 48 kHz; numpy, or tables without it
+#     pcm        768 kbit/s     passthrough, what clients sent before codecs
+#
+# The codec is picked per client at VOICE_JOIN: the client lists the codecs
+# it has, the server picks the smallest one it has too. Codecs with state
+# (opus) need one instance per stream; create_codec() always returns a new one.
+import functools
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # 20 ms
+FRAME_BYTES = FRAME_SAMPLES * 2
+
+# Sun's g711.c, which audioop and most other implementations follow
+MULAW_BIAS = 0x84
+MULAW_ENCODE_BIAS = 0x21  # the encoder works on the top 14 bits
+MULAW_ENCODE_CLIP = 8159
+
+
+class PcmCodec:
+    name = "pcm"
+    stateful = False
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def decode(self, payload: bytes) -> bytes:
+        return payload
+
+
+# ---------------- U-LAW ----------------
+
+def _mulaw_encode_sample(sample: int) -> int:
+    value = sample >> 2
+    if value < 0:
+        value, mask = -value, 0x7F
+    else:
+        mask = 0xFF
+    value = min(value, MULAW_ENCODE_CLIP) + MULAW_ENCODE_BIAS
+    segment = value.bit_length() - 6
+    if segment >= 8:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((value >> (segment + 1)) & 0x0F)) ^ mask
+
+
+def _mulaw_decode_byte(byte: int) -> int:
+    byte = ~byte & 0xFF
+    exponent = (byte >> 4) & 0x07
+    magnitude = ((((byte & 0x0F) << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return -magnitude if byte & 0x80 else magnitude
+
+
+@functools.cache
+def _mulaw_tables():
+    """(encode table indexed by the sample as unsigned 16-bit, decode table of 256 samples)"""
+    encode = bytes(_mulaw_encode_sample(s - 65536 if s >= 32768 else s) for s in range(65536))
+    decode = [_mulaw_decode_byte(b) for b in range(256)]
+    return encode, decode
+
+
+class MuLawCodec:
+    """One byte per sample, by table lookup: vectorized with numpy, a byte at a time without"""
+    name = "mulaw"
+    stateful = False
+
+    def __init__(self):
+        encode, decode = _mulaw_tables()
+        self.vectorized = np is not None
+        if self.vectorized:
+            self._encode_table = np.frombuffer(encode, dtype=np.uint8)
+            self._decode_table = np.array(decode, dtype="<i2")
+        else:
+            self._encode_table = encode
+            # Each u-law byte maps straight to its two PCM bytes
+            self._decode_table = [int(s).to_bytes(2, "little", signed=True) for s in decode]
+
+    def encode(self, pcm: bytes) -> bytes:
+        if self.vectorized:
+            return self._encode_table[np.frombuffer(pcm, dtype="<u2", count=len(pcm) // 2)].tobytes()
+        samples = array("H", pcm[:len(pcm) // 2 * 2])
+        if sys.byteorder == "big":
+            samples.byteswap()
+        return bytes(map(self._encode_table.__getitem__, samples))
+
+    def decode(self, payload: bytes) -> bytes:
+        if self.vectorized:
+            return self._decode_table[np.frombuffer(payload, dtype=np.uint8)].tobytes()
+        return b"".join(map(self._decode_table.__getitem__, payload))
+
+
+class MuLaw16kCodec(MuLawCodec):
+    """u-law after resampling to 16 kHz: voice keeps its band, a third of the bytes"""
+    name = "mulaw16k"
+    FACTOR = SAMPLE_RATE // 16000
+
+    def __init__(self):
+        super().__init__()
+        n = FRAME_SAMPLES // self.FACTOR
+        # Centre of each averaged group, for linear interpolation back up
+        self._coarse = np.arange(n) * self.FACTOR + (self.FACTOR - 1) / 2
+        self._fine = np.arange(FRAME_SAMPLES)
+
+    def encode(self, pcm: bytes) -> bytes:
+        samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+        usable = len(samples) // self.FACTOR * self.FACTOR
+        # Averaging each group doubles as a (crude) anti-aliasing filter
+        low = samples[:usable].reshape(-1, self.FACTOR).mean(axis=1)
+        return self._encode_table[np.round(low).astype(np.int16).view(np.uint16)].tobytes()
+
+    def decode(self, payload: bytes) -> bytes:
+        low = self._decode_table[np.frombuffer(payload, dtype=np.uint8)]
+        if len(low) != len(self._coarse):
+            coarse = np.arange(len(low)) * self.FACTOR + (self.FACTOR - 1) / 2
+            fine = np.arange(len(low) * self.FACTOR)
+        else:
+            coarse, fine = self._coarse, self._fine
+        return np.interp(fine, coarse, low).astype("<i2").tobytes()
+
+
+# ---------------- OPUS ----------------
+
+class OpusCodec:
+    name = "opus"
+    stateful = True
+    BITRATE = 32000
+
+    def __init__(self):
+        self._encoder = None
+        self._decoder = None
+
+    def encode(self, pcm: bytes) -> bytes:
+        if self._encoder is None:
+            self._encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+            self._encoder.bitrate = self.BITRATE
+        return self._encoder.encode(pcm, len(pcm) // 2)
+
+    def decode(self, payload: bytes) -> bytes:
+        if self._decoder is None:
+            self._decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+        return self._decoder.decode(payload, FRAME_SAMPLES)
+
+
+# Smallest first; only codecs whose library is installed are offered
+CODECS = {
+    codec.name: codec
+    for codec, available in (
+        (OpusCodec, opuslib is not None),
+        (MuLaw16kCodec, np is not None),
+        (MuLawCodec, True),
+        (PcmCodec, True),
+    )
+    if available
+}
+
+
+def create_codec(name: str):
+    return CODECS[name]()
+
+
+def negotiate_codec(offered) -> str:
+    """The smallest codec both sides have; clients that list none get pcm"""
+    offered = offered or []
+    return next((name for name in CODECS if name in offered), PcmCodec.name)
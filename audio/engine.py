@@ -0,0 +1,211 @@
+# audio/engine.py
+#
+# Full-duplex client voice. PortAudio runs the microphone and the speakers
+# as callback streams on threads of its own; the callbacks only move frames
+# through deques (appends and pops need no lock) and wake the client's event
+# loop. Everything else happens on that loop, next to the TCP connection:
+#
+#     capture callback -> captured -> VAD, encode, send      (loop)
+#     UDP endpoint     -> unpack, jitter buffers             (loop)
+#     playback callback <- playback <- mix one frame a tick   (loop)
+#
+# The playback callback is the clock for the receive side: every frame it
+# takes is replaced by a freshly mixed one, so playback stays PLAYBACK_FRAMES
+# ahead of the jitter buffers and latency does not drift.
+#
+# The server learns the engine's address from a FLAG_HELLO datagram carrying
+# the session token, resent every HELLO_INTERVAL until the server answers and
+# every HELLO_REFRESH after that, so a new address (NAT rebinding, a roam)
+# is picked up before the old one times out.
+import asyncio
+import collections
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+from audio.codecs import FRAME_BYTES, FRAME_SAMPLES, SAMPLE_RATE, PcmCodec, create_codec
+from audio.jitter import Playout
+from audio.packet import FLAG_HELLO, FLAG_SILENT, pack, unpack
+from audio.vad import VoiceActivityDetector
+
+CHANNELS = 1
+CAPTURE_FRAMES = 10  # frames the loop may fall behind the microphone before the oldest are dropped
+PLAYBACK_FRAMES = 2  # mixed frames queued for the speakers
+KEEPALIVE_FRAMES = 50  # one silence marker a second while not sending audio
+HELLO_INTERVAL = 0.5
+HELLO_REFRESH = 2.0  # well inside the server's 5 s timeout
+SILENCE = bytes(FRAME_BYTES)
+
+
+class VoiceClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        self.engine.receive(data)
+
+    def error_received(self, exc):
+        # ICMP errors while the server is unreachable; voice resumes when it is back
+        pass
+
+
+class VoiceEngine:
+    """
+    One voice session: a UDP endpoint on `loop` and two audio streams.
+    muted and deafened are plain attributes, read on every frame.
+    """
+
+    def __init__(self, loop, server_addr, input_device_index=None, output_device_index=None):
+        self.loop = loop
+        self.server_addr = server_addr
+        self.input_device_index = input_device_index
+        self.output_device_index = output_device_index
+        self.muted = False
+        self.deafened = False
+        self.speaking = False
+
+        self.codec = create_codec(PcmCodec.name)  # replaced by the one the server picks
+        self.playout = Playout(PcmCodec.name)
+        self.vad = VoiceActivityDetector()
+        self.captured = collections.deque(maxlen=CAPTURE_FRAMES)
+        self.playback = collections.deque()
+        self.seq = 0
+        self.timestamp = 0
+        self.quiet = 0  # frames since audio was last sent
+        self.underruns = 0
+        self.token = None
+        self.bound = False  # the server has answered our hello
+        self._hello_task = None
+
+        self.transport = None
+        self.audio = None
+        self.stream_in = None
+        self.stream_out = None
+        self.running = False
+
+    async def start(self, udp_port: int):
+        """Runs on the loop. Binds the UDP port, then opens the audio streams"""
+        if pyaudio is None:
+            raise RuntimeError("voice needs pyaudio")
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: VoiceClientProtocol(self), local_addr=("0.0.0.0", udp_port)
+        )
+        self.running = True
+        self._fill_playback()
+        try:
+            self.audio = pyaudio.PyAudio()
+            self.stream_in = self.audio.open(
+                format=pyaudio.paInt16,
+                channels=CHANNELS,
+                rate=SAMPLE_RATE,
+                input=True,
+                frames_per_buffer=FRAME_SAMPLES,
+                input_device_index=self.input_device_index,
+                stream_callback=self._on_capture,
+            )
+            self.stream_out = self.audio.open(
+                format=pyaudio.paInt16,
+                channels=CHANNELS,
+                rate=SAMPLE_RATE,
+                output=True,
+                frames_per_buffer=FRAME_SAMPLES,
+                output_device_index=self.output_device_index,
+                stream_callback=self._on_playback,
+            )
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """Safe from any thread"""
+        self.running = False
+        for stream in (self.stream_in, self.stream_out):
+            if stream:
+                stream.stop_stream()
+                stream.close()
+        self.stream_in = self.stream_out = None
+        if self.audio:
+            self.audio.terminate()
+            self.audio = None
+        if self.transport:
+            try:
+                self.loop.call_soon_threadsafe(self.transport.close)
+            except RuntimeError:
+                self.transport.close()  # the loop is already closed
+            self.transport = None
+
+    def set_codec(self, name: str):
+        self.codec = create_codec(name)
+        self.playout = Playout(name)
+
+    def hello(self, token: str):
+        """Runs on the loop. (Re)introduce this endpoint to the voice server"""
+        self.token = token
+        self.bound = False
+        if self._hello_task is None or self._hello_task.done():
+            self._hello_task = self.loop.create_task(self._hello_loop())
+
+    async def _hello_loop(self):
+        while self.running:
+            transport = self.transport
+            if transport is None:
+                return
+            transport.sendto(pack(self.token.encode(), 0, 0, flags=FLAG_HELLO), self.server_addr)
+            await asyncio.sleep(HELLO_REFRESH if self.bound else HELLO_INTERVAL)
+
+    # ---------------- CAPTURE ----------------
+
+    def _on_capture(self, in_data, frame_count, time_info, status):
+        # PortAudio's thread: hand the frame over and get out
+        self.captured.append(in_data)
+        self.loop.call_soon_threadsafe(self._send_captured)
+        return None, pyaudio.paContinue
+
+    def _send_captured(self):
+        captured = self.captured
+        transport = self.transport  # stop() may clear it from another thread
+        while captured:
+            pcm = captured.popleft()
+            if not self.running or transport is None:
+                continue
+            self.speaking = not self.muted and self.vad.is_speech(pcm)
+            if self.speaking:
+                transport.sendto(pack(self.codec.encode(pcm), self.seq, self.timestamp), self.server_addr)
+                self.seq += 1
+                self.quiet = 0
+            else:
+                if self.quiet % KEEPALIVE_FRAMES == 0:
+                    # Carries the next seq without using it up: receivers never see it
+                    transport.sendto(pack(b"", self.seq, self.timestamp, flags=FLAG_SILENT), self.server_addr)
+                self.quiet += 1
+            self.timestamp += FRAME_SAMPLES  # keeps counting through silence, so gaps show as gaps
+
+    # ---------------- PLAYBACK ----------------
+
+    def receive(self, data: bytes):
+        packet = unpack(data)
+        if packet is None:
+            return
+        flags, source, seq, timestamp, payload = packet
+        if flags & FLAG_HELLO:
+            self.bound = True
+            return
+        if self.deafened:
+            return
+        self.playout.push(source, seq, timestamp, payload)
+
+    def _on_playback(self, in_data, frame_count, time_info, status):
+        # PortAudio's thread: play what the loop mixed, ask for the next one
+        try:
+            frame = self.playback.popleft()
+        except IndexError:
+            frame = SILENCE
+            self.underruns += 1
+        self.loop.call_soon_threadsafe(self._fill_playback)
+        return (SILENCE if self.deafened else frame), pyaudio.paContinue
+
+    def _fill_playback(self):
+        while self.running and len(self.playback) < PLAYBACK_FRAMES:
+            self.playback.append(self.playout.next_frame() or SILENCE)
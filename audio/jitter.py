@@ -0,0 +1,179 @@
+# audio/jitter.py
+#
+# Client playout. Every speaker (packet source) gets a jitter buffer that
+# reorders their packets and releases one per 20 ms tick, holding back just
+# enough frames to ride out the jitter it has measured; every tick the
+# speakers' frames are decoded and mixed into the one frame that is played.
+#
+# Latency stays bounded: a buffer never holds more than MAX_DEPTH frames and
+# skips ahead when it finds itself further behind than it needs to be. Lost
+# frames are concealed by repeating the last one, fading out, for up to
+# MAX_CONCEALED ticks.
+import math
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from audio.codecs import FRAME_SAMPLES, SAMPLE_RATE, create_codec
+from audio.packet import SEQ_MOD, seq_delta
+
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+MIN_DEPTH = 1  # frames buffered before a talkspurt starts playing
+MAX_DEPTH = 10  # 200 ms
+DEPTH_SLACK = 2  # frames above the target tolerated before skipping ahead
+MAX_CONCEALED = 3
+CONCEAL_FADE = 0.5
+IDLE_TICKS = 10  # ticks without packets after which a speaker has stopped
+RESYNC_DISTANCE = 250  # a seq this far off means the sender started over
+
+
+class JitterBuffer:
+    """One speaker's packets, reordered and released one per tick at an adaptive depth"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.packets: dict[int, bytes] = {}  # seq -> payload
+        self.next_seq = None  # next seq to play; None between talkspurts
+        self.newest = None
+        self.jitter = 0.0  # seconds, RFC 3550 interarrival jitter estimate
+        self.target = MIN_DEPTH
+        self.idle = 0
+        self._transit = None
+        self.late = self.lost = self.skipped = 0
+
+    def push(self, seq: int, timestamp: int, payload: bytes):
+        transit = self.clock() - timestamp / SAMPLE_RATE
+        if self._transit is not None:
+            d = abs(transit - self._transit)
+            if d < 1.0:  # otherwise the timestamp wrapped or the sender restarted
+                self.jitter += (d - self.jitter) / 16
+        self._transit = transit
+        self.target = min(MAX_DEPTH, max(MIN_DEPTH, math.ceil(2 * self.jitter / FRAME_SECONDS) + 1))
+        self.idle = 0
+
+        if self.next_seq is not None:
+            distance = seq_delta(seq, self.next_seq)
+            if abs(distance) > RESYNC_DISTANCE:
+                self.reset()
+            elif distance < 0:
+                self.late += 1  # its turn has passed
+                return
+        self.packets[seq] = payload
+        if self.newest is None or seq_delta(seq, self.newest) > 0:
+            self.newest = seq
+
+    def reset(self):
+        self.packets.clear()
+        self.next_seq = None
+        self.newest = None
+
+    def pop(self):
+        """
+        Once per tick: (payload, playing). playing is False while buffering or
+        between talkspurts; a None payload while playing is a lost frame.
+        """
+        self.idle += 1
+        if self.next_seq is None:
+            if len(self.packets) < self.target:
+                return None, False
+            self.next_seq = min(self.packets, key=lambda seq: seq_delta(seq, self.newest))
+        elif not self.packets and self.idle > IDLE_TICKS:
+            self.reset()
+            return None, False
+
+        behind = seq_delta(self.newest, self.next_seq) + 1 if self.newest is not None else 0
+        if behind > self.target + DEPTH_SLACK:
+            # Further behind than the jitter calls for: drop the oldest frames
+            skip_to = (self.newest - self.target + 1) % SEQ_MOD
+            while self.next_seq != skip_to:
+                self.packets.pop(self.next_seq, None)
+                self.next_seq = (self.next_seq + 1) % SEQ_MOD
+                self.skipped += 1
+
+        payload = self.packets.pop(self.next_seq, None)
+        if payload is None and self.newest is not None and seq_delta(self.next_seq, self.newest) > 0:
+            # Played everything received; wait here instead of running ahead of the sender
+            return None, True
+        self.next_seq = (self.next_seq + 1) % SEQ_MOD
+        if payload is None:
+            self.lost += 1
+        return payload, True
+
+
+# ---------------- SAMPLES ----------------
+
+def _to_samples(pcm: bytes):
+    if np is not None:
+        samples = np.frombuffer(pcm, dtype="<i2", count=min(len(pcm) // 2, FRAME_SAMPLES)).astype(np.int32)
+        return np.pad(samples, (0, FRAME_SAMPLES - len(samples))) if len(samples) < FRAME_SAMPLES else samples
+    samples = array("h", pcm[:FRAME_SAMPLES * 2])
+    return list(samples) + [0] * (FRAME_SAMPLES - len(samples))
+
+
+def _fade(samples, factor: float):
+    if np is not None:
+        return (samples * factor).astype(np.int32)
+    return [int(s * factor) for s in samples]
+
+
+def _mix(frames: list) -> bytes:
+    if np is not None:
+        total = frames[0] if len(frames) == 1 else np.sum(frames, axis=0)
+        return np.clip(total, -32768, 32767).astype("<i2").tobytes()
+    mixed = array("h", (max(-32768, min(32767, sum(column))) for column in zip(*frames)))
+    return mixed.tobytes()
+
+
+# ---------------- PLAYOUT ----------------
+
+class Speaker:
+    def __init__(self, codec_name: str, clock):
+        self.buffer = JitterBuffer(clock)
+        self.decoder = create_codec(codec_name)  # per speaker: codecs may keep state
+        self.last = None
+        self.concealed = 0
+
+    def next_frame(self):
+        """This tick's samples, or None if there is nothing to play"""
+        payload, playing = self.buffer.pop()
+        if not playing:
+            self.last = None
+            return None
+        if payload is not None:
+            self.last = _to_samples(self.decoder.decode(payload))
+            self.concealed = 0
+            return self.last
+        if self.last is None or self.concealed >= MAX_CONCEALED:
+            return None
+        self.concealed += 1
+        self.last = _fade(self.last, CONCEAL_FADE)
+        return self.last
+
+
+class Playout:
+    """Every speaker in the room, mixed into one PCM frame per tick"""
+
+    def __init__(self, codec_name: str, clock=time.monotonic):
+        self.codec_name = codec_name
+        self.clock = clock
+        self.speakers: dict[int, Speaker] = {}  # packet source -> speaker
+
+    def push(self, source: int, seq: int, timestamp: int, payload: bytes):
+        speaker = self.speakers.get(source)
+        if speaker is None:
+            speaker = self.speakers[source] = Speaker(self.codec_name, self.clock)
+        speaker.buffer.push(seq, timestamp, payload)
+
+    def next_frame(self) -> bytes | None:
+        frames = []
+        for source, speaker in list(self.speakers.items()):
+            frame = speaker.next_frame()
+            if frame is not None:
+                frames.append(frame)
+            elif speaker.buffer.next_seq is None and not speaker.buffer.packets:
+                del self.speakers[source]  # stopped talking; state is rebuilt if they start again
+        return _mix(frames) if frames else None
@@ -0,0 +1,57 @@
+# audio/packet.py
+#
+# Header carried by every voice datagram:
+#
+#     !B version | !B flags | !H source | !H seq | !I timestamp | codec payload
+#
+# seq counts packets and timestamp counts samples (48 kHz), both per sender
+# and wrapping. Clients send source 0; VoiceServer overwrites it with the
+# sender's id in the room before forwarding, so receivers can keep one
+# jitter buffer per speaker. Mixed rooms send the server's own stream with
+# source MIX_SOURCE.
+#
+# Clients stop sending audio while their VAD hears silence and send an
+# occasional FLAG_SILENT packet instead: no payload, just the sign that the
+# sender is still there. The server does not forward them.
+#
+# A client's first datagram is a FLAG_HELLO packet carrying its session
+# token; the server learns the client's UDP address from it (VOICE_JOIN only
+# names the channel) and answers with an empty FLAG_HELLO packet.
+import struct
+
+HEADER = struct.Struct("!BBHHI")
+HEADER_SIZE = HEADER.size
+VERSION = 1
+MIX_SOURCE = 0
+
+FLAG_SILENT = 0x01
+FLAG_HELLO = 0x02
+
+SEQ_MOD = 1 << 16
+TIMESTAMP_MOD = 1 << 32
+
+
+def pack(payload: bytes, seq: int, timestamp: int, source: int = 0, flags: int = 0) -> bytes:
+    return HEADER.pack(VERSION, flags, source, seq % SEQ_MOD, timestamp % TIMESTAMP_MOD) + payload
+
+
+def unpack(data: bytes):
+    """(flags, source, seq, timestamp, payload), or None if this is not a voice packet"""
+    if len(data) < HEADER_SIZE or data[0] != VERSION:
+        return None
+    _, flags, source, seq, timestamp = HEADER.unpack_from(data)
+    return flags, source, seq, timestamp, data[HEADER_SIZE:]
+
+
+def is_packet(data: bytes) -> bool:
+    return len(data) >= HEADER_SIZE and data[0] == VERSION
+
+
+def restamp(data: bytes, source: int) -> bytes:
+    """The same packet with the sender's source id filled in"""
+    return data[:2] + source.to_bytes(2, "big") + data[4:]
+
+
+def seq_delta(a: int, b: int) -> int:
+    """a - b for wrapping 16-bit sequence numbers, in -32768..32767"""
+    return (a - b + SEQ_MOD // 2) % SEQ_MOD - SEQ_MOD // 2
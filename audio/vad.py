@@ -0,0 +1,52 @@
+# audio/vad.py
+#
+# Energy-based voice activity detection for the sending side. A frame is
+# speech when its energy clears the noise floor by SPEECH_RATIO and an
+# absolute minimum; the floor follows the background level, dropping at once
+# and rising slowly, so a steady fan or hum is learned as silence while
+# speech is not. Once speech stops, frames count as speech for HANGOVER more
+# ticks so word endings and short pauses are not cut off.
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HANGOVER = 15  # frames (300 ms)
+SPEECH_RATIO = 8.0  # energy over the noise floor, ~9 dB
+MIN_SPEECH_ENERGY = 300.0 ** 2  # mean square; an RMS of 300 of 32768
+FLOOR_RISE = 0.005  # fraction of the gap the floor closes per frame when rising
+INITIAL_FLOOR = 100.0 ** 2
+
+
+def frame_energy(pcm: bytes) -> float:
+    """Mean square of the 16-bit little-endian samples in one frame"""
+    if np is not None:
+        samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2).astype(np.float32)
+        return float(np.dot(samples, samples)) / len(samples) if len(samples) else 0.0
+    samples = array("h", pcm[:len(pcm) // 2 * 2])
+    return sum(s * s for s in samples) / len(samples) if samples else 0.0
+
+
+class VoiceActivityDetector:
+    def __init__(self, hangover: int = HANGOVER):
+        self.hangover = hangover
+        self.floor = INITIAL_FLOOR
+        self.remaining = 0  # hangover frames left
+        self.energy = 0.0  # of the last frame, for meters
+
+    def is_speech(self, pcm: bytes) -> bool:
+        energy = self.energy = frame_energy(pcm)
+        if energy > max(self.floor * SPEECH_RATIO, MIN_SPEECH_ENERGY):
+            self.remaining = self.hangover
+            # Speech does not teach the floor anything
+            return True
+        if energy < self.floor:
+            self.floor = energy
+        else:
+            self.floor += (energy - self.floor) * FLOOR_RISE
+        if self.remaining:
+            self.remaining -= 1
+            return True
+        return False
@@ -1,11 +1,27 @@
+import asyncio
 import bcrypt
 import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from core.models.user import User
 
 
+class AuthBusy(Exception):
+    """Raised when too many password checks are already queued"""
+
+
 class AuthManager:
-    def __init__(self):
-        self.sessions = {}
+    def __init__(self, max_workers: int = 4, max_pending: int = 256, session_ttl: float = 24 * 3600):
+        # token -> (user_id, expires_at), ordered by expiry: every session gets the
+        # same TTL and is moved to the end when refreshed, so expired ones sit at the front
+        self.sessions: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.session_ttl = session_ttl
+        # bcrypt releases the GIL, so a small thread pool checks passwords in parallel
+        # without stalling the event loop; max_pending bounds the queue during login storms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self._pending = 0
 
     def hash_password(self, password: str) -> str:
         return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
@@ -13,15 +29,50 @@ class AuthManager:
     def verify_password(self, password: str, password_hash: str) -> bool:
         return bcrypt.checkpw(password.encode(), password_hash.encode())
 
+    async def verify_password_async(self, password: str, password_hash: str) -> bool:
+        if self._pending >= self.max_pending:
+            raise AuthBusy()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.verify_password, password, password_hash)
+        finally:
+            self._pending -= 1
+
     def create_user(self, username: str, password: str) -> User:
         password_hash = self.hash_password(password)
         return User(username, password_hash)
 
     def create_session(self, user: User) -> str:
+        self.expire_sessions()
         token = secrets.token_hex(32)
-        self.sessions[token] = user.id
+        self.sessions[token] = (user.id, time.monotonic() + self.session_ttl)
         user.session_token = token
         return token
 
+    def add_session(self, token: str, user_id: str):
+        """Register a session created elsewhere (another worker process)"""
+        self.sessions[token] = (user_id, time.monotonic() + self.session_ttl)
+        self.sessions.move_to_end(token)
+
     def validate_session(self, token: str) -> str | None:
-        return self.sessions.get(token)
+        """Return the session's user_id and extend its lifetime, or None if unknown/expired"""
+        self.expire_sessions()
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        user_id, _ = session
+        self.sessions[token] = (user_id, time.monotonic() + self.session_ttl)
+        self.sessions.move_to_end(token)
+        return user_id
+
+    def revoke_session(self, token: str):
+        self.sessions.pop(token, None)
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        while self.sessions:
+            token, (_, expires_at) = next(iter(self.sessions.items()))
+            if expires_at > now:
+                break
+            del self.sessions[token]
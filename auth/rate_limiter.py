@@ -0,0 +1,45 @@
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket per key (IP address, username, ...).
+    Each key may spend `burst` attempts at once and regains `rate` per second.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: dict[str, tuple[float, float]] = {}  # key -> (tokens, updated_at)
+
+    def _tokens(self, key: str, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, updated_at = bucket
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def allowed(self, key: str) -> bool:
+        """Check without spending a token"""
+        return self._tokens(key, time.monotonic()) >= 1
+
+    def hit(self, key: str) -> bool:
+        """Spend a token; False when the key is over its limit"""
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        if len(self.buckets) > self.max_keys:
+            self._prune(now)
+        return True
+
+    def reset(self, key: str):
+        self.buckets.pop(key, None)
+
+    def _prune(self, now: float):
+        # Buckets that have refilled are indistinguishable from unseen keys
+        full_after = self.burst / self.rate if self.rate else float("inf")
+        for key in [k for k, (_, updated_at) in self.buckets.items() if now - updated_at >= full_after]:
+            del self.buckets[key]
@@ -0,0 +1,63 @@
+# benchmarks/bench_message_lookup.py
+#
+# Compares the old linear scan over channel.messages with the message index
+# used by ChannelController for edit/delete/react.
+#
+#   python -m benchmarks.bench_message_lookup [--sizes 10000 100000 1000000]
+import argparse
+import random
+import time
+
+from core.enums import ChannelType
+from core.models.channel import Channel
+from core.models.message import Message
+
+
+def build_channel(size: int) -> Channel:
+    channel = Channel("bench", ChannelType.TEXT)
+    for i in range(size):
+        channel.add_message(Message("author", f"message {i}"))
+    return channel
+
+
+def linear_lookup(channel: Channel, message_id: str):
+    for msg in channel.messages:
+        if msg.id == message_id and not msg.deleted:
+            return msg
+    return None
+
+
+def indexed_lookup(channel: Channel, message_id: str):
+    msg = channel.get_message(message_id)
+    if msg and not msg.deleted:
+        return msg
+    return None
+
+
+def time_lookups(lookup, channel: Channel, ids: list[str]) -> float:
+    """Average seconds per lookup"""
+    start = time.perf_counter()
+    for message_id in ids:
+        lookup(channel, message_id)
+    return (time.perf_counter() - start) / len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message lookup: linear scan vs index")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'linear (us)':>14} {'indexed (us)':>14} {'speedup':>10}")
+    for size in args.sizes:
+        channel = build_channel(size)
+        # Random targets, so the scan pays half the list on average
+        ids = [random.choice(channel.messages).id for _ in range(args.lookups)]
+
+        linear = time_lookups(linear_lookup, channel, ids)
+        indexed = time_lookups(indexed_lookup, channel, ids)
+        print(f"{size:>10} {linear * 1e6:>14.2f} {indexed * 1e6:>14.3f} {linear / indexed:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
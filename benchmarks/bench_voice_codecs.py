@@ -0,0 +1,75 @@
+# benchmarks/bench_voice_codecs.py
+#
+# Bitrate, CPU cost and quality of the voice codecs in audio/codecs.py on a
+# synthetic voice-like signal (a few harmonics of a gliding pitch plus some
+# noise), one 20 ms frame at a time. "mulaw (tables)" is the fallback used
+# when numpy is missing.
+#
+#   python -m benchmarks.bench_voice_codecs [--frames 2000]
+import argparse
+import math
+import random
+import time
+from array import array
+
+import audio.codecs as codecs
+from audio.codecs import CODECS, FRAME_SAMPLES, SAMPLE_RATE, create_codec
+
+FRAMES_PER_SECOND = SAMPLE_RATE // FRAME_SAMPLES
+
+
+def voice_frames(count: int, seed: int = 0) -> list[bytes]:
+    rng = random.Random(seed)
+    frames, phase = [], 0.0
+    for i in range(count):
+        pitch = 120 + 60 * math.sin(i / 25)  # Hz, gliding
+        samples = array("h")
+        for _ in range(FRAME_SAMPLES):
+            phase += 2 * math.pi * pitch / SAMPLE_RATE
+            value = sum(math.sin(phase * h) / h for h in range(1, 8)) * 6000 + rng.gauss(0, 200)
+            samples.append(max(-32768, min(32767, int(value))))
+        frames.append(samples.tobytes())
+    return frames
+
+
+def snr_db(reference: bytes, decoded: bytes) -> float:
+    ref, out = array("h", reference), array("h", decoded)
+    signal = sum(x * x for x in ref)
+    noise = sum((x - y) ** 2 for x, y in zip(ref, out))
+    return float("inf") if noise == 0 else 10 * math.log10(signal / noise)
+
+
+def measure(codec, frames):
+    start = time.perf_counter()
+    payloads = [codec.encode(frame) for frame in frames]
+    encoded = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = [codec.decode(payload) for payload in payloads]
+    elapsed = time.perf_counter() - start
+    size = sum(map(len, payloads)) / len(payloads)
+    # Quality on a sample of frames; the pure-Python SNR is slow
+    snr = sum(snr_db(a, b) for a, b in zip(frames[::50], decoded[::50])) / len(frames[::50])
+    return size, encoded / len(frames), elapsed / len(frames), snr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice codec bitrate, CPU and quality")
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+
+    frames = voice_frames(args.frames)
+    rows = [(name, create_codec(name)) for name in CODECS]
+    if codecs.np is not None:
+        numpy, codecs.np = codecs.np, None
+        rows.append(("mulaw (tables)", codecs.MuLawCodec()))
+        codecs.np = numpy
+
+    print(f"{'codec':>15} {'bytes/frame':>12} {'kbit/s':>8} {'encode us':>10} {'decode us':>10} {'SNR dB':>7}")
+    for name, codec in rows:
+        size, encode, decode, snr = measure(codec, frames)
+        print(f"{name:>15} {size:>12.0f} {size * 8 * FRAMES_PER_SECOND / 1000:>8.0f} "
+              f"{encode * 1e6:>10.1f} {decode * 1e6:>10.1f} {snr:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
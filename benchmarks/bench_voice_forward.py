@@ -0,0 +1,115 @@
+# benchmarks/bench_voice_forward.py
+#
+# VoiceServer forwarding throughput over loopback. The server runs in a child
+# process with `rooms` voice channels of `members` each; one member per room
+# sends as fast as this process can, the others only receive (and do not
+# read, so the kernel drops what they are sent). Reported per second of
+# wall time and per second of the server's CPU time, which is the figure to
+# compare across modes and machines.
+#
+#   python -m benchmarks.bench_voice_forward [--rooms 200] [--members 5] [--mode asyncio thread]
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from audio.packet import pack
+from networking.voice_server import VoiceServer
+
+PACKET = pack(bytes(1920), seq=0, timestamp=0)  # one 20 ms frame of 48 kHz 16-bit mono PCM
+
+
+class CountingVoiceServer(VoiceServer):
+    packets_in = 0
+
+    def forward(self, data, addr):
+        self.packets_in += 1
+        super().forward(data, addr)
+
+
+def serve(port, mode, rooms, done, results):
+    async def main():
+        # Listeners never send, so they are kept without the liveness timeout
+        server = CountingVoiceServer("127.0.0.1", port, threaded=(mode == "thread"), timeout=None)
+        for room, addrs in enumerate(rooms):
+            for user, addr in enumerate(addrs):
+                server.join(f"room-{room}", f"user-{room}-{user}", addr)
+        task = asyncio.create_task(server.start())
+        await asyncio.to_thread(done.wait)
+        cpu = time.process_time()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        results.put((server.packets_in, cpu))
+
+    asyncio.run(main())
+
+
+def run(mode, rooms, members, duration, port) -> dict:
+    sockets = []
+    for _ in range(rooms):
+        room = []
+        for _ in range(members):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.bind(("127.0.0.1", 0))
+            room.append(sock)
+        sockets.append(room)
+    addrs = [[sock.getsockname() for sock in room] for room in sockets]
+
+    context = multiprocessing.get_context("fork")
+    done, results = context.Event(), context.Queue()
+    process = context.Process(target=serve, args=(port, mode, addrs, done, results))
+    process.start()
+    time.sleep(0.5)
+
+    speakers = [room[0] for room in sockets]
+    target = ("127.0.0.1", port)
+    sent = 0
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for sock in speakers:
+            sock.sendto(PACKET, target)
+        sent += len(speakers)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.2)
+    done.set()
+    packets_in, cpu = results.get()
+    process.join()
+    for room in sockets:
+        for sock in room:
+            sock.close()
+
+    forwarded = packets_in * (members - 1)
+    return {
+        "mode": mode,
+        "sent": sent,
+        "received": packets_in,
+        "forwarded": forwarded,
+        "forwarded_per_second": forwarded / elapsed,
+        "forwarded_per_cpu_second": forwarded / cpu if cpu else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VoiceServer forwarding throughput")
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--mode", nargs="+", choices=("asyncio", "thread"), default=["asyncio", "thread"])
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'sent':>9} {'received':>9} {'fwd/s':>10} {'fwd/cpu-s':>10}")
+    for mode in args.mode:
+        r = run(mode, args.rooms, args.members, args.duration, args.port)
+        print(f"{r['mode']:>8} {r['sent']:>9} {r['received']:>9} "
+              f"{r['forwarded_per_second']:>10.0f} {r['forwarded_per_cpu_second']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# benchmarks/bench_voice_mix.py
+#
+# Forwarding vs mixing for one voice room: packets the server sends per
+# 20 ms tick, and the CPU time one mixing tick takes, by room size and
+# number of people talking at once.
+#
+#   python -m benchmarks.bench_voice_mix [--sizes 4 16 64 256] [--speakers 1 3]
+import argparse
+import time
+
+from networking.voice_mixer import RoomMixer, FRAME_SAMPLES, np
+
+
+def time_mix(members: int, speakers: int, ticks: int) -> float:
+    """Average seconds per tick"""
+    mixer = RoomMixer()
+    listeners = [("127.0.0.1", 10000 + i) for i in range(members)]
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(-8000, 8000, FRAME_SAMPLES, dtype=np.int16).tobytes() for _ in range(speakers)]
+    elapsed = 0.0
+    for _ in range(ticks):
+        for addr, frame in zip(listeners, frames):
+            mixer.push(addr, frame)
+        start = time.perf_counter()
+        mixer.mix()
+        elapsed += time.perf_counter() - start
+    return elapsed / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice room: forwarding vs mixing")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 16, 64, 256])
+    parser.add_argument("--speakers", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--ticks", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'members':>8} {'speakers':>9} {'fwd pkts/tick':>14} {'mix pkts/tick':>14} {'mix us/tick':>12}")
+    for members in args.sizes:
+        for speakers in args.speakers:
+            if speakers > members:
+                continue
+            forwarded = speakers * (members - 1)
+            mixed = members if speakers > 1 else members - 1
+            per_tick = time_mix(members, speakers, args.ticks)
+            print(f"{members:>8} {speakers:>9} {forwarded:>14} {mixed:>14} {per_tick * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_voice_vad.py
+#
+# Silence suppression in a voice room where one member talks at a time and
+# everyone else's microphone picks up background noise. Every member's
+# frames go through their own VAD, as on the client; the packets that
+# leave the clients are then run through VoiceServer.forward in process
+# (sends are only counted). Compares sending every frame against sending
+# only speech plus a silence marker a second.
+#
+#   python -m benchmarks.bench_voice_vad [--members 8 32] [--seconds 20]
+import argparse
+import time
+
+from audio.codecs import FRAME_SAMPLES, SAMPLE_RATE
+from audio.packet import FLAG_SILENT, pack
+from audio.vad import VoiceActivityDetector, np
+from networking.voice_server import VoiceServer
+
+KEEPALIVE_FRAMES = 50
+TURN_SECONDS = 4  # each member talks for this long, in turn
+
+
+def make_frames(members: int, ticks: int):
+    """frames[tick][member]: speech for the member whose turn it is, noise for the rest"""
+    rng = np.random.default_rng(0)
+    t = np.arange(FRAME_SAMPLES) / SAMPLE_RATE
+    turn_ticks = TURN_SECONDS * SAMPLE_RATE // FRAME_SAMPLES
+    frames = []
+    for tick in range(ticks):
+        speaker = tick // turn_ticks % members
+        row = []
+        for member in range(members):
+            samples = rng.normal(0, 60, FRAME_SAMPLES)
+            # Syllables: 200 ms of voiced sound, 100 ms pause
+            if member == speaker and tick % 15 < 10:
+                samples += 6000 * np.sin(2 * np.pi * (150 + 50 * (tick % 7)) * (t + tick * FRAME_SAMPLES / SAMPLE_RATE))
+            row.append(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+        frames.append(row)
+    return frames
+
+
+def client_packets(frames, vad: bool):
+    """Packets in send order: (member, datagram)"""
+    members = len(frames[0])
+    detectors = [VoiceActivityDetector() for _ in range(members)]
+    seqs, quiet = [0] * members, [0] * members
+    packets = []
+    for tick, row in enumerate(frames):
+        timestamp = tick * FRAME_SAMPLES
+        for member, pcm in enumerate(row):
+            if not vad or detectors[member].is_speech(pcm):
+                packets.append((member, pack(pcm, seqs[member], timestamp)))
+                seqs[member] += 1
+                quiet[member] = 0
+            else:
+                if quiet[member] % KEEPALIVE_FRAMES == 0:
+                    packets.append((member, pack(b"", seqs[member], timestamp, flags=FLAG_SILENT)))
+                quiet[member] += 1
+    return packets
+
+
+def run(members: int, seconds: float, vad: bool, frames) -> dict:
+    addrs = [("127.0.0.1", 20000 + i) for i in range(members)]
+    server = VoiceServer()
+    for i, addr in enumerate(addrs):
+        server.join("room", f"user-{i}", addr)
+    sent = [0, 0]  # packets, bytes
+
+    def sendto(data, addr):
+        sent[0] += 1
+        sent[1] += len(data)
+
+    server.sendto = sendto
+    start = time.perf_counter()
+    packets = client_packets(frames, vad)
+    vad_seconds = time.perf_counter() - start
+
+    forward = server.forward
+    start = time.process_time()
+    for member, data in packets:
+        forward(data, addrs[member])
+    cpu = time.process_time() - start
+    return {
+        "vad": vad,
+        "in_kbps": sum(len(data) for _, data in packets) * 8 / seconds / 1000,
+        "out_kbps": sent[1] * 8 / seconds / 1000,
+        "out_pps": sent[0] / seconds,
+        "server_cpu": cpu / seconds,
+        "vad_us": vad_seconds / len(frames) / members * 1e6 if vad else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice room bandwidth and server CPU with and without VAD")
+    parser.add_argument("--members", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--seconds", type=float, default=20.0)
+    args = parser.parse_args()
+
+    ticks = int(args.seconds * SAMPLE_RATE / FRAME_SAMPLES)
+    print(f"{'members':>8} {'vad':>5} {'in kbit/s':>10} {'out kbit/s':>11} {'out pkt/s':>10} "
+          f"{'server cpu':>11} {'vad us/frame':>13}")
+    for members in args.members:
+        frames = make_frames(members, ticks)
+        for vad in (False, True):
+            r = run(members, args.seconds, vad, frames)
+            print(f"{members:>8} {str(vad):>5} {r['in_kbps']:>10.0f} {r['out_kbps']:>11.0f} {r['out_pps']:>10.0f} "
+                  f"{r['server_cpu']:>10.1%} {r['vad_us']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+# benchmarks/loadgen.py
+#
+# End-to-end load test for EventServer. Simulated clients speak the real
+# protocol (HELLO, AUTH, SWITCH_CHANNEL) and then post, edit and react at
+# Poisson-distributed rates. Posts and edits carry their send time, so every
+# subscriber that receives one records a fan-out latency.
+#
+# By default a server is started in a subprocess with a temporary database
+# and cheap bcrypt hashes, so the numbers measure the chat path rather than
+# password hashing:
+#
+#   python -m benchmarks.loadgen --clients 2000 --channels 20 --duration 30 --output results.json
+#
+# To drive a server that is already running, start it in serve mode and
+# point the load generator at it (users load00000.. are created there):
+#
+#   python -m benchmarks.loadgen --serve --port 9765 --clients 2000 --channels 20
+#   python -m benchmarks.loadgen --connect 127.0.0.1:9765 --clients 2000
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+from networking.dispatch import EventRegistry, UnknownEvent, InvalidPayload
+from networking.protocol import LineFraming, ProtocolError, MAX_FRAME_SIZE, client_handshake
+
+PASSWORD = "load"
+STAMP_PREFIX = "lg:"
+
+sim_events = EventRegistry()
+
+
+def username(i: int) -> str:
+    return f"load{i:05d}"
+
+
+def raise_fd_limit():
+    # Thousands of sockets need more than the usual 1024 descriptors
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples) -> dict:
+    values = sorted(samples)
+    summary = {"count": len(values)}
+    for p in (50, 95, 99):
+        summary[f"p{p}_ms"] = percentile(values, p) * 1000 if values else None
+    summary["max_ms"] = values[-1] * 1000 if values else None
+    return summary
+
+
+# ---------------- SIMULATED CLIENT ----------------
+
+class Stats:
+    def __init__(self):
+        self.sent = {"post": 0, "edit": 0, "react": 0}
+        self.received = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.login_seconds: list[float] = []
+        self.fanout = {"post": [], "edit": []}  # seconds from send to receipt, per delivery
+        self.measuring = False
+
+
+class SimClient:
+    def __init__(self, index, host, port, stats: Stats, legacy=False):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.legacy = legacy
+        self.user_id = None
+        self.channel_id = None
+        self.recent_ids = deque(maxlen=50)  # messages seen in our channel, for reactions
+        self.own_ids = deque(maxlen=50)  # our own messages, for edits
+        self.authenticated = asyncio.Event()
+        self.switched = asyncio.Event()
+        self.reader_task = None
+        self.retry_task = None
+        self.closed = False
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=MAX_FRAME_SIZE)
+        if self.legacy:
+            self.framing = LineFraming()
+        else:
+            self.framing = await client_handshake(self.reader, self.writer)
+        self.reader_task = asyncio.create_task(self._read_loop())
+        self.send({"event": "AUTH", "payload": {"username": username(self.index), "password": PASSWORD}})
+        await self.authenticated.wait()
+        if self.channel_id is None:
+            raise RuntimeError("the server has no channels to join")
+        self.stats.login_seconds.append(time.perf_counter() - start)
+        self.send({"event": "SWITCH_CHANNEL", "payload": {"channel_id": self.channel_id}})
+        await self.switched.wait()
+
+    def send(self, message):
+        if not self.closed:
+            self.writer.write(self.framing.encode(message))
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message = await self.framing.read(self.reader)
+                if message is None:
+                    break
+                self.stats.received += 1
+                try:
+                    await sim_events.dispatch(self, message)
+                except (UnknownEvent, InvalidPayload):
+                    pass
+        except (ConnectionError, OSError, ProtocolError):
+            pass
+        if not self.closed:
+            self.stats.disconnects += 1
+            self.closed = True
+
+    # ---------------- INCOMING ----------------
+
+    @sim_events.on("AUTH_SUCCESS")
+    async def _on_auth_success(self, payload):
+        self.user_id = payload["user_id"]
+        channels = [ch["id"] for ch in payload.get("channels", [])]
+        if channels:
+            self.channel_id = channels[self.index % len(channels)]
+        self.authenticated.set()
+
+    @sim_events.on("AUTH_FAILED")
+    async def _on_auth_failed(self, payload):
+        self.stats.errors += 1
+        # Retried after a pause, as a real client would; the reader keeps going meanwhile
+        if self.retry_task is None or self.retry_task.done():
+            self.retry_task = asyncio.create_task(self._retry_auth())
+
+    async def _retry_auth(self):
+        await asyncio.sleep(random.uniform(0.5, 2.0))
+        self.send({"event": "AUTH", "payload": {"username": username(self.index), "password": PASSWORD}})
+
+    @sim_events.on("CHANNEL_SWITCHED")
+    async def _on_switched(self, payload):
+        self.switched.set()
+
+    @sim_events.on("ERROR")
+    async def _on_error(self, payload):
+        self.stats.errors += 1
+
+    @sim_events.on("MESSAGE_CREATE")
+    async def _on_message_create(self, payload):
+        message = payload["message"]
+        self.recent_ids.append(message["id"])
+        if message.get("author_id") == self.user_id:
+            self.own_ids.append(message["id"])
+        self._record("post", message.get("content", ""))
+
+    @sim_events.on("MESSAGE_EDIT")
+    async def _on_message_edit(self, payload):
+        self._record("edit", payload.get("content", ""))
+
+    def _record(self, kind, content):
+        if not self.stats.measuring or not content.startswith(STAMP_PREFIX):
+            return
+        sent_at = int(content[len(STAMP_PREFIX):content.index(":", len(STAMP_PREFIX))]) / 1e9
+        self.stats.fanout[kind].append(time.perf_counter() - sent_at)
+
+    # ---------------- OUTGOING ----------------
+
+    def _stamped(self, size):
+        stamp = f"{STAMP_PREFIX}{time.perf_counter_ns()}:"
+        return stamp + "x" * max(0, size - len(stamp))
+
+    async def run(self, duration, rates, message_size):
+        """Issue actions until duration elapses; rates are per-client events/second"""
+        total_rate = sum(rates.values())
+        if total_rate <= 0:
+            await asyncio.sleep(duration)
+            return
+        kinds, weights = zip(*rates.items())
+        deadline = time.perf_counter() + duration
+        # Desynchronise clients so they do not all fire on the same tick
+        await asyncio.sleep(random.uniform(0, 1 / total_rate))
+        while not self.closed:
+            delay = random.expovariate(total_rate)
+            if time.perf_counter() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+            kind = random.choices(kinds, weights)[0]
+            if kind == "edit" and not self.own_ids or kind == "react" and not self.recent_ids:
+                kind = "post"
+
+            if kind == "post":
+                payload = {"channel_id": self.channel_id, "content": self._stamped(message_size)}
+                self.send({"event": "MESSAGE_CREATE", "payload": payload})
+            elif kind == "edit":
+                payload = {"channel_id": self.channel_id, "message_id": random.choice(self.own_ids),
+                           "content": self._stamped(message_size)}
+                self.send({"event": "MESSAGE_EDIT", "payload": payload})
+            else:
+                payload = {"channel_id": self.channel_id, "message_id": random.choice(self.recent_ids),
+                           "emoji": random.choice("👍🎉❤😂")}
+                self.send({"event": "MESSAGE_REACT", "payload": payload})
+            self.stats.sent[kind] += 1
+            await self.writer.drain()
+
+    async def close(self):
+        self.closed = True
+        for task in (self.reader_task, self.retry_task):
+            if task:
+                task.cancel()
+        self.writer.close()
+
+
+# ---------------- LOAD RUN ----------------
+
+async def run_load(args, host, port) -> dict:
+    stats = Stats()
+    clients = [SimClient(i, host, port, stats, args.legacy) for i in range(args.clients)]
+
+    # Bounded so the server's accept backlog is not overrun
+    gate = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client):
+        async with gate:
+            await asyncio.wait_for(client.connect(), args.connect_timeout)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(connect(c) for c in clients), return_exceptions=True)
+    ramp_seconds = time.perf_counter() - start
+    ready = [c for c, r in zip(clients, results) if r is None]
+    print(f"[loadgen] {len(ready)}/{len(clients)} clients ready in {ramp_seconds:.1f}s")
+
+    rates = {"post": args.post_rate, "edit": args.edit_rate, "react": args.react_rate}
+    received_before = stats.received
+    stats.measuring = True
+    start = time.perf_counter()
+    await asyncio.gather(*(c.run(args.duration, rates, args.message_size) for c in ready))
+    # Let in-flight deliveries land before stopping the clock
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+    stats.measuring = False
+
+    for client in clients:
+        if hasattr(client, "writer"):
+            await client.close()
+
+    sent = sum(stats.sent.values())
+    return {
+        "clients": {"requested": args.clients, "ready": len(ready), "ramp_seconds": ramp_seconds},
+        "login": summarize(stats.login_seconds),
+        "sent": dict(stats.sent),
+        "throughput": {
+            "sent_per_second": sent / elapsed,
+            "delivered_per_second": (stats.received - received_before) / elapsed,
+        },
+        "fanout": {kind: summarize(samples) for kind, samples in stats.fanout.items()},
+        "errors": stats.errors,
+        "disconnects": stats.disconnects,
+        "elapsed_seconds": elapsed,
+    }
+
+
+# ---------------- SERVER ----------------
+
+def serve(args):
+    import bcrypt
+    from auth.auth_manager import AuthManager
+    from core.enums import ChannelType
+    from core.models.channel import Channel
+    from core.models.server import Server
+    from core.models.user import User
+    from networking.bus import new_secret
+    from networking.cluster import default_bus_path, start_workers, watch_workers
+    from networking.event_server import EventServer
+    from persistence.database import Database
+
+    raise_fd_limit()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="loadgen-"), "load.db")
+    auth = AuthManager(max_pending=args.clients + 16)
+    community = Server("Load Test")
+    # One cheap hash shared by every user: logins still go through bcrypt, quickly
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+    for i in range(args.clients):
+        community.add_member(User(username(i), password_hash))
+    db = Database(db_path)
+    for i in range(args.channels):
+        channel = Channel(f"load-{i}", ChannelType.TEXT)
+        community.add_channel(channel)
+        db.save_channel(community.id, channel)
+    db.close()
+
+    options = dict(
+        host=args.host, port=args.port, db_path=db_path, metrics_port=args.metrics_port,
+        # Every simulated client logs in from the same address
+        login_rate=args.clients, login_burst=args.clients * 2
+    )
+    print(f"[loadgen] serving {args.clients} users, {args.channels} channels on {args.host}:{args.port} "
+          f"with {args.workers} worker(s) (db {db_path})", flush=True)
+    if args.workers > 1:
+        bus_path, bus_secret = default_bus_path(), new_secret()
+        processes = start_workers(args.workers, auth, community, bus_path, bus_secret, **options)
+        asyncio.run(watch_workers(processes, bus_path, bus_secret))
+    else:
+        asyncio.run(EventServer(auth=auth, community=community, **options).start())
+
+
+async def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def main_async(args):
+    raise_fd_limit()
+    server_proc = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", args.port
+        server_proc = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.loadgen", "--serve", "--host", host, "--port", str(port),
+            "--clients", str(args.clients), "--channels", str(args.channels), "--workers", str(args.workers),
+            *(["--metrics-port", str(args.metrics_port)] if args.metrics_port else []),
+        ])
+        await wait_for_port(host, port, timeout=60)
+
+    try:
+        results = await run_load(args, host, port)
+    finally:
+        if server_proc:
+            server_proc.terminate()
+            server_proc.wait()
+
+    results["config"] = {
+        key: getattr(args, key) for key in (
+            "clients", "channels", "duration", "post_rate", "edit_rate", "react_rate", "message_size", "legacy",
+            "workers"
+        )
+    }
+    results["environment"] = {"python": platform.python_version(), "platform": platform.platform()}
+    results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return results
+
+
+def print_report(results):
+    print(f"sent/s {results['throughput']['sent_per_second']:.0f}   "
+          f"delivered/s {results['throughput']['delivered_per_second']:.0f}   "
+          f"errors {results['errors']}   disconnects {results['disconnects']}")
+    print(f"{'fan-out':>10} {'count':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for kind, s in [*results["fanout"].items(), ("login", results["login"])]:
+        if s["count"]:
+            print(f"{kind:>10} {s['count']:>10} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} "
+                  f"{s['p99_ms']:>10.2f} {s['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EventServer load generator")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load after all clients are in")
+    parser.add_argument("--post-rate", type=float, default=0.2, help="posts per client per second")
+    parser.add_argument("--edit-rate", type=float, default=0.02, help="edits per client per second")
+    parser.add_argument("--react-rate", type=float, default=0.05, help="reactions per client per second")
+    parser.add_argument("--message-size", type=int, default=64, help="bytes of content per post/edit")
+    parser.add_argument("--legacy", action="store_true", help="JSON lines instead of negotiated framing")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--connect-timeout", type=float, default=60.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight deliveries")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="use a running server instead of spawning one")
+    parser.add_argument("--serve", action="store_true", help="only run the load-test server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9765)
+    parser.add_argument("--metrics-port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (see networking/cluster.py)")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    results = asyncio.run(main_async(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[loadgen] results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+# benchmarks/microbench.py
+#
+# Microbenchmarks for the persistence layer, ChannelController lookups and
+# the domain models, run against synthetic datasets of a given number of
+# messages. Results can be saved as a baseline and later runs compared
+# against it, so a regression shows up as a percentage.
+#
+#   python -m benchmarks.microbench                                  # 10k, 100k
+#   python -m benchmarks.microbench --sizes 10000 1000000 10000000   # ~10 GB RAM at 10M
+#   python -m benchmarks.microbench --save-baseline                  # benchmarks/baselines/micro.json
+#   python -m benchmarks.microbench --compare --fail-on-regression
+#
+# Datasets are deterministic for a given --seed. The database side is built
+# with bulk inserts (not timed); the in-memory side with the real models.
+# Benchmarks leave the shared dataset as they found it (writes go to a scratch
+# channel that is emptied afterwards, edits to copies of the messages) and
+# draw from their own random stream, so a result does not depend on which
+# benchmarks ran before it.
+import argparse
+import asyncio
+import copy
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from core.controllers.channel_controller import ChannelController
+from core.enums import ChannelType
+from core.models.channel import Channel
+from core.models.message import Message
+from core.models.server import Server
+from persistence.async_database import AsyncDatabase
+from persistence.database import Database
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+MESSAGES_PER_CHANNEL = 1000  # small channels around the one big channel
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do",
+         "eiusmod", "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua")
+
+BENCHMARKS = {}  # name -> fn(dataset, ops) -> (elapsed seconds, operations)
+
+
+def bench(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+# ---------------- DATASET ----------------
+
+class Dataset:
+    """
+    size messages: half in one big channel, the rest in channels of
+    MESSAGES_PER_CHANNEL. Built once per size and shared by every benchmark.
+    """
+
+    def __init__(self, size, workdir, seed):
+        self.size = size
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.server_id = "bench-server"
+        self.big_channel_id = "big"
+        self.scratch_channel_id = "scratch"  # written to by benchmarks, empty between them
+        self.big_size = size // 2
+        small_count = max(1, (size - self.big_size) // MESSAGES_PER_CHANNEL)
+        self.small_channel_ids = [f"small-{i}" for i in range(small_count)]
+        self.path = os.path.join(workdir, f"bench-{size}.db")
+        self._memory = None
+        self._build_db()
+
+    def content(self):
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(3, 30)))
+
+    def _rows(self, channel_id, count, start):
+        for i in range(start, start + count):
+            yield (f"m{i:09d}", channel_id, f"user-{i % 500}", 1_700_000_000 + i, self.content(), "{}")
+
+    def _build_db(self):
+        db = Database(self.path, synchronous="OFF")
+        with db.conn:
+            db.conn.executemany("INSERT INTO channels VALUES (?, ?, ?, ?)", [
+                (ch_id, self.server_id, ch_id, "TEXT") for ch_id in [self.big_channel_id, *self.small_channel_ids]
+            ])
+            db.conn.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(self.big_channel_id, self.big_size, 0)
+            )
+            per_small = (self.size - self.big_size) // len(self.small_channel_ids)
+            for n, ch_id in enumerate(self.small_channel_ids):
+                db.conn.executemany(
+                    "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                    self._rows(ch_id, per_small, self.big_size + n * per_small)
+                )
+        db.close()
+
+    def fill_scratch(self):
+        """Give the scratch channel MESSAGES_PER_CHANNEL messages, like a small channel"""
+        db = Database(self.path, synchronous="OFF")
+        with db.conn:
+            db.conn.execute("INSERT INTO channels VALUES (?, ?, ?, ?)",
+                            (self.scratch_channel_id, self.server_id, self.scratch_channel_id, "TEXT"))
+            db.conn.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(self.scratch_channel_id, MESSAGES_PER_CHANNEL, self.size)
+            )
+        db.close()
+
+    def clear_scratch(self):
+        db = Database(self.path, synchronous="OFF")
+        with db.conn:
+            db.conn.execute("DELETE FROM channels WHERE id=?", (self.scratch_channel_id,))
+            db.conn.execute("DELETE FROM messages WHERE channel_id=?", (self.scratch_channel_id,))
+        db.close()
+
+    def memory(self):
+        """(server, channel with size messages), built with the real models"""
+        if self._memory is None:
+            rng, self.rng = self.rng, random.Random(self.seed)
+            server = Server("bench")
+            channel = Channel("big", ChannelType.TEXT)
+            channel.set_messages([Message(f"user-{i % 500}", self.content()) for i in range(self.size)])
+            server.add_channel(channel)
+            self._memory = (server, channel)
+            self.rng = rng
+        return self._memory
+
+    def memory_copy(self):
+        """A channel with copies of the in-memory messages, for benchmarks that change them"""
+        _, source = self.memory()
+        server = Server("bench")
+        channel = Channel("big", ChannelType.TEXT)
+        messages = []
+        for msg in source.messages:
+            clone = copy.copy(msg)
+            clone.reactions = {}
+            messages.append(clone)
+        channel.set_messages(messages)
+        server.add_channel(channel)
+        return server, channel
+
+    def close(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+def new_messages(ds, ops):
+    return [Message(f"user-{i % 500}", ds.content()) for i in range(ops)]
+
+
+# ---------------- PERSISTENCE ----------------
+
+@bench("db.save_message")
+def bench_save_message(ds, ops):
+    # One commit per message, as with write_behind=False
+    db = Database(ds.path)
+    messages = new_messages(ds, ops)
+    start = time.perf_counter()
+    for msg in messages:
+        db.save_message(ds.scratch_channel_id, msg)
+    elapsed = time.perf_counter() - start
+    db.close()
+    ds.clear_scratch()
+    return elapsed, ops
+
+
+@bench("db.save_message.write_behind")
+def bench_save_message_write_behind(ds, ops):
+    db = Database(ds.path, write_behind=True, flush_interval=3600)
+    messages = new_messages(ds, ops)
+    start = time.perf_counter()
+    for msg in messages:
+        db.save_message(ds.scratch_channel_id, msg)
+    db.flush()
+    elapsed = time.perf_counter() - start
+    db.close()
+    ds.clear_scratch()
+    return elapsed, ops
+
+
+@bench("db.load_messages")
+def bench_load_messages(ds, ops):
+    db = Database(ds.path)
+    start = time.perf_counter()
+    rows = db.load_messages(ds.big_channel_id)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed, len(rows)
+
+
+@bench("db.load_message_page")
+def bench_load_message_page(ds, ops):
+    db = Database(ds.path)
+    cursors = [f"m{ds.rng.randrange(1, ds.big_size):09d}" for _ in range(ops)]
+    start = time.perf_counter()
+    for before in cursors:
+        db.load_message_page(ds.big_channel_id, before=before, limit=50)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed, ops
+
+
+@bench("db.load_channels")
+def bench_load_channels(ds, ops):
+    db = Database(ds.path)
+    start = time.perf_counter()
+    rows = db.load_channels(ds.server_id)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed, len(rows)
+
+
+@bench("db.delete_channel")
+def bench_delete_channel(ds, ops):
+    # Deletes a channel of MESSAGES_PER_CHANNEL messages, refilled every repeat
+    ds.fill_scratch()
+    db = Database(ds.path)
+    start = time.perf_counter()
+    db.delete_channel(ds.scratch_channel_id)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed, 1
+
+
+# ---------------- CONTROLLER ----------------
+
+def _controller_bench(ds, ops, action):
+    server, channel = ds.memory_copy()
+    ids = [ds.rng.choice(channel.messages).id for _ in range(ops)]
+
+    async def run():
+        db = AsyncDatabase(":memory:", write_behind=True, flush_interval=3600)
+        controller = ChannelController(server, db, max_cached_messages=ds.size + ops)
+        await controller.ensure_loaded(channel)
+        start = time.perf_counter()
+        for message_id in ids:
+            await action(controller, channel.id, message_id)
+        elapsed = time.perf_counter() - start
+        await db.close()
+        return elapsed
+
+    return asyncio.run(run()), ops
+
+
+@bench("controller.edit_message")
+def bench_edit_message(ds, ops):
+    return _controller_bench(ds, ops, lambda c, ch, m: c.edit_message(ch, m, "edited"))
+
+
+@bench("controller.add_reaction")
+def bench_add_reaction(ds, ops):
+    return _controller_bench(ds, ops, lambda c, ch, m: c.add_reaction(ch, m, "user-1", "+1"))
+
+
+@bench("channel.get_message")
+def bench_get_message(ds, ops):
+    _, channel = ds.memory()
+    ids = [ds.rng.choice(channel.messages).id for _ in range(ops)]
+    start = time.perf_counter()
+    for message_id in ids:
+        channel.get_message(message_id)
+    return time.perf_counter() - start, ops
+
+
+# ---------------- MODELS ----------------
+
+@bench("model.message_init")
+def bench_message_init(ds, ops):
+    contents = [ds.content() for _ in range(ds.size)]
+    start = time.perf_counter()
+    for content in contents:
+        Message("user-1", content)
+    return time.perf_counter() - start, ds.size
+
+
+@bench("model.channel_set_messages")
+def bench_channel_set_messages(ds, ops):
+    _, source = ds.memory()
+    channel = Channel("copy", ChannelType.TEXT)
+    start = time.perf_counter()
+    channel.set_messages(source.messages)
+    return time.perf_counter() - start, ds.size
+
+
+@bench("model.channel_add_message")
+def bench_channel_add_message(ds, ops):
+    _, source = ds.memory()
+    channel = Channel("copy", ChannelType.TEXT)
+    start = time.perf_counter()
+    for msg in source.messages:
+        channel.add_message(msg)
+    return time.perf_counter() - start, ds.size
+
+
+@bench("model.message_to_json")
+def bench_message_to_json(ds, ops):
+    _, channel = ds.memory()
+    start = time.perf_counter()
+    for msg in channel.messages:
+        json.dumps(msg.to_dict())
+    return time.perf_counter() - start, ds.size
+
+
+@bench("model.message_from_json")
+def bench_message_from_json(ds, ops):
+    _, channel = ds.memory()
+    encoded = [json.dumps(msg.to_dict()) for msg in channel.messages]
+    start = time.perf_counter()
+    for data in encoded:
+        Message.from_dict(json.loads(data))
+    return time.perf_counter() - start, ds.size
+
+
+# ---------------- RUN / COMPARE ----------------
+
+def run(args) -> dict:
+    selected = [name for name in BENCHMARKS if not args.only or any(name.startswith(p) for p in args.only)]
+    results = {name: {} for name in selected}
+    with tempfile.TemporaryDirectory(prefix="microbench-") as workdir:
+        for size in args.sizes:
+            print(f"[microbench] building dataset of {size} messages")
+            ds = Dataset(size, workdir, args.seed)
+            try:
+                for name in selected:
+                    per_op = []
+                    for repeat in range(args.repeat):
+                        ds.rng = random.Random(f"{args.seed}/{name}/{repeat}")
+                        # As timeit does: collector pauses are noise at this scale
+                        gc.collect()
+                        gc.disable()
+                        try:
+                            elapsed, count = BENCHMARKS[name](ds, args.ops)
+                        finally:
+                            gc.enable()
+                        per_op.append(elapsed / max(count, 1))
+                    results[name][str(size)] = {
+                        "best_us": min(per_op) * 1e6,
+                        "median_us": statistics.median(per_op) * 1e6,
+                        "ops": count,
+                    }
+                    print(f"{name:>32} {size:>10} {min(per_op) * 1e6:>12.3f} us/op")
+            finally:
+                ds.close()
+    return {
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"sizes": args.sizes, "ops": args.ops, "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold) -> int:
+    """Print per-benchmark change against the baseline; returns the number of regressions"""
+    regressions = 0
+    print(f"{'benchmark':>32} {'size':>10} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, by_size in current["results"].items():
+        for size, result in by_size.items():
+            base = baseline.get("results", {}).get(name, {}).get(size)
+            if not base:
+                continue
+            # Best-of-N is the least noisy figure for a microbenchmark
+            change = result["best_us"] / base["best_us"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            elif change < -threshold:
+                flag = "  faster"
+            print(f"{name:>32} {size:>10} {base['best_us']:>12.3f} {result['best_us']:>12.3f} "
+                  f"{change * 100:>+8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistence, controller and model microbenchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                        help="dataset sizes in messages (10k .. 10M)")
+    parser.add_argument("--ops", type=int, default=2000, help="operations per repeat for per-op benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="+", help="benchmark name prefixes, e.g. db. model.")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, metavar="PATH")
+    parser.add_argument("--threshold", type=float, default=0.20, help="relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[microbench] results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
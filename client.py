@@ -1,15 +1,18 @@
 import asyncio
-import json
-import socket
-import pyaudio
 import threading
+from networking.protocol import LineFraming, ProtocolError, MAX_FRAME_SIZE, client_handshake
+from networking.dispatch import EventRegistry, UnknownEvent, InvalidPayload, Field
+from audio.codecs import CODECS
+from audio.engine import VoiceEngine
 
-CHUNK = 960
-RATE = 48000
-CHANNELS = 1
-FORMAT = pyaudio.paInt16
 SERVER_HOST = "127.0.0.1"
 SERVER_PORT = 8765
+VOICE_PORT = 5000
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+# Server -> client events, registered on ClientController below
+client_events = EventRegistry()
 
 class ClientController:
     def __init__(self, username=None, password=None):
@@ -17,6 +20,8 @@ class ClientController:
         self.password = password
         self.user_id = None
         self.token = None
+        self.last_seq = 0  # sequence number of the last broadcast seen, for RESUME
+        self.framing = LineFraming()  # upgraded by the HELLO handshake on connect
         self.channel_id = None
         self.connected = False
         self.message_callback = None
@@ -24,12 +29,7 @@ class ClientController:
 
         self.loop = asyncio.new_event_loop()
         self.client_task = None
-        self.voice_task = None
-        self.voice_sock = None
-        self.audio = None
-        self.stream_in = None
-        self.stream_out = None
-        self.voice_running = False
+        self.voice = None  # VoiceEngine while in a voice channel
 
         self.muted = False
         self.deafened = False
@@ -75,11 +75,20 @@ class ClientController:
         asyncio.run_coroutine_threadsafe(self.switch_channel(channel_id), self.loop)
 
 
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(SERVER_HOST, SERVER_PORT, limit=MAX_FRAME_SIZE)
+        self.framing = await client_handshake(self.reader, self.writer)
+
     async def _connect(self):
-        self.reader, self.writer = await asyncio.open_connection(SERVER_HOST, SERVER_PORT)
+        await self._open()
         self.client_task = asyncio.create_task(self._listen_forever())
 
         # Send auth AFTER listener starts
+        await self._send_auth()
+
+        self.connected = True
+
+    async def _send_auth(self):
         await self._send({
             "event": "AUTH",
             "payload": {
@@ -88,89 +97,222 @@ class ClientController:
             }
         })
 
-        self.connected = True
+    async def _reconnect(self) -> bool:
+        """Reopen the connection and resume the session; False once shut down"""
+        delay = RECONNECT_MIN_DELAY
+        while self.connected:
+            try:
+                await self._open()
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            if self.token:
+                # The server replays only the broadcasts after last_seq
+                await self._send({
+                    "event": "RESUME",
+                    "payload": {
+                        "token": self.token,
+                        "last_seq": self.last_seq,
+                        "channels": [self.channel_id] if self.channel_id else []
+                    }
+                })
+            else:
+                await self._send_auth()
+            return True
+        return False
 
     async def _send_message(self, channel_id, content):
         msg = {"event": "MESSAGE_CREATE", "payload": {"channel_id": channel_id, "content": content}}
         await self._send(msg)
 
     async def _send(self, message):
-        self.writer.write((json.dumps(message) + "\n").encode())
+        self.writer.write(self.framing.encode(message))
         await self.writer.drain()
 
     async def _receive(self):
-        line = await self.reader.readline()
-        if not line:
-            return {}
-        return json.loads(line.decode())
+        """Next event, or None when the connection is gone"""
+        try:
+            return await self.framing.read(self.reader)
+        except (ConnectionError, OSError, ProtocolError):
+            return None
 
     async def _listen_forever(self):
         while True:
             msg = await self._receive()
+            if msg is None:
+                if not await self._reconnect():
+                    break
+                continue
             if not msg:
                 continue
 
-            event = msg.get("event")
-            payload = msg.get("payload", {})
-
-            # ---------------- AUTH SUCCESS ----------------
-            if event == "AUTH_SUCCESS":
-                self.token = payload["token"]
-                self.user_id = payload["user_id"]
-
-                # Send initial channel list to GUI
-                if self.channel_callback:
-                    self.channel_callback({
-                        "type": "INIT_CHANNELS",
-                        "channels": payload.get("channels", [])
-                    })
-
-            # ---------------- CHANNEL CREATE ----------------
-            elif event == "CHANNEL_CREATE":
-                if self.channel_callback:
-                    self.channel_callback({
-                        "type": "CHANNEL_CREATE",
-                        "channel": payload
-                    })
-
-            # ---------------- CHANNEL DELETE ----------------
-            elif event == "CHANNEL_DELETE":
-                if self.channel_callback:
-                    self.channel_callback({
-                        "type": "CHANNEL_DELETE",
-                        "channel_id": payload["channel_id"]
-                    })
-
-            # ---------------- CHANNEL UPDATE ----------------
-            elif event == "CHANNEL_UPDATE":
-                if self.channel_callback:
-                    self.channel_callback({
-                        "type": "CHANNEL_UPDATE",
-                        "channel_id": payload["channel_id"],
-                        "name": payload["name"]
-                    })
-
-            # ---------------- MESSAGE ----------------
-            elif event == "MESSAGE_CREATE":
-                m = payload["message"]
-                channel_id = payload["channel_id"]
-
-                if self.channel_callback:
-                    self.channel_callback({
-                        "type": "MESSAGE_APPEND",
-                        "channel_id": channel_id,
-                        "message": m
-                    })
-
-                if channel_id == self.channel_id and self.message_callback:
-                    self.message_callback(
-                        m.get("author_id", "unknown"),
-                        m.get("content", "")
-                    )
-
-
-            elif event == "CHANNEL_SWITCHED":
-                self.channel_id = payload["channel_id"]
+            if "seq" in msg:
+                self.last_seq = msg["seq"]
+            try:
+                await client_events.dispatch(self, msg)
+            except UnknownEvent:
+                # Events this client has no use for (yet) are skipped
+                pass
+            except InvalidPayload as e:
+                print(f"[Client] ignored malformed event: {e}")
+
+    # ---------------- AUTH SUCCESS ----------------
+    @client_events.on("AUTH_SUCCESS", {
+        "token": Field(str),
+        "user_id": Field(str),
+        "seq": Field(int, required=False),
+        "channels": Field(list, required=False)
+    })
+    async def _on_auth_success(self, payload):
+        # A second AUTH_SUCCESS means we re-logged in after a failed resume
+        resync = self.user_id is not None
+        self.token = payload["token"]
+        self.user_id = payload["user_id"]
+        self.last_seq = payload.get("seq", 0)
+
+        # Send initial channel list to GUI
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "INIT_CHANNELS",
+                "channels": payload.get("channels", []),
+                "resync": resync
+            })
+        if resync and self.voice:
+            await self._send_voice_join()
+
+    # ---------------- RESUME ----------------
+    @client_events.on("RESUMED", {"seq": Field(int, required=False), "channels": Field(list, required=False)})
+    async def _on_resumed(self, payload):
+        # Missed events follow as normal messages unless the gap was too old
+        if payload.get("full"):
+            self.last_seq = payload.get("seq", 0)
+            if self.channel_callback:
+                self.channel_callback({
+                    "type": "INIT_CHANNELS",
+                    "channels": payload.get("channels", []),
+                    "resync": True
+                })
+        # The server dropped us from voice with the old connection
+        if self.voice:
+            await self._send_voice_join()
+
+    @client_events.on("RESUME_FAILED")
+    async def _on_resume_failed(self, payload):
+        self.token = None
+        await self._send_auth()
+
+    @client_events.on("AUTH_FAILED")
+    async def _on_auth_failed(self, payload):
+        print(f"[Client] login failed: {payload.get('reason')}")
+
+    @client_events.on("ERROR")
+    async def _on_error(self, payload):
+        print(f"[Client] server rejected {payload.get('event')}: {payload.get('reason')}")
+
+    @client_events.on("HELLO_ACK")
+    async def _on_hello_ack(self, payload):
+        # Normally consumed by client_handshake; a late one is harmless
+        pass
+
+    @client_events.on("VOICE_JOINED", {"channel_id": Field(str), "codec": Field(str)})
+    async def _on_voice_joined(self, payload):
+        codec = payload["codec"]
+        if self.voice:
+            if codec in CODECS:
+                self.voice.set_codec(codec)
+            # Tell the voice server where to send, under our session token
+            self.voice.hello(self.token)
+        print(f"[Client] Voice codec: {codec}")
+
+    @client_events.on("VOICE_EVICTED", {"channel_id": Field(str)})
+    async def _on_voice_evicted(self, payload):
+        # The voice server stopped hearing from us (a roam, a long sleep): join again
+        if self.voice:
+            print("[Client] Dropped from voice, rejoining")
+            await self._send_voice_join()
+
+    # ---------------- CHANNEL CREATE ----------------
+    @client_events.on("CHANNEL_CREATE", {"id": Field(str), "name": Field(str), "type": Field(str)})
+    async def _on_channel_create(self, payload):
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "CHANNEL_CREATE",
+                "channel": payload
+            })
+
+    # ---------------- CHANNEL DELETE ----------------
+    @client_events.on("CHANNEL_DELETE", {"channel_id": Field(str)})
+    async def _on_channel_delete(self, payload):
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "CHANNEL_DELETE",
+                "channel_id": payload["channel_id"]
+            })
+
+    # ---------------- CHANNEL UPDATE ----------------
+    @client_events.on("CHANNEL_UPDATE", {"channel_id": Field(str), "name": Field(str)})
+    async def _on_channel_update(self, payload):
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "CHANNEL_UPDATE",
+                "channel_id": payload["channel_id"],
+                "name": payload["name"]
+            })
+
+    # ---------------- MESSAGE ----------------
+    @client_events.on("MESSAGE_CREATE", {"channel_id": Field(str), "message": Field(dict)})
+    async def _on_message_create(self, payload):
+        m = payload["message"]
+        channel_id = payload["channel_id"]
+
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "MESSAGE_APPEND",
+                "channel_id": channel_id,
+                "message": m
+            })
+
+        if channel_id == self.channel_id and self.message_callback:
+            self.message_callback(
+                m.get("author_id", "unknown"),
+                m.get("content", "")
+            )
+
+    @client_events.on("CHANNEL_SWITCHED", {"channel_id": Field(str)})
+    async def _on_channel_switched(self, payload):
+        self.channel_id = payload["channel_id"]
+
+    # ---------------- UNREAD ----------------
+    # Activity in a channel we are not subscribed to; its events are not sent to us
+    @client_events.on("CHANNEL_UNREAD", {"channel_id": Field(str)})
+    async def _on_channel_unread(self, payload):
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "CHANNEL_UNREAD",
+                "channel_id": payload["channel_id"]
+            })
+
+    # ---------------- HISTORY PAGE ----------------
+    @client_events.on("HISTORY_PAGE", {"channel_id": Field(str), "messages": Field(list, required=False)})
+    async def _on_history_page(self, payload):
+        if self.channel_callback:
+            self.channel_callback({
+                "type": "HISTORY_PAGE",
+                "channel_id": payload["channel_id"],
+                "messages": payload.get("messages", []),
+                "has_more": payload.get("has_more", False),
+                "before": payload.get("before"),
+                "after": payload.get("after")
+            })
+
+    async def fetch_history(self, channel_id, before=None, after=None, limit=50):
+        """Request one page of history; before/after are message id cursors"""
+        await self._send({
+            "event": "HISTORY_FETCH",
+            "payload": {"channel_id": channel_id, "before": before, "after": after, "limit": limit}
+        })
 
     async def edit_message(self, channel_id, message_id, new_content):
         await self._send({
@@ -196,70 +338,53 @@ class ClientController:
             "payload": {"channel_id": channel_id, "message_id": message_id, "emoji": emoji}
         })
     # ------------------ Voice ------------------
-    def start_voice(self, udp_port=6000):
-        if self.voice_running:
+    def start_voice(self, udp_port=0):
+        if self.voice:
             return
-        self.voice_running = True
-        self.voice_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.voice_sock.bind(("", udp_port))
-        # Notify server we joined voice
-        asyncio.run_coroutine_threadsafe(
-            self._send({
-                "event": "VOICE_JOIN",
-                "payload": {
-                    "channel_id": self.channel_id,
-                    "udp_port": udp_port
-                }
-            }),
-            self.loop
-        )
-        self.audio = pyaudio.PyAudio()
-        self.stream_in = self.audio.open(
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RATE,
-            input=True,
-            frames_per_buffer=CHUNK,
-            input_device_index=self.input_device_index
-        )
-
-        self.stream_out = self.audio.open(
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RATE,
-            output=True,
-            frames_per_buffer=CHUNK,
+        self.voice = VoiceEngine(
+            self.loop,
+            (SERVER_HOST, VOICE_PORT),
+            input_device_index=self.input_device_index,
             output_device_index=self.output_device_index
         )
-        self.voice_task = threading.Thread(target=self._voice_loop, daemon=True)
-        self.voice_task.start()
-
-    def _voice_loop(self):
-        while self.voice_running:
-            try:
-                if not self.muted:
-                    data = self.stream_in.read(CHUNK, exception_on_overflow=False)
-                    self.voice_sock.sendto(data, (SERVER_HOST, 5000))
-
-                if not self.deafened:
-                    self.voice_sock.settimeout(0.01)
-                    try:
-                        data, _ = self.voice_sock.recvfrom(4096)
-                        self.stream_out.write(data)
-                    except socket.timeout:
-                        continue
+        self.voice.muted = self.muted
+        self.voice.deafened = self.deafened
+        asyncio.run_coroutine_threadsafe(self._start_voice(self.voice, udp_port), self.loop)
+
+    async def _start_voice(self, voice, udp_port):
+        try:
+            await voice.start(udp_port)
+        except Exception as e:
+            print(f"[Voice Error] {e}")
+            if self.voice is voice:
+                self.voice = None
+            return
+        await self._send_voice_join()
 
-            except Exception as e:
-                print(f"[Voice Error] {e}")
+    async def _send_voice_join(self):
+        # The server answers VOICE_JOINED with the codec to use
+        await self._send({
+            "event": "VOICE_JOIN",
+            "payload": {
+                "channel_id": self.channel_id,
+                "codecs": list(CODECS)
+            }
+        })
 
     def toggle_mute(self):
         self.muted = not self.muted
+        if self.voice:
+            self.voice.muted = self.muted
 
     def toggle_deafen(self):
         self.deafened = not self.deafened
+        if self.voice:
+            self.voice.deafened = self.deafened
 
     def stop_voice(self):
-        self.voice_running = False
+        voice, self.voice = self.voice, None
+        if voice is None:
+            return
         if self.channel_id:
             asyncio.run_coroutine_threadsafe(
                 self._send({
@@ -268,21 +393,13 @@ class ClientController:
                 }),
                 self.loop
             )
-        if self.stream_in:
-            self.stream_in.stop_stream()
-            self.stream_in.close()
-        if self.stream_out:
-            self.stream_out.stop_stream()
-            self.stream_out.close()
-        if self.audio:
-            self.audio.terminate()
-        if self.voice_sock:
-            self.voice_sock.close()
+        voice.stop()
 
     # ------------------ Shutdown ------------------
     def shutdown(self):
         self.stop_voice()
         if self.connected:
-            self.writer.close()
+            # Cleared first so the listener does not try to reconnect
             self.connected = False
+            self.writer.close()
 
@@ -1,32 +1,57 @@
+import asyncio
+from collections import OrderedDict
 from core.models.channel import Channel
 from core.models.message import Message
 from core.enums import ChannelType
-from persistence.database import Database
+from persistence.async_database import AsyncDatabase
 
 
 class ChannelController:
-    def __init__(self, server, db: Database):
+    def __init__(self, server, db: AsyncDatabase, max_cached_messages: int = 100_000):
         self.server = server
         self.db = db
+        # Channel histories are loaded on first access and evicted least-recently-used
+        # first once more than max_cached_messages are held in memory
+        self.max_cached_messages = max_cached_messages
+        self.cached_messages = 0
+        self._hot_channels: OrderedDict[str, Channel] = OrderedDict()
+        self._loading: dict[str, asyncio.Task] = {}  # channel_id -> history load in flight
 
-    def create_channel(self, name: str, channel_type: ChannelType) -> Channel:
+    async def create_channel(self, name: str, channel_type: ChannelType) -> Channel:
         channel = Channel(name, channel_type)
         self.server.add_channel(channel)
-        self.db.save_channel(self.server.id, channel)
+        await self.db.save_channel(self.server.id, channel)
         return channel
 
-    def delete_channel(self, channel_id: str) -> bool:
-        if channel_id in self.server.channels:
-            del self.server.channels[channel_id]
-            self.db.delete_channel(channel_id)
+    async def delete_channel(self, channel_id: str) -> bool:
+        if self.forget_channel(channel_id):
+            await self.db.delete_channel(channel_id)
             return True
         return False
 
-    def update_channel(self, channel_id: str, new_name: str) -> bool:
+    def adopt_channel(self, channel_id: str, name: str, channel_type: ChannelType, cached: bool) -> Channel:
+        """Register a channel that was created and persisted elsewhere (another worker)"""
+        channel = Channel(name, channel_type)
+        channel.id = channel_id
+        # Uncached channels read their history from the database only
+        channel.history_loaded = cached
+        self.server.add_channel(channel)
+        return channel
+
+    def forget_channel(self, channel_id: str) -> bool:
+        """Drop a channel from memory without touching the database"""
+        channel = self.server.channels.pop(channel_id, None)
+        if channel is None:
+            return False
+        if self._hot_channels.pop(channel_id, None):
+            self.cached_messages -= len(channel.messages)
+        return True
+
+    async def update_channel(self, channel_id: str, new_name: str) -> bool:
         channel = self.server.get_channel(channel_id)
         if channel:
             channel.name = new_name
-            self.db.save_channel(self.server.id, channel)
+            await self.db.save_channel(self.server.id, channel)
             return True
         return False
 
@@ -36,46 +61,111 @@ class ChannelController:
     def list_channels(self) -> list[Channel]:
         return list(self.server.channels.values())
     
-    def edit_message(self, channel_id: str, message_id: str, new_content: str) -> bool:
+    # ---------------- HISTORY CACHE ----------------
+
+    async def ensure_loaded(self, channel: Channel) -> Channel:
+        """Hydrate the channel's history from the database if it was never loaded or was evicted"""
+        if not channel.history_loaded:
+            # Concurrent callers share one load instead of querying twice
+            task = self._loading.get(channel.id)
+            if task is None:
+                task = asyncio.ensure_future(self._load_history(channel))
+                self._loading[channel.id] = task
+            await asyncio.shield(task)
+        # Deleted while the load was in flight: nothing to cache or count
+        if self.server.channels.get(channel.id) is channel:
+            self._touch(channel)
+        return channel
+
+    async def _load_history(self, channel: Channel):
+        try:
+            messages = await self.db.load_messages(channel.id)
+            if not channel.history_loaded:
+                channel.set_messages(messages)
+                if self.server.channels.get(channel.id) is channel:
+                    self.cached_messages += len(channel.messages)
+        finally:
+            del self._loading[channel.id]
+
+    async def post_message(self, channel_id: str, author_id: str, content: str) -> Message | None:
         channel = self.server.get_channel(channel_id)
         if not channel:
-            return False
-        for msg in channel.messages:
-            if msg.id == message_id and not msg.deleted:
-                msg.edit(new_content)
-                self.db.save_message(channel.id, msg)
-                return True
-        return False
+            return None
+        if channel.id in self._loading:
+            # The load may already have read past this point in the table
+            await asyncio.shield(self._loading[channel.id])
+        msg = Message(author_id, content)
+        # A cold channel stays cold: the message goes to the database only
+        if channel.history_loaded:
+            channel.add_message(msg)
+            self.cached_messages += 1
+            self._touch(channel)
+        await self.db.save_message(channel.id, msg)
+        return msg
 
-    def delete_message(self, channel_id: str, message_id: str) -> bool:
+    async def recent_messages(self, channel: Channel, limit: int) -> tuple[list[Message], bool]:
+        """Newest messages of a channel without hydrating it; returns (messages, has_more)"""
+        if channel.history_loaded:
+            tail = channel.messages[-limit:] if limit > 0 else []
+            return tail, len(channel.messages) > len(tail)
+        return await self.db.load_message_page(channel.id, limit=max(limit, 0))
+
+    def _touch(self, channel: Channel):
+        if channel.id in self._hot_channels:
+            self._hot_channels.move_to_end(channel.id)
+        else:
+            self._hot_channels[channel.id] = channel
+        self._evict(keep=channel.id)
+
+    def _evict(self, keep: str):
+        while self.cached_messages > self.max_cached_messages and len(self._hot_channels) > 1:
+            channel_id, channel = next(iter(self._hot_channels.items()))
+            if channel_id == keep:
+                break
+            del self._hot_channels[channel_id]
+            self.cached_messages -= len(channel.messages)
+            channel.unload_messages()
+
+    async def _get_live_message(self, channel_id: str, message_id: str):
+        """Return (channel, message) via the channel's message index, or (None, None)"""
         channel = self.server.get_channel(channel_id)
         if not channel:
+            return None, None
+        await self.ensure_loaded(channel)
+        msg = channel.get_message(message_id)
+        if not msg or msg.deleted:
+            return None, None
+        return channel, msg
+
+    async def edit_message(self, channel_id: str, message_id: str, new_content: str) -> bool:
+        channel, msg = await self._get_live_message(channel_id, message_id)
+        if not msg:
             return False
-        for msg in channel.messages:
-            if msg.id == message_id and not msg.deleted:
-                msg.delete()
-                self.db.save_message(channel.id, msg)
-                return True
-        return False
+        msg.edit(new_content)
+        await self.db.save_message(channel.id, msg)
+        return True
 
-    def add_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
-        channel = self.server.get_channel(channel_id)
-        if not channel:
+    async def delete_message(self, channel_id: str, message_id: str) -> bool:
+        channel, msg = await self._get_live_message(channel_id, message_id)
+        if not msg:
             return False
-        for msg in channel.messages:
-            if msg.id == message_id and not msg.deleted:
-                msg.add_reaction(user_id, emoji)
-                self.db.save_message(channel.id, msg)
-                return True
-        return False
+        # Soft delete: the message keeps its slot, so the index stays valid
+        msg.delete()
+        await self.db.save_message(channel.id, msg)
+        return True
 
-    def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
-        channel = self.server.get_channel(channel_id)
-        if not channel:
+    async def add_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        channel, msg = await self._get_live_message(channel_id, message_id)
+        if not msg:
+            return False
+        msg.add_reaction(user_id, emoji)
+        await self.db.save_message(channel.id, msg)
+        return True
+
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        channel, msg = await self._get_live_message(channel_id, message_id)
+        if not msg:
             return False
-        for msg in channel.messages:
-            if msg.id == message_id and not msg.deleted:
-                msg.remove_reaction(user_id, emoji)
-                self.db.save_message(channel.id, msg)
-                return True
-        return False
\ No newline at end of file
+        msg.remove_reaction(user_id, emoji)
+        await self.db.save_message(channel.id, msg)
+        return True
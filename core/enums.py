@@ -28,3 +28,9 @@ class Permission(Enum):
     MUTE_MEMBERS = auto()
     MANAGE_ROLES = auto()
     MANAGE_SERVER = auto()
+
+
+class OverflowPolicy(Enum):
+    DROP = auto()        # discard the new event
+    COALESCE = auto()    # replace a queued event with the same coalesce key, else discard
+    DISCONNECT = auto()  # close the connection; the client can RESUME from the replay buffer
@@ -9,13 +9,34 @@ class Channel:
         self.type = channel_type
         self.permission_overrides = {}
         self.messages: list[Message] = []
+        self.message_index: dict[str, int] = {}  # message_id -> position in self.messages
+        self.history_loaded = True  # False while the history only lives in the database
         self.active_users: set[str] = set()
         self.voice_streams: dict[str, tuple[str, int]] = {}  # user_id -> (ip, port)
 
     def add_message(self, message: Message):
         if self.type == ChannelType.TEXT or self.type == ChannelType.VOICE:
+            self.message_index[message.id] = len(self.messages)
             self.messages.append(message)
 
+    def set_messages(self, messages: list[Message]):
+        """Replace the history (e.g. when hydrating from the database) and rebuild the index"""
+        self.messages = list(messages)
+        self.message_index = {msg.id: pos for pos, msg in enumerate(self.messages)}
+        self.history_loaded = True
+
+    def unload_messages(self):
+        """Drop the in-memory history; it is reloaded from the database on next access"""
+        self.messages = []
+        self.message_index = {}
+        self.history_loaded = False
+
+    def get_message(self, message_id: str) -> Message | None:
+        pos = self.message_index.get(message_id)
+        if pos is None:
+            return None
+        return self.messages[pos]
+
     def join_voice(self, user_id: str, addr: tuple[str, int]):
         """Add user to voice chat; addr = (ip, port) for UDP streaming"""
         self.active_users.add(user_id)
@@ -30,4 +30,19 @@ class Message:
         if emoji in self.reactions and user_id in self.reactions[emoji]:
             self.reactions[emoji].discard(user_id)
             if not self.reactions[emoji]:
-                del self.reactions[emoji]
\ No newline at end of file
+                del self.reactions[emoji]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "author_id": self.author_id,
+            "content": self.content,
+            "timestamp": self.timestamp
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Message":
+        msg = cls(data["author_id"], data["content"])
+        msg.id = data["id"]
+        msg.timestamp = data["timestamp"]
+        return msg
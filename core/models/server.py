@@ -9,11 +9,16 @@ class Server:
         self.id = str(uuid.uuid4())
         self.name = name
         self.members: dict[str, User] = {}
+        self.members_by_username: dict[str, User] = {}
         self.roles: dict[str, Role] = {}
         self.channels: dict[str, Channel] = {}
 
     def add_member(self, user: User):
         self.members[user.id] = user
+        self.members_by_username[user.username] = user
+
+    def get_member_by_username(self, username: str):
+        return self.members_by_username.get(username)
 
     def add_role(self, role: Role):
         self.roles[role.id] = role
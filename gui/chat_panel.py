@@ -3,6 +3,7 @@ from tkinter import scrolledtext, simpledialog, messagebox
 from core.enums import ChannelType
 import asyncio
 from core.models.channel import Channel
+from core.models.message import Message
 from core.enums import ChannelType
 from gui.settings.settings_window import SettingsWindow
 
@@ -12,6 +13,11 @@ class ChatPanel(tk.Frame):
         self.client_controller = client_controller
         self.channels: dict[str, object] = {}  # channel_id -> Channel instance
         self.channel: object | None = None
+        self.history_more: dict[str, bool] = {}  # channel_id -> older pages on server
+        self.history_pending: set[str] = set()  # channel_ids with a HISTORY_FETCH in flight
+        self.history_refresh: dict[str, int] = {}  # channel_id -> messages held when a refresh was requested
+        self.unread: set[str] = set()  # channels with activity we were not subscribed to
+        self.listbox_ids: list[str] = []  # channel_id per listbox row
 
         # ---------------- UI ----------------
         # Sidebar container (list + buttons)
@@ -49,6 +55,7 @@ class ChatPanel(tk.Frame):
         self.chat_display.pack(side="top", fill="both", expand=True, padx=5, pady=5)
 
         self.chat_display.bind("<Button-3>", self.on_right_click)
+        self.chat_display.configure(yscrollcommand=self.on_chat_scroll)
 
         # ---- Message input row ----
         self.input_frame = tk.Frame(self)
@@ -179,15 +186,81 @@ class ChatPanel(tk.Frame):
         )
         channel.id = channel_data["id"]
 
-        # Load message history
+        # Only the newest messages arrive with the channel; older pages are fetched on demand
         for msg_data in channel_data.get("messages", []):
-            from core.models.message import Message
-            msg = Message(msg_data["author_id"], msg_data["content"])
-            msg.id = msg_data["id"]
-            msg.timestamp = msg_data["timestamp"]
-            channel.messages.append(msg)
+            channel.add_message(Message.from_dict(msg_data))
 
         self.channels[channel.id] = channel
+        self.history_more[channel.id] = channel_data.get("has_more", False)
+
+    def fetch_older_history(self, channel):
+        if not self.history_more.get(channel.id) or channel.id in self.history_pending:
+            return
+        if not self.client_controller.loop.is_running():
+            return
+        before = channel.messages[0].id if channel.messages else None
+        self.history_pending.add(channel.id)
+        asyncio.run_coroutine_threadsafe(
+            self.client_controller.fetch_history(channel.id, before=before),
+            self.client_controller.loop
+        )
+
+    def refresh_history(self, channel):
+        """
+        Refetch the newest page of a channel we were not subscribed to: it has
+        the messages we missed and the current content of the ones we hold
+        (edited, or emptied by a deletion), in the server's order. Pages carry
+        no reactions or edited/deleted flags
+        """
+        if channel.id in self.history_pending or not self.client_controller.loop.is_running():
+            return
+        self.history_pending.add(channel.id)
+        self.history_refresh[channel.id] = len(channel.messages)
+        asyncio.run_coroutine_threadsafe(
+            self.client_controller.fetch_history(channel.id),
+            self.client_controller.loop
+        )
+
+    def add_history_page(self, channel_id, messages, has_more, before=None):
+        self.history_pending.discard(channel_id)
+        held = self.history_refresh.pop(channel_id, None)
+        channel = self.channels.get(channel_id)
+        if not channel:
+            return
+
+        if before:
+            page = [Message.from_dict(m) for m in messages if m["id"] not in channel.message_index]
+            channel.set_messages(page + channel.messages)
+        else:
+            # The newest page replaces what we held; messages that arrived live
+            # while it was in flight are newer than all of it
+            page = [Message.from_dict(m) for m in messages]
+            ids = {msg.id for msg in page}
+            live = channel.messages[len(channel.messages) if held is None else held:]
+            channel.set_messages(page + [msg for msg in live if msg.id not in ids])
+        self.history_more[channel_id] = has_more
+
+        if self.channel is channel:
+            self.render_messages(channel)
+
+    def reset_channels(self, channels_data):
+        current_id = self.channel.id if self.channel else None
+        self.channels.clear()
+        self.history_more.clear()
+        self.history_pending.clear()
+        self.history_refresh.clear()
+        self.unread.clear()
+        for channel_data in channels_data:
+            self.add_channel_from_server(channel_data)
+        self.refresh_channel_list()
+
+        if current_id in self.channels:
+            self.set_channel(self.channels[current_id])
+        else:
+            self.channel = None
+            self.chat_display.configure(state="normal")
+            self.chat_display.delete(1.0, tk.END)
+            self.chat_display.configure(state="disabled")
 
     def remove_channel_from_server(self, channel_id):
         if channel_id in self.channels:
@@ -227,27 +300,42 @@ class ChatPanel(tk.Frame):
 
 
     def refresh_channel_list(self):
+        selection = self.channel_listbox.curselection()
         self.channel_listbox.delete(0, tk.END)
+        self.listbox_ids = list(self.channels)
         for ch in self.channels.values():
-            self.channel_listbox.insert(tk.END, ch.name)
+            label = f"{ch.name} •" if ch.id in self.unread else ch.name
+            self.channel_listbox.insert(tk.END, label)
+        if selection and selection[0] < len(self.listbox_ids):
+            self.channel_listbox.selection_set(selection[0])
+
+    def mark_unread(self, channel_id):
+        if channel_id in self.channels and channel_id not in self.unread:
+            self.unread.add(channel_id)
+            self.refresh_channel_list()
 
     def on_channel_select(self, event):
         selection = self.channel_listbox.curselection()
         if not selection:
             return
-        index = selection[0]
-        channel_name = self.channel_listbox.get(index)
-        for ch in self.channels.values():
-            if ch.name == channel_name:
-                self.set_channel(ch)
-                # Switch channel on server safely
-                if self.client_controller.loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        self.client_controller._send({"event": "SWITCH_CHANNEL", "payload": {"channel_id": ch.id}}),
-                        self.client_controller.loop
-                    )
-                self.client_controller.channel_id = ch.id
-                break
+        ch = self.channels.get(self.listbox_ids[selection[0]])
+        if not ch:
+            return
+
+        self.set_channel(ch)
+        # Switch channel on server safely
+        if self.client_controller.loop.is_running():
+            asyncio.run_coroutine_threadsafe(
+                self.client_controller._send({"event": "SWITCH_CHANNEL", "payload": {"channel_id": ch.id}}),
+                self.client_controller.loop
+            )
+        self.client_controller.channel_id = ch.id
+
+        # Events for unsubscribed channels were not sent to us, so pull what we missed
+        if ch.id in self.unread:
+            self.unread.discard(ch.id)
+            self.refresh_channel_list()
+            self.refresh_history(ch)
 
     def set_channel(self, channel):
         self.channel = channel
@@ -256,12 +344,21 @@ class ChatPanel(tk.Frame):
         else:
             self.voice_button.config(state="normal")
 
+        self.render_messages(channel)
+
+    def render_messages(self, channel):
         self.chat_display.configure(state="normal")
         self.chat_display.delete(1.0, tk.END)
         for msg in channel.messages:
             self.display_message(msg.author_id, msg.content)
         self.chat_display.configure(state="disabled")
 
+    def on_chat_scroll(self, first, last):
+        self.chat_display.vbar.set(first, last)
+        # Reaching the top of the history pulls in the previous page
+        if self.channel and float(first) <= 0.0:
+            self.fetch_older_history(self.channel)
+
     # ---------------- Right Click ----------------
     def on_right_click(self, event):
         try:
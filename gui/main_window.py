@@ -1,6 +1,7 @@
 import tkinter as tk
 from gui.login_dialog import LoginDialog
 from gui.chat_panel import ChatPanel
+from core.models.message import Message
 
 
 class MainWindow(tk.Tk):
@@ -35,6 +36,11 @@ class MainWindow(tk.Tk):
 
         # ---------------- INIT ----------------
         if event_type == "INIT_CHANNELS":
+            if data.get("resync"):
+                # Full state after a reconnect the server could not replay
+                self.chat_panel.reset_channels(data["channels"])
+                return
+
             for ch in data["channels"]:
                 self.chat_panel.add_channel_from_server(ch)
 
@@ -65,8 +71,17 @@ class MainWindow(tk.Tk):
 
             channel = self.chat_panel.channels.get(channel_id)
             if channel:
-                from core.models.message import Message
-                msg_obj = Message(message["author_id"], message["content"])
-                msg_obj.id = message["id"]
-                msg_obj.timestamp = message["timestamp"]
-                channel.messages.append(msg_obj)
+                channel.add_message(Message.from_dict(message))
+
+        # ---------------- UNREAD ----------------
+        elif event_type == "CHANNEL_UNREAD":
+            self.chat_panel.mark_unread(data["channel_id"])
+
+        # ---------------- HISTORY PAGE ----------------
+        elif event_type == "HISTORY_PAGE":
+            self.chat_panel.add_history_page(
+                data["channel_id"],
+                data["messages"],
+                data["has_more"],
+                before=data.get("before")
+            )
@@ -0,0 +1,319 @@
+# networking/bus.py
+#
+# Message bus between EventServer nodes: worker processes on one machine,
+# servers on several machines, or a few servers in one process for tests.
+#
+# Nodes publish envelopes (dicts) and a router relays them. The router only
+# looks at two fields:
+#
+#     "to"     node id to deliver to, or None for every node (sender included)
+#     "stamp"  if true, the router sets "seq" from one global counter
+#
+# Because the router relays everything in the order it arrives, every node
+# sees stamped envelopes in the same order with contiguous sequence numbers;
+# a node that sees a jump knows it missed some (Bus.gaps).
+#
+# Envelopes published during one event loop iteration travel as one batch
+# (a list), and the router writes at most one batch per node for each batch
+# it receives, so a burst of broadcasts costs a few frames rather than one
+# per event per node.
+#
+# Implementations:
+#     InProcessBus + InProcessHub   nodes in one process, no sockets
+#     SocketBus + BusBroker         "host:port" over TCP or a Unix socket path
+#                                   (run_bus_broker.py runs a standalone broker)
+#
+# Envelopes carry session tokens and are trusted as they are, so a node
+# proves itself with the secret shared by the broker and every node before
+# it is let in. Brokers should still listen on a private network only.
+import abc
+import asyncio
+import hmac
+import os
+import secrets
+
+from networking.protocol import CODECS, LengthPrefixedFraming, ProtocolError
+
+BUS_FRAME_SIZE = 16 << 20  # a replayed history page can be large
+MAX_BATCH = 256  # envelopes per batch before flushing early
+MAX_NODE_BACKLOG = 64 << 20  # bytes queued for one node before the broker drops it
+CONNECT_RETRY_DELAY = 0.1
+CONNECT_TIMEOUT = 10.0
+HELLO_TIMEOUT = 5.0  # for a new connection to name its node and prove it knows the secret
+BUS_SECRET_ENV = "EVENT_BUS_SECRET"  # where run_bus_broker.py and run_event_server.py --bus read the secret
+
+
+def parse_address(address: str):
+    """"host:port" -> (host, port); anything else is a Unix socket path -> (path, None)"""
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit() and "/" not in address:
+        return host.strip("[]"), int(port)
+    return address, None
+
+
+def new_secret() -> str:
+    """A secret for a bus whose nodes all start from this process"""
+    return secrets.token_hex(16)
+
+
+def _framing():
+    # Both ends run the same code with the same libraries, so no negotiation
+    return LengthPrefixedFraming(next(iter(CODECS.values())), BUS_FRAME_SIZE)
+
+
+# ---------------- ROUTING ----------------
+
+class _Router:
+    def __init__(self):
+        self.seq = 0
+
+    def split(self, batch: list, nodes) -> dict:
+        """Stamp a batch and sort it into per-node batches, keeping the order"""
+        out = {}
+        for envelope in batch:
+            if envelope.pop("stamp", False):
+                self.seq += 1
+                envelope["seq"] = self.seq
+            to = envelope.get("to")
+            if to is None:
+                for node_id in nodes:
+                    out.setdefault(node_id, []).append(envelope)
+            elif to in nodes:
+                out.setdefault(to, []).append(envelope)
+        return out
+
+
+class InProcessHub(_Router):
+    """Router for nodes that share one event loop; envelopes are passed by reference"""
+
+    def __init__(self):
+        super().__init__()
+        self.nodes: dict[int, asyncio.Queue] = {}
+
+    def attach(self, node_id: int) -> asyncio.Queue:
+        queue = self.nodes[node_id] = asyncio.Queue()
+        return queue
+
+    def detach(self, node_id: int):
+        queue = self.nodes.pop(node_id, None)
+        if queue:
+            queue.put_nowait(None)
+
+    def route(self, batch: list):
+        for node_id, envelopes in self.split(batch, self.nodes).items():
+            self.nodes[node_id].put_nowait(envelopes)
+
+
+class BusBroker(_Router):
+    def __init__(self, address: str, secret: str):
+        super().__init__()
+        if not secret:
+            raise ValueError("the bus needs a shared secret")
+        self.address = address
+        self.secret = secret
+        self.nodes: dict[int, asyncio.StreamWriter] = {}
+        self.framing = _framing()
+
+    async def handle(self, reader, writer):
+        framing = _framing()
+        node_id = None
+        try:
+            hello = await asyncio.wait_for(framing.read(reader), HELLO_TIMEOUT)
+            if not isinstance(hello, dict) or not isinstance(hello.get("node"), int):
+                return
+            secret = hello.get("secret")
+            if not isinstance(secret, str) or not hmac.compare_digest(secret.encode(), self.secret.encode()):
+                print(f"[BusBroker] Rejected node {hello['node']} from "
+                      f"{writer.get_extra_info('peername') or 'local socket'}: wrong secret")
+                return
+            node_id = hello["node"]
+            previous = self.nodes.get(node_id)
+            if previous:
+                previous.close()
+            self.nodes[node_id] = writer
+            print(f"[BusBroker] Node {node_id} joined from {writer.get_extra_info('peername') or 'local socket'}")
+            while True:
+                batch = await framing.read(reader)
+                if batch is None:
+                    break
+                self.route(batch)
+        except (ConnectionError, OSError, ProtocolError, asyncio.TimeoutError):
+            pass
+        finally:
+            if node_id is not None and self.nodes.get(node_id) is writer:
+                del self.nodes[node_id]
+                print(f"[BusBroker] Node {node_id} left")
+            writer.close()
+
+    def route(self, batch: list):
+        # Nodes normally read as fast as the broker writes, so writes are not
+        # drained one by one; a node that stops reading is cut off instead of
+        # growing the broker's buffers (it sees the bus as lost)
+        for node_id, envelopes in self.split(batch, self.nodes).items():
+            writer = self.nodes[node_id]
+            writer.write(self.framing.encode(envelopes))
+            if writer.transport.get_write_buffer_size() > MAX_NODE_BACKLOG:
+                print(f"[BusBroker] Node {node_id} is not keeping up, dropping it")
+                del self.nodes[node_id]
+                writer.transport.abort()
+
+    async def serve(self):
+        host, port = parse_address(self.address)
+        if port is None:
+            if os.path.exists(host):
+                os.unlink(host)
+            server = await asyncio.start_unix_server(self.handle, host, limit=BUS_FRAME_SIZE)
+            os.chmod(host, 0o600)  # this user's processes only
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=BUS_FRAME_SIZE)
+        print(f"[BusBroker] Listening on {self.address}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if port is None and os.path.exists(host):
+                os.unlink(host)
+
+
+# ---------------- NODES ----------------
+
+class Bus(abc.ABC):
+    """
+    What EventServer sees of the bus. Subclasses connect in _connect, send
+    batches in _send and hand received batches to _receive.
+    """
+
+    def __init__(self, node_id: int, max_batch: int = MAX_BATCH):
+        self.node_id = node_id
+        self.max_batch = max_batch
+        self.lost = None  # set once the node is cut off from the others
+        self.last_seq = None
+        self.gaps = 0  # times stamped envelopes arrived out of sequence
+        self._on_message = None
+        self._pending = []
+        self._flush_handle = None
+        self._reader_task = None
+
+    async def start(self, on_message):
+        """Connect and feed every received envelope to on_message, one at a time"""
+        self.lost = asyncio.Event()
+        self._on_message = on_message
+        await self._connect()
+
+    def publish(self, envelope: dict, to: int | None = None, stamp: bool = False):
+        envelope["to"] = to
+        if stamp:
+            envelope["stamp"] = True
+        self._pending.append(envelope)
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            # Everything published until the loop comes round again shares a batch
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._send(batch)
+
+    async def _receive(self, batch: list):
+        for envelope in batch:
+            seq = envelope.get("seq")
+            if seq is not None:
+                if self.last_seq is not None and seq != self.last_seq + 1:
+                    self.gaps += 1
+                    print(f"[Bus] Node {self.node_id} missed sequence numbers {self.last_seq + 1}..{seq - 1}")
+                self.last_seq = seq
+            # In order, so forwarded events keep their per-connection order
+            await self._on_message(envelope)
+
+    @abc.abstractmethod
+    async def _connect(self):
+        ...
+
+    @abc.abstractmethod
+    def _send(self, batch: list):
+        ...
+
+    async def close(self):
+        self.flush()
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self.lost:
+            self.lost.set()
+
+
+class InProcessBus(Bus):
+    def __init__(self, hub: InProcessHub, node_id: int, max_batch: int = MAX_BATCH):
+        super().__init__(node_id, max_batch)
+        self.hub = hub
+
+    async def _connect(self):
+        self._reader_task = asyncio.create_task(self._read_loop(self.hub.attach(self.node_id)))
+
+    async def _read_loop(self, queue):
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            await self._receive(batch)
+        self.lost.set()
+
+    def _send(self, batch: list):
+        self.hub.route(batch)
+
+    async def close(self):
+        await super().close()
+        self.hub.detach(self.node_id)
+
+
+class SocketBus(Bus):
+    def __init__(self, address: str, node_id: int, secret: str, max_batch: int = MAX_BATCH):
+        super().__init__(node_id, max_batch)
+        self.address = address
+        self.secret = secret
+        self.framing = _framing()
+        self.writer = None
+
+    async def _connect(self):
+        # Waits for the broker to come up
+        host, port = parse_address(self.address)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONNECT_TIMEOUT
+        while True:
+            try:
+                if port is None:
+                    reader, self.writer = await asyncio.open_unix_connection(host, limit=BUS_FRAME_SIZE)
+                else:
+                    reader, self.writer = await asyncio.open_connection(host, port, limit=BUS_FRAME_SIZE)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(CONNECT_RETRY_DELAY)
+        self.writer.write(self.framing.encode({"node": self.node_id, "secret": self.secret}))
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                batch = await self.framing.read(reader)
+                if batch is None:
+                    break
+                await self._receive(batch)
+        except (ConnectionError, OSError, ProtocolError):
+            pass
+        print(f"[SocketBus] Node {self.node_id} lost the broker")
+        self.lost.set()
+
+    def _send(self, batch: list):
+        if not self.writer.is_closing():
+            self.writer.write(self.framing.encode(batch))
+
+    async def close(self):
+        await super().close()
+        if self.writer:
+            self.writer.close()
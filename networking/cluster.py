@@ -0,0 +1,114 @@
+# networking/cluster.py
+#
+# Runs EventServer as N worker processes on one machine.
+#
+# The master builds the community (users, roles, channels), then forks the
+# workers so each starts with a copy of it, and runs the BusBroker. Workers
+# share the listening port through SO_REUSEPORT, so the kernel spreads
+# connections over them. Each channel belongs to one worker (crc32 of its id
+# modulo N), which caches its history and handles every change to it; other
+# workers forward those events over the bus. Broadcasts go through the
+# broker so every worker delivers them in the same order to its own clients.
+#
+# Several machines can do the same against one shared broker (run_bus_broker.py
+# on a TCP address): each runs its workers as a range of node ids out of the
+# cluster-wide total, starting from the same community.
+#
+# Voice joins and leaves are handled by node 0, which also runs the one
+# VoiceServer when voice options are given.
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+
+from networking.bus import BusBroker, SocketBus
+from networking.event_server import EventServer, VOICE_NODE
+from networking.voice_server import VoiceServer
+
+SHUTDOWN_TIMEOUT = 10.0  # seconds a worker gets to close its database before it is killed
+
+
+def default_bus_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"event-bus-{os.getpid()}.sock")
+
+
+def _run_worker(node_id, nodes, auth, community, bus_address, bus_secret, voice_options, server_options):
+    async def main():
+        # SIGTERM stops the worker the way losing the bus does, so EventServer
+        # commits its write-behind queue on the way out
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        options = dict(server_options)
+        if options.get("metrics_port") is not None:
+            # One scrape target per worker
+            options["metrics_port"] += node_id
+        voice = None
+        if voice_options is not None and node_id == VOICE_NODE:
+            voice = VoiceServer(**voice_options)
+        server = EventServer(
+            auth=auth, community=community, bus=SocketBus(bus_address, node_id, bus_secret),
+            node_id=node_id, nodes=nodes, reuse_port=True, voice=voice, **options
+        )
+        if voice:
+            await asyncio.gather(server.start(), voice.start())
+        else:
+            await server.start()
+
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+def start_workers(workers, auth, community, bus_address, bus_secret, first_node=0, nodes=None, voice_options=None,
+                  **server_options) -> list:
+    """
+    Fork the worker processes as nodes first_node .. first_node + workers - 1
+    of `nodes` (default: just these). Call before the master starts an event
+    loop: the children inherit the community and AuthManager as they are now.
+    bus_secret is the broker's shared secret; voice_options are VoiceServer
+    arguments for node 0.
+    """
+    nodes = nodes or first_node + workers
+    context = multiprocessing.get_context("fork")
+    processes = []
+    for node_id in range(first_node, first_node + workers):
+        process = context.Process(
+            target=_run_worker,
+            args=(node_id, nodes, auth, community, bus_address, bus_secret, voice_options, server_options),
+            name=f"event-worker-{node_id}",
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    print(f"[Cluster] Started {workers} workers")
+    return processes
+
+
+async def watch_workers(processes, broker_address=None, bus_secret=None):
+    """
+    Wait until a worker exits, then stop the rest. Also runs the broker when
+    broker_address is given (otherwise the workers use an external one).
+    """
+    broker_task = None
+    if broker_address:
+        broker_task = asyncio.create_task(BusBroker(broker_address, bus_secret).serve())
+    try:
+        while all(process.is_alive() for process in processes):
+            await asyncio.sleep(0.5)
+        print("[Cluster] A worker exited, shutting down")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHUTDOWN_TIMEOUT
+        while any(process.is_alive() for process in processes) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        for process in processes:
+            if process.is_alive():
+                print(f"[Cluster] {process.name} did not stop in time, killing it")
+                process.kill()
+            process.join()
+        if broker_task:
+            broker_task.cancel()
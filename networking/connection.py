@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+from core.enums import OverflowPolicy
+from networking.protocol import LineFraming
+
+
+class Connection:
+    """
+    One client socket. Outgoing frames go into a bounded queue that a dedicated
+    writer task drains, so a slow reader only ever delays itself.
+
+    The queue holds encoded bodies; framing (and compression, whose stream
+    state depends on send order) happens only when the writer takes them.
+    """
+
+    def __init__(self, writer, max_queue=1024, overflow_policy=OverflowPolicy.DISCONNECT, framing=None,
+                 metrics=None):
+        self.writer = writer
+        self.framing = framing or LineFraming()  # replaced after a HELLO handshake
+        self.peername = writer.get_extra_info("peername")
+        self.user_id: str | None = None
+        self.active_channel: str | None = None
+        self.channels: set[str] = set()  # subscribed channel ids
+        self.unread: set[str] = set()  # channels already flagged unread to this client
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.queue: deque[tuple[object, object, bytes]] = deque()  # (coalesce_key, framing, body)
+        self.dropped = 0
+        self.metrics = metrics
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    def send_message(self, message: dict, coalesce_key=None) -> bool:
+        return self.send(self.framing.encode_body(message), coalesce_key)
+
+    def send(self, body: bytes, coalesce_key=None) -> bool:
+        """Queue a body encoded by the current framing; False if it was not queued"""
+        if self.closed:
+            return False
+        if len(body) > self.framing.max_frame_size:
+            # The client would drop the connection over it, reconnect and be sent it again
+            print(f"[Connection] Dropping a {len(body)} byte frame for {self.peername}, "
+                  f"over the {self.framing.max_frame_size} byte limit")
+            return False
+        if len(self.queue) >= self.max_queue:
+            return self._overflow(body, coalesce_key)
+        # Remember the framing: a HELLO_ACK queued before the switch still goes out as a line
+        self.queue.append((coalesce_key, self.framing, body))
+        self._wakeup.set()
+        return True
+
+    def _overflow(self, body: bytes, coalesce_key) -> bool:
+        if self.metrics:
+            self.metrics.outbound_overflow.inc(self.overflow_policy.name)
+        if self.overflow_policy == OverflowPolicy.DISCONNECT:
+            self.close()
+            return False
+
+        if self.overflow_policy == OverflowPolicy.COALESCE and coalesce_key is not None:
+            for i, (key, framing, _) in enumerate(self.queue):
+                if key == coalesce_key and framing is self.framing:
+                    # The newer frame supersedes the queued one, keeping its place
+                    self.queue[i] = (coalesce_key, framing, body)
+                    return True
+
+        self.dropped += 1
+        return False
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue and not self.closed:
+                    # Everything queued so far goes out in one write
+                    batch = b"".join(framing.frame(body) for _, framing, body in self.queue)
+                    self.queue.clear()
+                    self.writer.write(batch)
+                    if self.metrics:
+                        self.metrics.bytes_out.inc(amount=len(batch))
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._wakeup.set()
+        self.writer.close()
+
+
+class RemoteConnection:
+    """
+    Stands in for a client connected to another worker while an event that
+    worker forwarded is handled here; replies travel back over the bus.
+    """
+
+    def __init__(self, bus, node_id: int, conn_id: int, user_id: str | None, peername=None, max_frame_size=None):
+        self.bus = bus
+        self.max_frame_size = max_frame_size  # the frame limit negotiated with the client, if known
+        self.node_id = node_id
+        self.conn_id = conn_id
+        self.user_id = user_id
+        self.peername = tuple(peername) if peername else None
+        self.channels: set[str] = set()
+        self.unread: set[str] = set()
+
+    def send_message(self, message: dict, coalesce_key=None) -> bool:
+        self.bus.publish({"type": "deliver", "conn": self.conn_id, "message": message}, to=self.node_id)
+        return True
@@ -0,0 +1,122 @@
+# networking/dispatch.py
+#
+# Event name -> handler registry, shared by EventServer and ClientController.
+#
+#     events = EventRegistry()
+#
+#     class EventServer:
+#         @events.on("MESSAGE_CREATE", {"channel_id": Field(str), "content": Field(str, max_len=4000)})
+#         async def handle_message_create(self, payload, conn): ...
+#
+#     await events.dispatch(server, message, conn)
+#
+# Schemas are compiled into flat tuples of checks when the handler is
+# registered, so validating a frame costs a few dict lookups and isinstance
+# calls. A handler only ever sees a dict payload that passed its schema.
+
+
+class DispatchError(Exception):
+    """The frame was rejected before reaching a handler"""
+
+    def __init__(self, event, reason):
+        super().__init__(f"{event}: {reason}")
+        self.event = event
+        self.reason = reason
+
+
+class UnknownEvent(DispatchError):
+    pass
+
+
+class InvalidPayload(DispatchError):
+    pass
+
+
+class Field:
+    """
+    One payload field. A missing field and an explicit null are treated the
+    same: an error if required, skipped otherwise.
+    """
+    __slots__ = ("types", "required", "choices", "max_len")
+
+    def __init__(self, types, required=True, choices=None, max_len=None):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.required = required
+        self.choices = frozenset(choices) if choices is not None else None
+        self.max_len = max_len
+
+
+def compile_schema(schema: dict[str, Field] | None):
+    """Returns validate(payload) -> error string, or None if the payload is fine"""
+    if not schema:
+        return lambda payload: None
+
+    checks = tuple(
+        (
+            name,
+            field.types,
+            field.required,
+            # JSON true/false decode to bool, which isinstance() accepts as int
+            bool in field.types or int not in field.types,
+            field.choices,
+            field.max_len,
+            "/".join(t.__name__ for t in field.types),
+        )
+        for name, field in schema.items()
+    )
+
+    def validate(payload):
+        for name, types, required, bool_ok, choices, max_len, type_names in checks:
+            value = payload.get(name)
+            if value is None:
+                if required:
+                    return f"missing field '{name}'"
+                continue
+            if not isinstance(value, types) or (not bool_ok and isinstance(value, bool)):
+                return f"field '{name}' must be {type_names}"
+            if choices is not None and value not in choices:
+                return f"field '{name}' has unknown value"
+            if max_len is not None and len(value) > max_len:
+                return f"field '{name}' is longer than {max_len}"
+        return None
+
+    return validate
+
+
+class EventRegistry:
+    def __init__(self):
+        self.handlers: dict[str, tuple] = {}  # event -> (handler, validate)
+
+    def on(self, event: str, schema: dict[str, Field] | None = None):
+        """Register the decorated coroutine function as the handler for event"""
+        def register(handler):
+            if event in self.handlers:
+                raise ValueError(f"handler for {event} already registered")
+            self.handlers[event] = (handler, compile_schema(schema))
+            return handler
+        return register
+
+    def __contains__(self, event):
+        return event in self.handlers
+
+    async def dispatch(self, owner, message, *args):
+        """
+        Call handler(owner, payload, *args) for the message's event.
+        Raises UnknownEvent or InvalidPayload without touching the handler.
+        """
+        event = message.get("event") if isinstance(message, dict) else None
+        # Non-string names (lists, numbers) are unhashable or meaningless: same cheap miss
+        entry = self.handlers.get(event) if isinstance(event, str) else None
+        if entry is None:
+            raise UnknownEvent(event if isinstance(event, str) else None, "unknown event")
+
+        handler, validate = entry
+        payload = message.get("payload")
+        if payload is None:
+            payload = {}
+        elif not isinstance(payload, dict):
+            raise InvalidPayload(event, "payload must be an object")
+        error = validate(payload)
+        if error:
+            raise InvalidPayload(event, error)
+        return await handler(owner, payload, *args)
@@ -1,279 +1,806 @@
 import asyncio
-import json
-from auth.auth_manager import AuthManager
+import collections
+import itertools
+import time
+import zlib
+from auth.auth_manager import AuthManager, AuthBusy
+from auth.rate_limiter import RateLimiter
 from core.models.server import Server
 from core.models.channel import Channel
-from core.models.message import Message
-from core.enums import ChannelType, Permission
-from persistence.database import Database
+from core.enums import ChannelType, Permission, OverflowPolicy, RoleType
+from persistence.async_database import AsyncDatabase
 from core.controllers.channel_controller import ChannelController
+from networking.replay_buffer import ReplayBuffer
+from networking.connection import Connection, RemoteConnection
+from networking.subscriptions import ChannelSubscriptions
+from networking.protocol import JsonCodec, LineFraming, ProtocolError, MAX_FRAME_SIZE, negotiate
+from networking.dispatch import EventRegistry, DispatchError, Field
+from networking.metrics import ServerMetrics, start_metrics_server
+from audio.codecs import negotiate_codec
+
+DEFAULT_HISTORY_PAGE = 50
+MAX_HISTORY_PAGE = 100
+MAX_NAME_LENGTH = 100
+MAX_MESSAGE_LENGTH = 4000
+MAX_EMOJI_LENGTH = 32
+
+# Client -> server events; handlers below register themselves with a payload schema
+events = EventRegistry()
+
+CHANNEL_ID = Field(str, max_len=64)
+MESSAGE_ID = Field(str, max_len=64)
+
+# With several workers, these are handled by the worker that owns the channel
+CHANNEL_OWNED_EVENTS = frozenset({
+    "MESSAGE_CREATE", "MESSAGE_EDIT", "MESSAGE_DELETE", "MESSAGE_REACT", "MESSAGE_REMOVE_REACT",
+    "HISTORY_FETCH", "CHANNEL_DELETE", "CHANNEL_UPDATE"
+})
+# ...and these by the worker running the VoiceServer
+VOICE_EVENTS = frozenset({"VOICE_JOIN", "VOICE_LEAVE"})
+VOICE_NODE = 0
+TAIL_REQUEST_TIMEOUT = 2.0  # seconds to wait for an owner's channel tails before reading them locally
 
 
 class EventServer:
-    def __init__(self, host="0.0.0.0", port=8765, auth=None, community=None):
+    def __init__(self, host="0.0.0.0", port=8765, auth=None, community=None, history_tail=20,
+                 max_cached_messages=100_000, db=None, login_rate=1.0, login_burst=10,
+                 replay_capacity=4096, max_outbound_queue=1024, overflow_policy=OverflowPolicy.DISCONNECT,
+                 max_frame_size=MAX_FRAME_SIZE, compression=True, metrics=None, metrics_host="127.0.0.1",
+                 metrics_port=None, bus=None, node_id=0, nodes=1, reuse_port=False, db_path="server.db",
+                 voice=None):
         self.host = host
         self.port = port
-        self.clients = {}
+        self.voice = voice  # VoiceServer to keep informed of who is in which voice channel
+        self.reuse_port = reuse_port  # several worker processes listen on the same port
+
+        # Cluster mode: `nodes` processes (on one host or several) joined by
+        # `bus`, each owning a slice of the channels
+        self.bus = bus
+        self.node_id = node_id
+        self.nodes = nodes
+        self._conn_ids = itertools.count(1)
+        self._request_ids = itertools.count(1)
+        self._tail_requests: dict[int, asyncio.Future] = {}  # request id -> tails another node is sending
+        self._background: set[asyncio.Task] = set()
+        self._forwarded: dict[tuple, collections.deque] = {}  # (origin, conn) -> envelopes not yet handled
+        self.connections: dict[int, Connection] = {}  # conn_id -> local connection, for bus replies
+        self.history_tail = history_tail  # messages per channel sent with AUTH_SUCCESS
+        self.clients: set[Connection] = set()  # authenticated connections
+        # Per-connection outbound queue size and what to do when a client falls behind
+        self.max_outbound_queue = max_outbound_queue
+        self.overflow_policy = overflow_policy
+        self.max_frame_size = max_frame_size
+        self.compression = compression  # offer zlib streams to clients that ask
         self.auth = auth
         self.community = community
-        self.active_channels = {}
-        self.db = Database()
-
-        self.channel_controller = ChannelController(community, self.db)
-        self._load_persisted_data()
+        # Channel-scoped events only go to connections subscribed to that channel
+        self.subscriptions = ChannelSubscriptions()
+        # Always recorded; metrics_port additionally serves them over HTTP
+        self.metrics = metrics or ServerMetrics()
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.metrics.clients.fn = lambda: len(self.clients)
+        self.metrics.queue_depth.fn = self._queue_depths
+        if bus:
+            self.metrics.bus_gaps.fn = lambda: bus.gaps
+        if voice:
+            # Voice endpoints are learned from hellos carrying a session token
+            voice.authenticate = auth.validate_session
+            voice.on_bind = self._voice_bound
+            voice.on_evict = self._voice_evicted
+
+        # SQLite runs on its own threads with group-committed writes by default;
+        # pass an AsyncDatabase to pick another durability trade-off
+        self.db = db or AsyncDatabase(db_path, write_behind=True, metrics=self.metrics)
+
+        self.channel_controller = ChannelController(community, self.db, max_cached_messages)
+
+        # Login throttling: attempts per IP, failed attempts per username
+        self.ip_limiter = RateLimiter(rate=login_rate, burst=login_burst)
+        self.login_failure_limiter = RateLimiter(rate=1 / 30, burst=5)
+
+        # Recent broadcasts, replayed to clients that RESUME after a short disconnect
+        self.replay = ReplayBuffer(replay_capacity)
 
     # ---------------- LOAD ON BOOT ----------------
 
-    def _load_persisted_data(self):
-        from core.enums import ChannelType
-
-        rows = self.db.load_channels(self.community.id)
+    async def _load_persisted_data(self):
+        # Channel metadata only; histories are hydrated on first access by ChannelController
+        rows = await self.db.load_channels(self.community.id)
 
         for ch_id, name, type_str in rows:
+            channel = self.community.get_channel(ch_id)
+            if channel:
+                # Registered up front (fixed demo ids); its history is in the database
+                if not channel.messages:
+                    channel.history_loaded = False
+                continue
             channel = Channel(name, ChannelType[type_str])
             channel.id = ch_id
+            channel.history_loaded = False
             self.community.add_channel(channel)
 
-            messages = self.db.load_messages(ch_id)
-            for msg_id, author_id, timestamp, content in messages:
-                msg = Message(author_id, content)
-                msg.id = msg_id
-                msg.timestamp = timestamp
-                channel.messages.append(msg)
-
     # ---------------- NETWORK ----------------
 
     async def handler(self, reader, writer):
+        conn = Connection(writer, self.max_outbound_queue, self.overflow_policy,
+                          LineFraming(self.max_frame_size), self.metrics)
+        conn.conn_id = next(self._conn_ids)
+        self.connections[conn.conn_id] = conn
         try:
             while True:
-                data = await reader.readline()
-                if not data:
+                # Framing can change after HELLO, so look it up for every frame
+                message = await conn.framing.read(reader)
+                if message is None:
                     break
+                self.metrics.bytes_in.inc(amount=conn.framing.last_frame_size)
 
-                message = json.loads(data.decode())
-                await self.process_event(message, writer)
+                await self.process_event(message, conn)
 
-        except (ConnectionResetError, OSError):
+        except (ConnectionResetError, OSError, ProtocolError):
             pass
 
         finally:
-            if writer in self.clients:
-                del self.clients[writer]
+            self.connections.pop(conn.conn_id, None)
+            self.clients.discard(conn)
+            self.subscriptions.drop(conn)
+            conn.close()
+            if conn.user_id:
+                self._voice_disconnected(self.node_id, conn.conn_id)
 
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except:
-                pass
 
-
-    async def process_event(self, message, writer):
-        event = message.get("event")
-        payload = message.get("payload", {})
-
-        if event == "AUTH":
-            await self.handle_auth(payload, writer)
-        elif event == "MESSAGE_CREATE":
-            await self.handle_message_create(payload, writer)
-        elif event == "SWITCH_CHANNEL":
-            await self.handle_switch_channel(payload, writer)
-        elif event == "CHANNEL_CREATE":
-            await self.handle_channel_create(payload, writer)
-        elif event == "CHANNEL_DELETE":
-            await self.handle_channel_delete(payload, writer)
-        elif event == "CHANNEL_UPDATE":
-            await self.handle_channel_update(payload, writer)
-        elif event == "VOICE_JOIN":
-            await self.handle_voice_join(payload, writer)
-        elif event == "VOICE_LEAVE":
-            await self.handle_voice_leave(payload, writer)
-        elif event == "MESSAGE_EDIT":
-            await self.handle_message_edit(payload, writer)
-        elif event == "MESSAGE_DELETE":
-            await self.handle_message_delete(payload, writer)
-        elif event == "MESSAGE_REACT":
-            await self.handle_message_react(payload, writer)
-        elif event == "MESSAGE_REMOVE_REACT":
-            await self.handle_message_remove_react(payload, writer)
+    async def process_event(self, message, conn):
+        if self.bus and self._forward(message, conn):
+            return
+        start = time.perf_counter()
+        try:
+            await events.dispatch(self, message, conn)
+        except DispatchError as e:
+            # Rejected before any handler ran; tell the client and keep the connection
+            self.metrics.events_rejected.inc(type(e).__name__)
+            conn.send_message({"event": "ERROR", "payload": {"event": e.event, "reason": e.reason}})
+            return
+        # Only registered event names get here, so the label set stays bounded
+        event = message["event"]
+        self.metrics.events.inc(event)
+        self.metrics.event_seconds.observe(time.perf_counter() - start, event)
+
+    # ---------------- HANDSHAKE ----------------
+
+    @events.on("HELLO", {
+        "framing": Field(str, required=False),
+        "codecs": Field(list, required=False),
+        "compression": Field(list, required=False),
+        "max_frame_size": Field(int, required=False)
+    })
+    async def handle_hello(self, payload, conn):
+        if not isinstance(conn.framing, LineFraming):
+            return
+        ack, framing = negotiate(payload, self.max_frame_size, self.compression)
+        # The ack still goes out as a JSON line; everything after it uses the new framing
+        conn.send_message({"event": "HELLO_ACK", "payload": ack or {"framing": "lines"}})
+        if framing:
+            conn.framing = framing
 
     # ---------------- AUTH ----------------
 
-    async def handle_auth(self, payload, writer):
+    @events.on("AUTH", {"username": Field(str, max_len=MAX_NAME_LENGTH), "password": Field(str, max_len=1024)})
+    async def handle_auth(self, payload, conn):
         username = payload.get("username")
         password = payload.get("password")
+        ip = conn.peername[0] if conn.peername else "unknown"
 
-        for user in self.community.members.values():
-            if user.username == username and self.auth.verify_password(password, user.password_hash):
-                token = self.auth.create_session(user)
-                self.clients[writer] = user.id
-
-                await self.send_event(writer, "AUTH_SUCCESS", {
-                    "token": token,
-                    "user_id": user.id,
-                    "channels": [
-                        {
-                            "id": ch.id,
-                            "name": ch.name,
-                            "type": ch.type.name,
-                            "messages": [
-                                {
-                                    "id": msg.id,
-                                    "author_id": msg.author_id,
-                                    "content": msg.content,
-                                    "timestamp": msg.timestamp
-                                }
-                                for msg in ch.messages
-                            ]
-                        }
-                        for ch in self.community.channels.values()
-                    ]
-                })
-                return
-
-        await self.send_event(writer, "AUTH_FAILED", {"reason": "Invalid credentials"})
+        if not self.ip_limiter.hit(ip) or not self.login_failure_limiter.allowed(username):
+            await self.send_event(conn, "AUTH_FAILED", {"reason": "Too many login attempts, try again later"})
+            return
+
+        user = self.community.get_member_by_username(username)
+        try:
+            valid = bool(user and password) and await self.auth.verify_password_async(password, user.password_hash)
+        except AuthBusy:
+            await self.send_event(conn, "AUTH_FAILED", {"reason": "Server busy, try again later"})
+            return
+
+        if not valid:
+            self.login_failure_limiter.hit(username)
+            await self.send_event(conn, "AUTH_FAILED", {"reason": "Invalid credentials"})
+            return
+
+        self.login_failure_limiter.reset(username)
+        token = self.auth.create_session(user)
+        if self.bus:
+            # Any worker may receive this client's RESUME
+            self.bus.publish({"type": "session", "origin": self.node_id, "token": token, "user_id": user.id})
+        conn.user_id = user.id
+        await self._send_snapshot(conn, "AUTH_SUCCESS", token, user.id)
+
+    @events.on("RESUME", {
+        "token": Field(str, max_len=128),
+        "last_seq": Field(int, required=False),
+        "channels": Field(list, required=False)
+    })
+    async def handle_resume(self, payload, conn):
+        token = payload.get("token")
+        last_seq = payload.get("last_seq")
+
+        user_id = self.auth.validate_session(token)
+        if not user_id:
+            await self.send_event(conn, "RESUME_FAILED", {"reason": "Session expired"})
+            return
+
+        conn.user_id = user_id
+        for channel_id in payload.get("channels") or []:
+            if isinstance(channel_id, str) and self.community.get_channel(channel_id):
+                self.subscriptions.subscribe(conn, channel_id)
+                conn.active_channel = channel_id
+
+        missed = self.replay.since(last_seq) if last_seq is not None else None
+        if missed is None:
+            # Gap is older than the replay buffer: fall back to a full resync
+            await self._send_snapshot(conn, "RESUMED", token, user_id, full=True)
+            return
+
+        # Queued back to back so no live broadcast can slip in between
+        self.clients.add(conn)
+        resumed = {"event": "RESUMED", "payload": {"token": token, "user_id": user_id, "full": False}}
+        conn.send_message(resumed)
+        unread = set()
+        for channel_id, message in missed:
+            if channel_id is None or channel_id in conn.channels:
+                conn.send_message(message)
+            else:
+                unread.add(channel_id)
+        for channel_id in unread:
+            # Route through the index so the live path does not notify twice
+            if conn in self.subscriptions.route(channel_id, {conn})[1]:
+                self._send_unread([conn], channel_id)
+
+    async def _send_snapshot(self, conn, event, token, user_id, **extra):
+        """
+        Send the community snapshot and start sending conn broadcasts. The
+        tails are read first; from the seq on, nothing awaits, so the reply is
+        queued ahead of every broadcast after that seq and behind none before it.
+        """
+        start_seq = self.replay.last_seq
+        # Only channel metadata and a short tail; older pages come via HISTORY_FETCH
+        tails = {summary["id"]: summary for summary in await self._channel_summaries()}
+        channels = []
+        for channel in self.community.channels.values():
+            # Created while the tails were read: the client pages its history in
+            summary = tails.get(channel.id) or {"id": channel.id, "type": channel.type.name,
+                                                "messages": [], "has_more": True}
+            channels.append({**summary, "name": channel.name})
+        payload = {"token": token, "user_id": user_id, "seq": self.replay.last_seq, "channels": channels, **extra}
+        reply = {"event": event, "payload": payload}
+        keep = self.history_tail
+        while keep > 0 and not self._fits(conn, reply):
+            # Too big for one frame: shorter tails, the rest comes via HISTORY_FETCH
+            keep //= 2
+            for summary in channels:
+                if len(summary["messages"]) > keep:
+                    summary["messages"] = summary["messages"][len(summary["messages"]) - keep:]
+                    summary["has_more"] = True
+        self.clients.add(conn)
+        conn.send_message(reply)
+
+        # Channel events broadcast while the tails were read may be missing from them
+        touched = {channel_id for channel_id, _ in self.replay.since(start_seq) or () if channel_id}
+        for channel_id in touched:
+            if channel_id in conn.channels or conn in self.subscriptions.route(channel_id, {conn})[1]:
+                self._send_unread([conn], channel_id)
+
+    async def _channel_summaries(self):
+        # With a bus, each channel's tail comes from its owner: machines do not
+        # share a database, and the owner's cache is ahead of any database anyway
+        channels = list(self.community.channels.values())
+        local = [ch for ch in channels if self.owns(ch.id)]
+        remote = {}  # owner node -> channel ids
+        for channel in channels:
+            if not self.owns(channel.id):
+                remote.setdefault(self.owner_of(channel.id), []).append(channel.id)
+        results = await asyncio.gather(
+            *(self._channel_summary(ch) for ch in local),
+            *(self._remote_summaries(node, ids) for node, ids in remote.items())
+        )
+        by_id = {summary["id"]: summary for summary in results[:len(local)]}
+        for summaries in results[len(local):]:
+            by_id.update((summary["id"], summary) for summary in summaries)
+        return [by_id[ch.id] for ch in channels if ch.id in by_id]
+
+    async def _remote_summaries(self, node, channel_ids):
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._tail_requests[request_id] = future
+        self.bus.publish({"type": "tails", "origin": self.node_id, "request": request_id, "channels": channel_ids},
+                         to=node)
+        try:
+            return await asyncio.wait_for(future, TAIL_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[EventServer] Node {node} did not send channel tails, reading them locally")
+            channels = [self.community.get_channel(channel_id) for channel_id in channel_ids]
+            return await asyncio.gather(*(self._channel_summary(ch) for ch in channels if ch))
+        finally:
+            self._tail_requests.pop(request_id, None)
+
+    async def _send_tails(self, envelope):
+        channels = [self.community.get_channel(channel_id) for channel_id in envelope["channels"]]
+        summaries = await asyncio.gather(*(self._channel_summary(ch) for ch in channels if ch))
+        self.bus.publish({"type": "tails_reply", "request": envelope["request"], "summaries": summaries},
+                         to=envelope["origin"])
 
      # ---------------- CHANNEL CREATE ----------------
      
-    async def handle_channel_create(self, payload, writer):
+    @events.on("CHANNEL_CREATE", {
+        "name": Field(str, max_len=MAX_NAME_LENGTH),
+        "type": Field(str, choices=ChannelType.__members__)
+    })
+    async def handle_channel_create(self, payload, conn):
         name = payload.get("name")
         type_str = payload.get("type")
-        channel = self.channel_controller.create_channel(name, ChannelType[type_str])
+        channel = await self.channel_controller.create_channel(name, ChannelType[type_str])
+        if not self.owns(channel.id):
+            # Its owner caches the history and serves it to the other nodes
+            channel.history_loaded = False
 
         await self.broadcast({
             "event": "CHANNEL_CREATE",
             "payload": {"id": channel.id, "name": name, "type": type_str}
         })
 
-    async def handle_channel_delete(self, payload, writer):
+    @events.on("CHANNEL_DELETE", {"channel_id": CHANNEL_ID})
+    async def handle_channel_delete(self, payload, conn):
         channel_id = payload.get("channel_id")
-        if self.channel_controller.delete_channel(channel_id):
+        if await self.channel_controller.delete_channel(channel_id):
+            self.subscriptions.remove_channel(channel_id)
             await self.broadcast({"event": "CHANNEL_DELETE", "payload": {"channel_id": channel_id}})
 
-    async def handle_channel_update(self, payload, writer):
+    @events.on("CHANNEL_UPDATE", {"channel_id": CHANNEL_ID, "name": Field(str, max_len=MAX_NAME_LENGTH)})
+    async def handle_channel_update(self, payload, conn):
         channel_id = payload.get("channel_id")
         new_name = payload.get("name")
-        if self.channel_controller.update_channel(channel_id, new_name):
+        if await self.channel_controller.update_channel(channel_id, new_name):
             await self.broadcast({
                 "event": "CHANNEL_UPDATE",
                 "payload": {"channel_id": channel_id, "name": new_name}
-            })
+            }, coalesce_key=("CHANNEL_UPDATE", channel_id))
 
     # ---------------- VOICE ------------------
 
-    async def handle_voice_join(self, payload, writer):
-        user_id = self.clients.get(writer)
+    @events.on("VOICE_JOIN", {
+        "channel_id": CHANNEL_ID,
+        "codecs": Field(list, required=False, max_len=16)  # voice codecs the client has, best first
+    })
+    async def handle_voice_join(self, payload, conn):
+        user_id = conn.user_id
         channel_id = payload.get("channel_id")
-        udp_port = payload.get("udp_port")
 
         channel = self.community.get_channel(channel_id)
-        if not channel:
+        if not channel or not self.voice:
             return
 
-        peername = writer.get_extra_info("peername")
-        ip = peername[0]
+        codec = negotiate_codec(payload.get("codecs"))
+        # The client's UDP address comes with its hello; this only expects it
+        origin = conn.node_id if isinstance(conn, RemoteConnection) else self.node_id
+        self.voice.expect(channel_id, user_id, codec, owner=(origin, conn.conn_id))
+        await self.send_event(conn, "VOICE_JOINED", {"channel_id": channel_id, "codec": codec})
 
-        channel.join_voice(user_id, (ip, udp_port))
 
-
-    async def handle_voice_leave(self, payload, writer):
-        user_id = self.clients.get(writer)
+    @events.on("VOICE_LEAVE", {"channel_id": CHANNEL_ID})
+    async def handle_voice_leave(self, payload, conn):
+        user_id = conn.user_id
         channel_id = payload.get("channel_id")
 
         channel = self.community.get_channel(channel_id)
         if channel:
             channel.leave_voice(user_id)
+        if self.voice:
+            self.voice.leave(user_id, channel_id)
+
+    def _voice_bound(self, channel_id, user_id, addr):
+        channel = self.community.get_channel(channel_id)
+        if channel:
+            channel.join_voice(user_id, addr)
 
+    def _voice_evicted(self, channel_id, user_id, owner):
+        channel = self.community.get_channel(channel_id)
+        if channel:
+            channel.leave_voice(user_id)
+        if owner is None:
+            return
+        # The client cannot tell from UDP alone; it answers with a new VOICE_JOIN
+        node_id, conn_id = owner
+        message = {"event": "VOICE_EVICTED", "payload": {"channel_id": channel_id}}
+        if node_id == self.node_id:
+            conn = self.connections.get(conn_id)
+            if conn:
+                conn.send_message(message)
+        elif self.bus:
+            RemoteConnection(self.bus, node_id, conn_id, user_id).send_message(message)
+
+    def _voice_disconnected(self, node_id, conn_id):
+        """Evict whoever this connection put in voice, here or on the voice worker"""
+        if self.voice:
+            self.voice.disconnect((node_id, conn_id))
+        elif self.bus and self.node_id != VOICE_NODE:
+            self.bus.publish({"type": "disconnect", "origin": node_id, "conn": conn_id}, to=VOICE_NODE)
 
     # ---------------- MESSAGES ----------------
 
-    async def handle_message_create(self, payload, writer):
-        user_id = self.clients.get(writer)
+    @events.on("MESSAGE_CREATE", {"channel_id": CHANNEL_ID, "content": Field(str, max_len=MAX_MESSAGE_LENGTH)})
+    async def handle_message_create(self, payload, conn):
+        user_id = conn.user_id
         channel_id = payload.get("channel_id")
         content = payload.get("content")
 
-        channel = self.community.get_channel(channel_id)
-        if not channel:
+        msg = await self.channel_controller.post_message(channel_id, user_id, content)
+        if not msg:
             return
 
-        msg = Message(user_id, content)
-        channel.add_message(msg)
-        self.db.save_message(channel.id, msg)
-
-        await self.broadcast({
+        await self.broadcast_channel(channel_id, {
             "event": "MESSAGE_CREATE",
             "payload": {
-                "channel_id": channel.id,
-                "message": {
-                    "id": msg.id,
-                    "author_id": msg.author_id,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp
-                }
+                "channel_id": channel_id,
+                "message": msg.to_dict()
             }
         })
 
-    async def handle_switch_channel(self, payload, writer):
-        user_id = self.clients.get(writer)
+    @events.on("SWITCH_CHANNEL", {"channel_id": CHANNEL_ID})
+    async def handle_switch_channel(self, payload, conn):
         channel_id = payload.get("channel_id")
-        self.active_channels[user_id] = channel_id
+        if not conn.user_id or not self.community.get_channel(channel_id):
+            return
+
+        if conn.active_channel and conn.active_channel != channel_id:
+            self.subscriptions.unsubscribe(conn, conn.active_channel)
+        conn.active_channel = channel_id
+        self.subscriptions.subscribe(conn, channel_id)
 
-        await self.send_event(writer, "CHANNEL_SWITCHED", {"channel_id": channel_id})
+        await self.send_event(conn, "CHANNEL_SWITCHED", {"channel_id": channel_id})
 
     # ---------------- MESSAGE OPERATIONS ----------------
-    async def handle_message_edit(self, payload, writer):
+    @events.on("MESSAGE_EDIT", {
+        "channel_id": CHANNEL_ID,
+        "message_id": MESSAGE_ID,
+        "content": Field(str, max_len=MAX_MESSAGE_LENGTH)
+    })
+    async def handle_message_edit(self, payload, conn):
         channel_id = payload.get("channel_id")
         message_id = payload.get("message_id")
         new_content = payload.get("content")
-        if self.channel_controller.edit_message(channel_id, message_id, new_content):
-            await self.broadcast({
+        if await self.channel_controller.edit_message(channel_id, message_id, new_content):
+            await self.broadcast_channel(channel_id, {
                 "event": "MESSAGE_EDIT",
                 "payload": {"channel_id": channel_id, "message_id": message_id, "content": new_content}
-            })
+            }, coalesce_key=("MESSAGE_EDIT", message_id))
 
-    async def handle_message_delete(self, payload, writer):
+    @events.on("MESSAGE_DELETE", {"channel_id": CHANNEL_ID, "message_id": MESSAGE_ID})
+    async def handle_message_delete(self, payload, conn):
         channel_id = payload.get("channel_id")
         message_id = payload.get("message_id")
-        if self.channel_controller.delete_message(channel_id, message_id):
-            await self.broadcast({
+        if await self.channel_controller.delete_message(channel_id, message_id):
+            await self.broadcast_channel(channel_id, {
                 "event": "MESSAGE_DELETE",
                 "payload": {"channel_id": channel_id, "message_id": message_id}
             })
 
-    async def handle_message_react(self, payload, writer):
+    @events.on("MESSAGE_REACT", {
+        "channel_id": CHANNEL_ID,
+        "message_id": MESSAGE_ID,
+        "emoji": Field(str, max_len=MAX_EMOJI_LENGTH)
+    })
+    async def handle_message_react(self, payload, conn):
         channel_id = payload.get("channel_id")
         message_id = payload.get("message_id")
-        user_id = self.clients.get(writer)
+        user_id = conn.user_id
         emoji = payload.get("emoji")
-        if self.channel_controller.add_reaction(channel_id, message_id, user_id, emoji):
-            await self.broadcast({
+        if await self.channel_controller.add_reaction(channel_id, message_id, user_id, emoji):
+            await self.broadcast_channel(channel_id, {
                 "event": "MESSAGE_REACT",
                 "payload": {"channel_id": channel_id, "message_id": message_id, "user_id": user_id, "emoji": emoji}
             })
 
-    async def handle_message_remove_react(self, payload, writer):
+    @events.on("MESSAGE_REMOVE_REACT", {
+        "channel_id": CHANNEL_ID,
+        "message_id": MESSAGE_ID,
+        "emoji": Field(str, max_len=MAX_EMOJI_LENGTH)
+    })
+    async def handle_message_remove_react(self, payload, conn):
         channel_id = payload.get("channel_id")
         message_id = payload.get("message_id")
-        user_id = self.clients.get(writer)
+        user_id = conn.user_id
         emoji = payload.get("emoji")
-        if self.channel_controller.remove_reaction(channel_id, message_id, user_id, emoji):
-            await self.broadcast({
+        if await self.channel_controller.remove_reaction(channel_id, message_id, user_id, emoji):
+            await self.broadcast_channel(channel_id, {
                 "event": "MESSAGE_REMOVE_REACT",
                 "payload": {"channel_id": channel_id, "message_id": message_id, "user_id": user_id, "emoji": emoji}
             })
 
+    # ---------------- HISTORY ----------------
+
+    @events.on("HISTORY_FETCH", {
+        "channel_id": CHANNEL_ID,
+        "before": Field(str, required=False, max_len=64),
+        "after": Field(str, required=False, max_len=64),
+        "limit": Field(int, required=False)
+    })
+    async def handle_history_fetch(self, payload, conn):
+        channel_id = payload.get("channel_id")
+        before = payload.get("before")
+        after = payload.get("after")
+        limit = payload.get("limit") or DEFAULT_HISTORY_PAGE
+        limit = max(1, min(limit, MAX_HISTORY_PAGE))
+
+        if not conn.user_id or not self.community.get_channel(channel_id):
+            return
+
+        messages, has_more = await self.db.load_message_page(channel_id, before=before, after=after, limit=limit)
+        page = {
+            "channel_id": channel_id,
+            "before": before,
+            "after": after,
+            "messages": [msg.to_dict() for msg in messages],
+            "has_more": has_more
+        }
+        while page["messages"] and not self._fits(conn, {"event": "HISTORY_PAGE", "payload": page}):
+            # Too big for one frame: keep the half next to the cursor, the client pages on from there
+            kept = page["messages"]
+            half = len(kept) // 2
+            page["messages"] = kept[:half] if after else kept[len(kept) - half:]
+            page["has_more"] = True
+        await self.send_event(conn, "HISTORY_PAGE", page)
+
+    async def _channel_summary(self, channel):
+        tail, has_more = await self.channel_controller.recent_messages(channel, self.history_tail)
+        return {
+            "id": channel.id,
+            "name": channel.name,
+            "type": channel.type.name,
+            "messages": [msg.to_dict() for msg in tail],
+            "has_more": has_more
+        }
+
+    # ---------------- STATS ----------------
+
+    @events.on("STATS")
+    async def handle_stats(self, payload, conn):
+        if not self._is_admin(conn.user_id):
+            await self.send_event(conn, "ERROR", {"event": "STATS", "reason": "Not permitted"})
+            return
+        await self.send_event(conn, "STATS", self.metrics.snapshot())
+
+    def _is_admin(self, user_id):
+        user = self.community.members.get(user_id) if user_id else None
+        if not user:
+            return False
+        for role_id in user.roles:
+            role = self.community.roles.get(role_id)
+            if role and (role.role_type in (RoleType.OWNER, RoleType.ADMIN) or role.has(Permission.MANAGE_SERVER)):
+                return True
+        return False
+
+    def _queue_depths(self):
+        depths = [len(conn.queue) for conn in list(self.clients)]
+        return {("max",): max(depths, default=0), ("total",): sum(depths)}
+
     # ---------------- UTIL ----------------
 
-    async def send_event(self, writer, event, payload):
-        writer.write((json.dumps({"event": event, "payload": payload}) + "\n").encode())
-        await writer.drain()
+    def _fits(self, conn, message) -> bool:
+        """Whether message fits in one frame to conn, under the limit negotiated with its client"""
+        framing = getattr(conn, "framing", None)
+        if framing is None:
+            # Forwarded from another worker; JSON is the largest codec the client can have picked
+            return len(JsonCodec.dumps(message)) <= (conn.max_frame_size or self.max_frame_size)
+        return len(framing.encode_body(message)) <= framing.max_frame_size
+
+    async def send_event(self, conn, event, payload):
+        conn.send_message({"event": event, "payload": payload})
+
+    async def broadcast(self, message, coalesce_key=None):
+        """Encode once and queue on every connection; never waits on a slow client"""
+        self._publish(None, message, coalesce_key)
+
+    async def broadcast_channel(self, channel_id, message, coalesce_key=None):
+        """Send a channel-scoped event to its subscribers; everyone else gets one CHANNEL_UNREAD"""
+        self._publish(channel_id, message, coalesce_key)
+
+    def _publish(self, channel_id, message, coalesce_key):
+        if self.bus:
+            # Delivered (here too) once the broker has numbered it, so every
+            # worker sees the same order and sequence numbers
+            self.bus.publish({
+                "type": "broadcast",
+                "origin": self.node_id,
+                "scope": channel_id,
+                "message": message,
+                "key": coalesce_key
+            }, stamp=True)
+            return
+        self._deliver(channel_id, message, coalesce_key)
+
+    def _deliver(self, channel_id, message, coalesce_key=None, seq=None):
+        self.replay.append(message, channel_id, seq)
+        if channel_id is None:
+            self._fanout(list(self.clients), message, coalesce_key)
+            return
+        subscribers, to_notify = self.subscriptions.route(channel_id, self.clients)
+        if subscribers:
+            self._fanout(list(subscribers), message, coalesce_key)
+        if to_notify:
+            self._send_unread(to_notify, channel_id)
+
+    def _send_unread(self, conns, channel_id):
+        self._fanout(conns, {"event": "CHANNEL_UNREAD", "payload": {"channel_id": channel_id}})
+
+    def _fanout(self, conns, message, coalesce_key=None):
+        # One encode per codec in use, not per connection; each connection
+        # frames (and compresses) the shared body itself at write time
+        start = time.perf_counter()
+        bodies = {}
+        for conn in conns:
+            body = bodies.get(conn.framing.key)
+            if body is None:
+                body = bodies[conn.framing.key] = conn.framing.encode_body(message)
+            conn.send(body, coalesce_key)
+        self.metrics.fanout_seconds.observe(time.perf_counter() - start)
+        self.metrics.fanout_recipients.inc(amount=len(conns))
+
+    # ---------------- WORKERS ----------------
+
+    def owner_of(self, channel_id: str) -> int:
+        # crc32 rather than hash(): it must agree across processes
+        return zlib.crc32(channel_id.encode()) % self.nodes
+
+    def owns(self, channel_id: str) -> bool:
+        return self.nodes == 1 or self.owner_of(channel_id) == self.node_id
+
+    def _forward(self, message, conn) -> bool:
+        """Hand a channel-owned event to the worker that owns the channel; False to handle it here"""
+        event = message.get("event") if isinstance(message, dict) else None
+        if event in VOICE_EVENTS:
+            target = VOICE_NODE
+        elif event in CHANNEL_OWNED_EVENTS:
+            payload = message.get("payload")
+            channel_id = payload.get("channel_id") if isinstance(payload, dict) else None
+            if not isinstance(channel_id, str):
+                # Malformed payloads are rejected locally by the schema
+                return False
+            target = self.owner_of(channel_id)
+        else:
+            return False
+        if target == self.node_id:
+            return False
+        self.metrics.events_forwarded.inc(event)
+        self.bus.publish({
+            "type": "forward",
+            "origin": self.node_id,
+            "conn": conn.conn_id,
+            "user_id": conn.user_id,
+            "peer": conn.peername,
+            "frame_limit": conn.framing.max_frame_size,
+            "message": message
+        }, to=target)
+        return True
+
+    async def _on_bus_message(self, envelope):
+        kind = envelope.get("type")
+        if kind == "broadcast":
+            message = envelope["message"]
+            if envelope["origin"] != self.node_id:
+                self._apply_remote(message)
+            key = envelope.get("key")
+            self._deliver(envelope["scope"], message, tuple(key) if key else None, envelope["seq"])
+        elif kind in ("forward", "disconnect"):
+            self._queue_forwarded(envelope)
+        elif kind == "deliver":
+            conn = self.connections.get(envelope["conn"])
+            if conn:
+                conn.send_message(envelope["message"])
+        elif kind == "tails":
+            # Off the bus reader: the tails may come from the database
+            self._spawn(self._send_tails(envelope))
+        elif kind == "tails_reply":
+            future = self._tail_requests.get(envelope["request"])
+            if future and not future.done():
+                future.set_result(envelope["summaries"])
+        elif kind == "session":
+            if envelope["origin"] != self.node_id:
+                self.auth.add_session(envelope["token"], envelope["user_id"])
+
+    def _queue_forwarded(self, envelope):
+        """
+        Handlers can wait on the database or on other nodes, so forwarded
+        events run in tasks of their own rather than on the bus reader; one
+        task per remote connection keeps that connection's events in order
+        """
+        key = (envelope["origin"], envelope["conn"])
+        queue = self._forwarded.get(key)
+        if queue is not None:
+            queue.append(envelope)
+            return
+        self._forwarded[key] = collections.deque([envelope])
+        self._spawn(self._run_forwarded(key))
 
-    async def broadcast(self, message):
-        msg = json.dumps(message) + "\n"
-        for writer in self.clients:
-            writer.write(msg.encode())
-            await writer.drain()
+    async def _run_forwarded(self, key):
+        queue = self._forwarded[key]
+        try:
+            while queue:
+                envelope = queue.popleft()
+                if envelope["type"] == "disconnect":
+                    self._voice_disconnected(envelope["origin"], envelope["conn"])
+                    continue
+                conn = RemoteConnection(self.bus, envelope["origin"], envelope["conn"], envelope["user_id"],
+                                        envelope.get("peer"), envelope.get("frame_limit"))
+                try:
+                    await self.process_event(envelope["message"], conn)
+                except Exception as e:
+                    print(f"[EventServer] Forwarded event from node {key[0]} failed: {e!r}")
+        finally:
+            del self._forwarded[key]
+
+    def _apply_remote(self, message):
+        """
+        Mirror channel list changes made by another worker, in memory and in
+        this node's database, which may not be the one the change was written
+        to (nodes on other machines). The writes are idempotent, so workers
+        sharing a file just repeat them.
+        """
+        event = message.get("event")
+        payload = message.get("payload", {})
+        if event == "CHANNEL_CREATE":
+            channel = self.community.get_channel(payload["id"])
+            if not channel:
+                channel = self.channel_controller.adopt_channel(
+                    payload["id"], payload["name"], ChannelType[payload["type"]], cached=self.owns(payload["id"])
+                )
+            self._spawn(self.db.save_channel(self.community.id, channel))
+        elif event == "CHANNEL_DELETE":
+            if self.channel_controller.forget_channel(payload["channel_id"]):
+                self.subscriptions.remove_channel(payload["channel_id"])
+            self._spawn(self.db.delete_channel(payload["channel_id"]))
+        elif event == "CHANNEL_UPDATE":
+            channel = self.community.get_channel(payload["channel_id"])
+            if channel:
+                channel.name = payload["name"]
+                self._spawn(self.db.save_channel(self.community.id, channel))
+
+    def _spawn(self, coro):
+        """Run bus work without holding up the envelopes behind it"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"[EventServer] Bus task failed: {task.exception()!r}")
 
     async def start(self):
-        server = await asyncio.start_server(self.handler, self.host, self.port)
-        async with server:
-            await server.serve_forever()
+        await self._load_persisted_data()
+        if self.bus:
+            await self.bus.start(self._on_bus_message)
+        server = await asyncio.start_server(self.handler, self.host, self.port, limit=self.max_frame_size,
+                                            reuse_port=self.reuse_port or None)
+        metrics_server = None
+        if self.metrics_port is not None:
+            metrics_server = await start_metrics_server(self.metrics, self.metrics_host, self.metrics_port)
+        try:
+            async with server:
+                if self.bus:
+                    # A worker cut off from the others would serve a partial view;
+                    # this also stops workers whose master died
+                    serving = asyncio.create_task(server.serve_forever())
+                    await self.bus.lost.wait()
+                    serving.cancel()
+                else:
+                    await server.serve_forever()
+        finally:
+            if metrics_server:
+                metrics_server.close()
+            # Handlers see end of stream and clean up instead of being cancelled
+            for conn in list(self.connections.values()):
+                conn.close()
+            if self.bus:
+                await self.bus.close()
+            # Commit whatever the write-behind queue still holds
+            await self.db.close()
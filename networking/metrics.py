@@ -0,0 +1,224 @@
+# networking/metrics.py
+#
+# In-process metrics for EventServer, exported as Prometheus text over a
+# small HTTP endpoint and as a JSON snapshot for the admin STATS event.
+#
+# Recording is a lock plus a dict update, cheap enough to leave on. Values
+# that already live elsewhere (connected clients, queue depths) are gauges
+# backed by a function and are only computed when someone scrapes.
+import asyncio
+import bisect
+import threading
+
+# Seconds; covers in-memory handlers through bcrypt and SQLite commits
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()  # database metrics are recorded from worker threads
+
+    def _label_str(self, values, extra=()) -> str:
+        pairs = [*zip(self.labels, values), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f"{key}=\"{_escape(value)}\"" for key, value in pairs) + "}"
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self.values.get(labels, 0)
+
+    def _samples(self):
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{self._label_str(labels)} {value}"
+
+    def snapshot(self):
+        return {",".join(map(str, labels)): value for labels, value in list(self.values.items())}
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.values: dict[tuple, float] = {}
+        # fn() -> number, or {label tuple: number}; evaluated at scrape time
+        self.fn = fn
+
+    def set(self, value, *labels):
+        with self._lock:
+            self.values[labels] = value
+
+    def _current(self) -> dict[tuple, float]:
+        if self.fn is None:
+            return dict(self.values)
+        value = self.fn()
+        return value if isinstance(value, dict) else {(): value}
+
+    def _samples(self):
+        for labels, value in self._current().items():
+            yield f"{self.name}{self._label_str(labels)} {value}"
+
+    def snapshot(self):
+        return {",".join(map(str, labels)): value for labels, value in self._current().items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value, *labels):
+        # First bucket whose upper bound is >= value; len(buckets) means +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        for labels, (counts, total, count) in list(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self._label_str(labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{self._label_str(labels)} {total}"
+            yield f"{self.name}_count{self._label_str(labels)} {count}"
+
+    def snapshot(self):
+        return {
+            ",".join(map(str, labels)): {"count": count, "sum": total}
+            for labels, (_, total, count) in list(self.series.items())
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), fn=None) -> Gauge:
+        return self._register(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """JSON-friendly values, for the STATS event"""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+class ServerMetrics(MetricsRegistry):
+    """The metrics EventServer, Connection and Database record into"""
+
+    def __init__(self):
+        super().__init__()
+        # ---------------- EVENTS ----------------
+        self.events = self.counter("chat_events_total", "Client events handled", ["event"])
+        self.event_seconds = self.histogram("chat_event_seconds", "Time to handle a client event", ["event"])
+        self.events_rejected = self.counter("chat_events_rejected_total", "Client events rejected before dispatch", ["reason"])
+        self.events_forwarded = self.counter(
+            "chat_events_forwarded_total", "Client events handed to the worker owning their channel", ["event"]
+        )
+
+        # ---------------- BROADCAST ----------------
+        self.fanout_seconds = self.histogram("chat_fanout_seconds", "Time to encode and queue one broadcast")
+        self.fanout_recipients = self.counter("chat_fanout_recipients_total", "Frames queued by broadcasts")
+        self.outbound_overflow = self.counter(
+            "chat_outbound_overflow_total", "Frames that hit a full outbound queue", ["policy"]
+        )
+
+        # ---------------- CONNECTIONS ----------------
+        self.bytes_in = self.counter("chat_bytes_in_total", "Bytes read from clients")
+        self.bytes_out = self.counter("chat_bytes_out_total", "Bytes written to clients")
+        self.clients = self.gauge("chat_connected_clients", "Authenticated connections")
+        self.queue_depth = self.gauge(
+            "chat_outbound_queue_depth", "Frames waiting in outbound queues", ["stat"]
+        )
+
+        # ---------------- BUS ----------------
+        self.bus_gaps = self.gauge("chat_bus_sequence_gaps", "Times broadcasts from the bus arrived out of sequence")
+
+        # ---------------- DATABASE ----------------
+        self.db_statement_seconds = self.histogram(
+            "chat_db_statement_seconds", "Time to execute SQLite statements", ["op"]
+        )
+        self.db_commit_seconds = self.histogram("chat_db_commit_seconds", "Time to commit a SQLite transaction")
+
+
+# ---------------- HTTP ENDPOINT ----------------
+
+async def start_metrics_server(metrics: MetricsRegistry, host="127.0.0.1", port=9108):
+    """Serve GET /metrics in Prometheus text format; returns the asyncio server"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are not needed, but must be read before answering
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"[Metrics] Serving /metrics on {host}:{port}")
+    return server
@@ -0,0 +1,265 @@
+# networking/protocol.py
+#
+# Wire format shared by EventServer and ClientController.
+#
+# Every connection starts in the legacy format: one JSON document per line.
+# A client may open with a HELLO line listing the codecs it understands; the
+# server answers with a HELLO_ACK line naming the codec it picked, and from
+# then on both sides exchange length-prefixed frames:
+#
+#     !B flags | !I body length | body (encoded by the negotiated codec)
+#
+# If zlib compression was negotiated too, bodies of at least
+# COMPRESSION_THRESHOLD bytes are deflated through one stream per connection
+# and direction (so repeated keys are cheap after the first frame) and carry
+# FLAG_COMPRESSED. Smaller frames are sent as-is and bypass the stream.
+#
+# Clients that never send HELLO keep talking JSON lines.
+import asyncio
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FRAME_HEADER = struct.Struct("!BI")
+MAX_FRAME_SIZE = 1 << 20  # 1 MiB
+HELLO_TIMEOUT = 2.0
+
+FLAG_COMPRESSED = 0x01
+COMPRESSIONS = ("zlib",)
+COMPRESSION_THRESHOLD = 256  # below this deflate costs more than it saves
+COMPRESSION_LEVEL = 6
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# ---------------- CODECS ----------------
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(message) -> bytes:
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(data: bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def dumps(message) -> bytes:
+        return orjson.dumps(message)
+
+    @staticmethod
+    def loads(data: bytes):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(message) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def loads(data: bytes):
+        return msgpack.unpackb(data, raw=False)
+
+
+# What a codec raises on a malformed body
+DECODE_ERRORS = (ValueError, msgpack.UnpackException) if msgpack is not None else (ValueError,)
+
+# Fastest first; only codecs whose library is installed are offered
+CODECS = {
+    codec.name: codec
+    for codec, available in (
+        (MsgpackCodec, msgpack is not None),
+        (OrjsonCodec, orjson is not None),
+        (JsonCodec, True),
+    )
+    if available
+}
+
+
+# ---------------- FRAMING ----------------
+#
+# Sending is split in two steps so broadcasts can share work:
+#   encode_body(message) -> bytes   stateless, cached per framing key
+#   frame(body) -> bytes            per connection, called in send order
+
+class LineFraming:
+    """Legacy newline-delimited JSON"""
+    key = "lines"
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.last_frame_size = 0  # wire bytes of the last frame read, for metrics
+
+    def encode_body(self, message) -> bytes:
+        return (json.dumps(message) + "\n").encode()
+
+    def frame(self, body: bytes) -> bytes:
+        return body
+
+    def encode(self, message) -> bytes:
+        return self.frame(self.encode_body(message))
+
+    async def read(self, reader):
+        """Next message, or None at end of stream"""
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # StreamReader limit hit: the line is longer than any frame we accept
+            raise ProtocolError("line exceeds maximum frame size")
+        if not line:
+            return None
+        if len(line) > self.max_frame_size:
+            raise ProtocolError("line exceeds maximum frame size")
+        self.last_frame_size = len(line)
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise ProtocolError(f"bad JSON line: {e}")
+
+
+class LengthPrefixedFraming:
+    def __init__(self, codec, max_frame_size=MAX_FRAME_SIZE, compression=None):
+        self.codec = codec
+        self.max_frame_size = max_frame_size
+        self.key = codec.name
+        self.compression = compression
+        self.last_frame_size = 0  # wire bytes of the last frame read, for metrics
+        # Streams are created on first use; a connection that only sees small
+        # frames never pays for zlib state
+        self._compressor = None
+        self._decompressor = None
+
+    def encode_body(self, message) -> bytes:
+        return self.codec.dumps(message)
+
+    def frame(self, body: bytes) -> bytes:
+        if self.compression and len(body) >= COMPRESSION_THRESHOLD:
+            if self._compressor is None:
+                self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+            # Sync flush ends the frame on a byte boundary but keeps the window
+            body = self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            return FRAME_HEADER.pack(FLAG_COMPRESSED, len(body)) + body
+        return FRAME_HEADER.pack(0, len(body)) + body
+
+    def encode(self, message) -> bytes:
+        return self.frame(self.encode_body(message))
+
+    async def read(self, reader):
+        """Next message, or None at end of stream"""
+        try:
+            flags, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+            if length > self.max_frame_size:
+                raise ProtocolError(f"frame of {length} bytes exceeds {self.max_frame_size}")
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        self.last_frame_size = FRAME_HEADER.size + length
+        if flags & FLAG_COMPRESSED:
+            body = self._inflate(body)
+        try:
+            return self.codec.loads(body)
+        except DECODE_ERRORS as e:
+            raise ProtocolError(f"bad {self.codec.name} frame: {e!r}")
+
+    def _inflate(self, data: bytes) -> bytes:
+        if not self.compression:
+            raise ProtocolError("compressed frame on an uncompressed connection")
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+        try:
+            # Bounded, so a small frame cannot inflate into unbounded memory
+            body = self._decompressor.decompress(data, self.max_frame_size)
+        except zlib.error as e:
+            raise ProtocolError(f"bad compressed frame: {e}")
+        if self._decompressor.unconsumed_tail:
+            raise ProtocolError(f"inflated frame exceeds {self.max_frame_size}")
+        return body
+
+
+# ---------------- HANDSHAKE ----------------
+
+def hello_message(max_frame_size=MAX_FRAME_SIZE, compress=True) -> dict:
+    return {
+        "event": "HELLO",
+        "payload": {
+            "framing": "length-prefixed",
+            "codecs": list(CODECS),
+            "compression": list(COMPRESSIONS) if compress else [],
+            "max_frame_size": max_frame_size
+        }
+    }
+
+
+def _frame_limit(ours: int, theirs) -> int:
+    """Both ends hold frames to the smaller of the two limits"""
+    if isinstance(theirs, int) and not isinstance(theirs, bool) and theirs > 0:
+        return min(ours, theirs)
+    return ours
+
+
+def negotiate(payload: dict, max_frame_size=MAX_FRAME_SIZE, compress=True):
+    """
+    Server side of HELLO: returns (HELLO_ACK payload, framing to switch to),
+    or (None, None) when nothing better than JSON lines is possible.
+    """
+    if payload.get("framing") != "length-prefixed":
+        return None, None
+    offered = payload.get("codecs") or []
+    # The client lists its codecs; pick the fastest one we also have
+    codec = next((CODECS[name] for name in CODECS if name in offered), None)
+    if codec is None:
+        return None, None
+    offered_compression = payload.get("compression") or []
+    compression = next((name for name in COMPRESSIONS if name in offered_compression), None) if compress else None
+    ack = {
+        "framing": "length-prefixed",
+        "codec": codec.name,
+        "compression": compression,
+        "max_frame_size": _frame_limit(max_frame_size, payload.get("max_frame_size"))
+    }
+    return ack, LengthPrefixedFraming(codec, ack["max_frame_size"], compression)
+
+
+async def client_handshake(reader, writer, max_frame_size=MAX_FRAME_SIZE, compress=True):
+    """
+    Client side of HELLO. Returns the framing to use; falls back to JSON lines
+    if the server does not answer (older servers ignore HELLO).
+    """
+    lines = LineFraming(max_frame_size)
+    writer.write(lines.encode(hello_message(max_frame_size, compress)))
+    await writer.drain()
+    try:
+        reply = await asyncio.wait_for(lines.read(reader), HELLO_TIMEOUT)
+    except asyncio.TimeoutError:
+        return lines
+    if not reply or reply.get("event") != "HELLO_ACK":
+        return lines
+    ack = reply["payload"]
+    codec = CODECS.get(ack.get("codec"))
+    if codec is None:
+        return lines
+    compression = ack.get("compression")
+    if compression not in COMPRESSIONS:
+        compression = None
+    return LengthPrefixedFraming(codec, _frame_limit(max_frame_size, ack.get("max_frame_size")), compression)
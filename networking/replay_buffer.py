@@ -0,0 +1,40 @@
+from collections import deque
+from itertools import islice
+
+
+class ReplayBuffer:
+    """
+    Bounded log of recent broadcast events, numbered with a community-wide
+    sequence so a reconnecting client can be sent only what it missed.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.events: deque[tuple[int, str | None, dict]] = deque(maxlen=capacity)
+        self.last_seq = 0
+
+    def append(self, message: dict, channel_id: str | None = None, seq: int | None = None) -> int:
+        """
+        channel_id scopes the event to one channel; None means community-wide.
+        seq is given when numbering happens elsewhere (the worker bus broker).
+        """
+        if seq is None:
+            seq = self.last_seq + 1
+        elif seq != self.last_seq + 1:
+            # Missed some numbers: since() relies on contiguous sequences, so start over
+            self.events.clear()
+        self.last_seq = seq
+        message["seq"] = seq
+        self.events.append((seq, channel_id, message))
+        return seq
+
+    def since(self, seq: int) -> list[tuple[str | None, dict]] | None:
+        """(channel_id, event) pairs after seq, or None if some already fell out of the buffer"""
+        if seq > self.last_seq or seq < 0:
+            return None
+        if seq == self.last_seq:
+            return []
+        oldest = self.events[0][0] if self.events else self.last_seq + 1
+        if seq < oldest - 1:
+            return None
+        # Sequence numbers are contiguous, so the offset is direct
+        return [(channel_id, message) for _, channel_id, message in islice(self.events, seq - oldest + 1, None)]
@@ -0,0 +1,57 @@
+class ChannelSubscriptions:
+    """
+    Which connections are interested in which channels.
+    Keeps both directions: conn.channels per connection and an inverted
+    channel_id -> connections index used to route channel-scoped events.
+    Connections outside a channel get a single unread notice until they subscribe.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[str, set] = {}  # channel_id -> connections
+        self.notified: dict[str, set] = {}  # channel_id -> connections already told it is unread
+
+    def subscribe(self, conn, channel_id: str):
+        conn.channels.add(channel_id)
+        self.subscribers.setdefault(channel_id, set()).add(conn)
+        self._clear_unread(conn, channel_id)
+
+    def unsubscribe(self, conn, channel_id: str):
+        conn.channels.discard(channel_id)
+        subs = self.subscribers.get(channel_id)
+        if subs is not None:
+            subs.discard(conn)
+            if not subs:
+                del self.subscribers[channel_id]
+
+    def drop(self, conn):
+        """Forget a closed connection"""
+        for channel_id in list(conn.channels):
+            self.unsubscribe(conn, channel_id)
+        for channel_id in list(conn.unread):
+            self._clear_unread(conn, channel_id)
+
+    def remove_channel(self, channel_id: str):
+        for conn in self.subscribers.pop(channel_id, ()):
+            conn.channels.discard(channel_id)
+        for conn in self.notified.pop(channel_id, ()):
+            conn.unread.discard(channel_id)
+
+    def route(self, channel_id: str, clients: set) -> tuple[set, set]:
+        """
+        Split clients for an event in channel_id into (subscribers, connections
+        that still need an unread notice). The latter are marked as notified.
+        """
+        subs = self.subscribers.get(channel_id, set())
+        notified = self.notified.setdefault(channel_id, set())
+        # Set arithmetic runs in C, so this stays cheap with many idle clients
+        to_notify = clients - subs - notified
+        notified |= to_notify
+        for conn in to_notify:
+            conn.unread.add(channel_id)
+        return subs, to_notify
+
+    def _clear_unread(self, conn, channel_id: str):
+        conn.unread.discard(channel_id)
+        notified = self.notified.get(channel_id)
+        if notified is not None:
+            notified.discard(conn)
@@ -0,0 +1,75 @@
+# networking/voice_mixer.py
+#
+# Server-side mixing for large voice rooms. Forwarding sends every speaker's
+# packets to every other member, so egress grows with speakers x members;
+# mixing sends each member one stream per 20 ms tick instead. Members who are
+# speaking get the mix minus their own voice; everyone else shares one mix.
+# The mixer works on PCM; VoiceServer decodes and encodes around it.
+import collections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FRAME_SAMPLES = 960  # 20 ms of 48 kHz mono
+SAMPLE_MIN = -32768
+SAMPLE_MAX = 32767
+MAX_QUEUED_FRAMES = 3  # per speaker; older frames are dropped so the mix never lags behind
+IDLE_TICKS = 50  # a speaker's queue is dropped after a second without frames
+
+
+class RoomMixer:
+    def __init__(self, frame_samples: int = FRAME_SAMPLES):
+        if np is None:
+            raise RuntimeError("mixing needs numpy")
+        self.frame_samples = frame_samples
+        self.queues: dict[tuple, collections.deque] = {}  # source addr -> frames waiting for a tick
+        self.heard: dict[tuple, int] = {}  # source addr -> tick of their last frame
+        self.ticks = 0  # ticks mixed so far, the seq of the room's stream
+
+    def push(self, addr: tuple, pcm: bytes):
+        # May run on the receiving thread while mix runs on the loop; mix only
+        # drops queues that have been idle for a while, so an append cannot
+        # land in a queue that was just thrown away
+        self.heard[addr] = self.ticks
+        queue = self.queues.get(addr)
+        if queue is None:
+            queue = self.queues[addr] = collections.deque(maxlen=MAX_QUEUED_FRAMES)
+        queue.append(pcm)
+
+    def to_samples(self, pcm: bytes):
+        """16-bit little-endian PCM -> int32 samples, padded or cut to one frame"""
+        n = min(len(pcm) // 2, self.frame_samples)
+        samples = np.frombuffer(pcm, dtype="<i2", count=n).astype(np.int32)
+        if n < self.frame_samples:
+            samples = np.pad(samples, (0, self.frame_samples - n))
+        return samples
+
+    def to_pcm(self, samples) -> bytes:
+        return np.clip(samples, SAMPLE_MIN, SAMPLE_MAX).astype("<i2").tobytes()
+
+    def mix(self):
+        """
+        One tick: (mix of every speaker, {speaker addr: mix of the others, or
+        None when they speak alone}) as PCM, or None if nobody spoke.
+        """
+        self.ticks += 1
+        speakers, frames = [], []
+        for addr, queue in list(self.queues.items()):
+            if queue:
+                speakers.append(addr)
+                frames.append(self.to_samples(queue.popleft()))
+            elif self.ticks - self.heard.get(addr, 0) > IDLE_TICKS:
+                del self.queues[addr]  # stopped talking or left; comes back with its next packet
+                self.heard.pop(addr, None)
+
+        if not speakers:
+            return None
+        stack = np.stack(frames)
+        total = stack.sum(axis=0)
+        everyone = self.to_pcm(total)
+        if len(speakers) == 1:
+            return everyone, {speakers[0]: None}
+        own = np.clip(total - stack, SAMPLE_MIN, SAMPLE_MAX).astype("<i2")
+        return everyone, {addr: own[i].tobytes() for i, addr in enumerate(speakers)}
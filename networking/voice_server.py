@@ -1,31 +1,397 @@
 import asyncio
 import socket
-import pyaudio
+import threading
+import time
+
+from audio.codecs import CODECS, FRAME_SAMPLES, PcmCodec, create_codec
+from audio.packet import (FLAG_HELLO, FLAG_SILENT, HEADER_SIZE, MIX_SOURCE, SEQ_MOD, is_packet, pack,
+                          restamp, unpack)
+from networking.voice_mixer import RoomMixer, np
+
+MAX_DATAGRAM = 4096
+MAX_BATCH = 64  # datagrams read per wakeup of the event loop
+THREAD_POLL_INTERVAL = 0.5  # how often the forwarding thread checks whether to stop
+MIX_TICK = 0.02  # one 20 ms frame
+VOICE_TIMEOUT = 5.0  # seconds without a packet (clients send a marker every second) before eviction
+SWEEP_INTERVAL = 1.0
+
+
+class VoiceProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.sendto = transport.sendto
+
+    def datagram_received(self, data, addr):
+        self.server.forward(data, addr)
+        # The transport reads one datagram per wakeup; read what else is queued
+        # now rather than going back through the selector for each one
+        self.server.drain()
+
+    def error_received(self, exc):
+        # ICMP errors from a client that went away; it stays routed until it leaves
+        pass
 
-CHUNK = 960  # 20ms audio at 48kHz
-RATE = 48000
-CHANNELS = 1
-FORMAT = pyaudio.paInt16
 
 class VoiceServer:
-    def __init__(self, host="0.0.0.0", port=5000, channel=None):
+    """
+    One UDP socket for every voice channel. EventServer reports joins and
+    leaves; each packet is routed by its source address to the other members
+    of the sender's channel.
+
+    A join only announces the user (expect()). Their address is taken from
+    their first FLAG_HELLO datagram, whose session token `authenticate` maps
+    back to the user. Members that send nothing for `timeout` seconds, and
+    members whose TCP connection (`owner`) goes away, are evicted, so
+    packets only go to clients that are still there.
+
+    Packets are forwarded from the event loop with non-blocking sends, or,
+    with threaded=True, from a thread of their own so a busy loop (or a busy
+    voice server) does not hold up the other.
+
+    Rooms with at least mix_threshold members are mixed instead (needs
+    numpy): every 20 ms each member gets one frame, the sum of the current
+    speakers without their own voice.
+
+    Each member sends and receives in the codec negotiated at VOICE_JOIN.
+    Packets are passed through untouched between members with the same
+    codec, and transcoded (once per codec in the room) otherwise.
+
+    Packets carry the header from audio.packet. Forwarded packets keep the
+    sender's seq and timestamp and get the sender's source id, so clients
+    can buffer and mix each speaker separately; mixed rooms send one stream
+    from MIX_SOURCE. Silence markers (FLAG_SILENT) are not forwarded or mixed.
+    """
+
+    def __init__(self, host="0.0.0.0", port=5000, threaded=False, mix_threshold=None, timeout=VOICE_TIMEOUT,
+                 authenticate=None):
         self.host = host
         self.port = port
-        self.channel = channel  # instance of Channel
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((host, port))
-        self.loop = asyncio.get_event_loop()
-        self.audio = pyaudio.PyAudio()
-        self.stream_out = self.audio.open(format=FORMAT, channels=CHANNELS,
-                                          rate=RATE, output=True, frames_per_buffer=CHUNK)
+        self.threaded = threaded
+        self.timeout = timeout  # None keeps silent members forever
+        self.authenticate = authenticate  # session token -> user_id, or None
+        # Called as on_bind(channel_id, user_id, addr) and on_evict(channel_id, user_id, owner)
+        self.on_bind = None
+        self.on_evict = None
+        if mix_threshold is not None and np is None:
+            print("[VoiceServer] numpy is not installed, rooms will not be mixed")
+            mix_threshold = None
+        self.mix_threshold = mix_threshold
+        self.mixers: dict[str, RoomMixer] = {}  # channel_id -> mixer, for rooms being mixed
+        self.routes: dict[tuple, tuple[str, str, str, int]] = {}  # addr -> (channel_id, user_id, codec, source)
+        self.sources: set[int] = set()  # source ids in use
+        self._next_source = 0
+        self.rooms: dict[str, dict[str, tuple]] = {}  # channel_id -> {user_id: addr}
+        self.members: dict[str, str] = {}  # user_id -> channel_id
+        self.pending: dict[str, tuple] = {}  # user_id -> (channel_id, codec, owner, since), until their hello
+        self.owners: dict[str, object] = {}  # user_id -> the TCP connection that joined them
+        # addr -> time of its last packet, by the coarse clock `now` the sweeper advances
+        self.last_seen: dict[tuple, float] = {}
+        self.now = time.monotonic()
+        # channel_id -> ((codec, member addresses), ...); replaced (never mutated)
+        # on every change, so forwarding iterates it without copying or locking
+        self.targets: dict[str, tuple] = {}
+        # Codec instances: one per codec name, or per stream for stateful codecs
+        self.codecs: dict = {}
+        self.sendto = None  # set once the socket is open
+        self.sock = None
+        self._control = None  # runs hellos on the event loop when forwarding has a thread
+
+    # ---------------- MEMBERSHIP ----------------
+
+    def expect(self, channel_id: str, user_id: str, codec: str = PcmCodec.name, owner=None):
+        """The user joins channel_id once their hello arrives"""
+        self.leave(user_id)
+        self.pending[user_id] = (channel_id, codec, owner, self.now)
+
+    def join(self, channel_id: str, user_id: str, addr: tuple, codec: str = PcmCodec.name, owner=None):
+        """A user is in at most one voice channel, and an address belongs to one user"""
+        addr = tuple(addr)
+        if codec not in CODECS:
+            codec = PcmCodec.name
+        self.leave(user_id)
+        stale = self.routes.get(addr)
+        if stale:
+            self.leave(stale[1])
+        self.rooms.setdefault(channel_id, {})[user_id] = addr
+        self.members[user_id] = channel_id
+        self.owners[user_id] = owner
+        self.routes[addr] = (channel_id, user_id, codec, self._allocate_source())
+        self.last_seen[addr] = self.now
+        self._update_targets(channel_id)
+
+    def _allocate_source(self) -> int:
+        if len(self.sources) >= SEQ_MOD - 1:
+            raise RuntimeError("no voice source ids left")
+        while True:
+            self._next_source = self._next_source % (SEQ_MOD - 1) + 1  # 1..65535; 0 is the mix
+            if self._next_source not in self.sources:
+                self.sources.add(self._next_source)
+                return self._next_source
+
+    def leave(self, user_id: str, channel_id: str | None = None) -> bool:
+        """Remove the user from their voice channel (only if it is channel_id, when given)"""
+        removed = False
+        pending = self.pending.get(user_id)
+        if pending and (channel_id is None or pending[0] == channel_id):
+            del self.pending[user_id]
+            removed = True
+        current = self.members.get(user_id)
+        if current is None or (channel_id is not None and current != channel_id):
+            return removed
+        del self.members[user_id]
+        self.owners.pop(user_id, None)
+        room = self.rooms[current]
+        addr = room.pop(user_id)
+        if not room:
+            del self.rooms[current]
+        route = self.routes.pop(addr, None)
+        if route:
+            self.sources.discard(route[3])
+        self.last_seen.pop(addr, None)
+        self._drop_codecs(addr)
+        self._update_targets(current)
+        return True
+
+    def evict(self, user_id: str):
+        channel_id = self.members.get(user_id)
+        owner = self.owners.get(user_id)
+        if self.leave(user_id) and channel_id is not None:
+            print(f"[VoiceServer] Evicted {user_id} from {channel_id}")
+            if self.on_evict:
+                self.on_evict(channel_id, user_id, owner)
+
+    def disconnect(self, owner):
+        """The TCP connection that joined users went away"""
+        for user_id, (_, _, pending_owner, _) in list(self.pending.items()):
+            if pending_owner == owner:
+                del self.pending[user_id]
+        for user_id, user_owner in list(self.owners.items()):
+            if user_owner == owner:
+                self.evict(user_id)
+
+    def sweep(self):
+        """Evict members that have gone quiet and joins whose hello never came"""
+        self.now = time.monotonic()
+        if self.timeout is None:
+            return
+        deadline = self.now - self.timeout
+        for user_id, (_, _, _, since) in list(self.pending.items()):
+            if since < deadline:
+                del self.pending[user_id]
+        for addr, seen in list(self.last_seen.items()):
+            if seen < deadline:
+                route = self.routes.get(addr)
+                if route:
+                    self.evict(route[1])
+                else:
+                    self.last_seen.pop(addr, None)  # stamped by the forwarding thread as it left
+
+    def hello(self, data: bytes, addr: tuple):
+        """Bind the sender of a hello to the user whose session token it carries"""
+        user_id = self.authenticate(unpack(data)[4].decode(errors="replace")) if self.authenticate else None
+        if not user_id:
+            return
+        pending = self.pending.get(user_id)
+        route = self.routes.get(addr)
+        if pending:
+            channel_id, codec, owner, _ = pending
+        elif user_id in self.members and not (route and route[1] == user_id):
+            # Already in voice from another address (NAT rebinding): move them
+            channel_id = self.members[user_id]
+            codec = self.routes[self.rooms[channel_id][user_id]][2]
+            owner = self.owners.get(user_id)
+        elif route and route[1] == user_id:
+            channel_id = None  # hello resent because our answer was lost
+        else:
+            return
+        if channel_id is not None:
+            self.join(channel_id, user_id, addr, codec, owner)
+            if self.on_bind:
+                self.on_bind(channel_id, user_id, addr)
+        self.last_seen[addr] = self.now
+        self.sendto(pack(b"", 0, 0, MIX_SOURCE, flags=FLAG_HELLO), addr)
+
+    def _update_targets(self, channel_id: str):
+        room = self.rooms.get(channel_id)
+        if room:
+            groups = {}
+            for addr in room.values():
+                groups.setdefault(self.routes[addr][2], []).append(addr)
+            self.targets[channel_id] = tuple((codec, tuple(addrs)) for codec, addrs in groups.items())
+        else:
+            self.targets.pop(channel_id, None)
+        # Forward or mix, by room size
+        if self.mix_threshold is not None and room and len(room) >= self.mix_threshold:
+            if channel_id not in self.mixers:
+                self.mixers[channel_id] = RoomMixer()
+        elif self.mixers.pop(channel_id, None):
+            self._drop_codecs(channel_id)
+
+    # ---------------- CODECS ----------------
+
+    def _codec(self, name: str, *stream):
+        key = (name, *stream) if CODECS[name].stateful else name
+        codec = self.codecs.get(key)
+        if codec is None:
+            codec = self.codecs[key] = create_codec(name)
+        return codec
+
+    def _drop_codecs(self, owner):
+        """Forget the stream state of a member address or a mixed channel"""
+        for key in list(self.codecs):
+            if isinstance(key, tuple) and key[-1] == owner:
+                self.codecs.pop(key, None)
+
+    # ---------------- FORWARDING ----------------
+
+    def forward(self, data: bytes, addr: tuple):
+        if not is_packet(data):
+            return
+        flags = data[1]
+        if flags & FLAG_HELLO:
+            if self._control:
+                self._control(self.hello, data, addr)
+            else:
+                self.hello(data, addr)
+            return
+        route = self.routes.get(addr)
+        if route is None:
+            return  # not in any voice channel
+        self.last_seen[addr] = self.now
+        if flags & FLAG_SILENT:
+            return  # nothing to hear
+        channel_id, _, codec, source = route
+        mixer = self.mixers.get(channel_id)
+        if mixer is not None:
+            mixer.push(addr, self._codec(codec, "in", addr).decode(data[HEADER_SIZE:]))
+            return
+        sendto = self.sendto
+        data = restamp(data, source)
+        pcm = None
+        for target_codec, targets in self.targets.get(channel_id, ()):
+            payload = data
+            if target_codec != codec:
+                if pcm is None:
+                    pcm = self._codec(codec, "in", addr).decode(data[HEADER_SIZE:])
+                payload = data[:HEADER_SIZE] + self._codec(target_codec, "out", addr).encode(pcm)
+            for target in targets:
+                if target != addr:
+                    sendto(payload, target)
+
+    def drain(self):
+        recvfrom = self.sock.recvfrom
+        for _ in range(MAX_BATCH - 1):
+            try:
+                data, addr = recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # ICMP error from an earlier send
+            self.forward(data, addr)
+
+    def mix(self):
+        sendto = self.sendto
+        if sendto is None:
+            return  # socket not open yet
+        for channel_id, mixer in list(self.mixers.items()):
+            mixed = mixer.mix()
+            if mixed is None:
+                continue
+            everyone, own = mixed
+            # One stream per room: every listener sees the same seq for a tick
+            seq, timestamp = mixer.ticks, mixer.ticks * FRAME_SAMPLES
+            for codec, targets in self.targets.get(channel_id, ()):
+                shared = None  # listeners who are not speaking all get the same packet
+                for addr in targets:
+                    if addr in own:
+                        if own[addr] is not None:
+                            payload = self._codec(codec, "mix", addr).encode(own[addr])
+                            sendto(pack(payload, seq, timestamp, MIX_SOURCE), addr)
+                        continue
+                    if shared is None:
+                        payload = self._codec(codec, "mix", channel_id).encode(everyone)
+                        shared = pack(payload, seq, timestamp, MIX_SOURCE)
+                    sendto(shared, addr)
+
+    async def _mix_loop(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += MIX_TICK
+            delay = next_tick - loop.time()
+            if delay < 0:
+                next_tick -= delay  # fell behind: skip ticks rather than bursting
+            await asyncio.sleep(max(delay, 0))
+            self.mix()
+
+    def _bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.host, self.port))
+        self.sock = sock
+        return sock
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
 
     async def start(self):
+        mixing = asyncio.create_task(self._mix_loop()) if self.mix_threshold is not None else None
+        sweeping = asyncio.create_task(self._sweep_loop())
+        try:
+            if self.threaded:
+                self._control = asyncio.get_running_loop().call_soon_threadsafe
+                await self._serve_threaded()
+            else:
+                await self._serve()
+        finally:
+            sweeping.cancel()
+            if mixing:
+                mixing.cancel()
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        sock = self._bind()
+        sock.setblocking(False)
+        transport, _ = await loop.create_datagram_endpoint(lambda: VoiceProtocol(self), sock=sock)
         print(f"[VoiceServer] Listening on {self.host}:{self.port}")
-        while True:
-            data, addr = await self.loop.sock_recvfrom(self.sock, 4096)
+        try:
+            await loop.create_future()  # until cancelled
+        finally:
+            transport.close()
+
+    async def _serve_threaded(self):
+        sock = self._bind()
+        sock.settimeout(THREAD_POLL_INTERVAL)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._forward_loop, args=(sock, stop), name="voice-forwarder", daemon=True)
+        thread.start()
+        print(f"[VoiceServer] Listening on {self.host}:{self.port} (forwarding thread)")
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+            sock.close()
+
+    def _forward_loop(self, sock, stop):
+        sock_sendto = sock.sendto
 
-            if self.channel:
-                for user_id, user_addr in self.channel.voice_streams.items():
-                    if user_addr != addr:
-                        await self.loop.sock_sendto(self.sock, data, user_addr)
+        def sendto(data, target):
+            try:
+                sock_sendto(data, target)
+            except OSError:
+                pass  # full buffer or unreachable client: drop the packet, as the asyncio transport does
 
+        self.sendto = sendto
+        recvfrom = sock.recvfrom
+        while not stop.is_set():
+            try:
+                data, addr = recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                continue
+            self.forward(data, addr)
@@ -0,0 +1,111 @@
+import asyncio
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from persistence.database import Database
+
+
+class AsyncDatabase:
+    """
+    Awaitable wrapper around Database that keeps SQLite off the event loop.
+    All writes run in order on one writer thread; reads run on a small pool of
+    read-only connections, which WAL lets proceed while the writer commits.
+    """
+
+    def __init__(self, path="server.db", readers=2, **options):
+        self.path = path
+        self.metrics = options.get("metrics")
+        self.writer = Database(path, **options)
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        # An in-memory database cannot be shared, so its reads stay on the writer
+        self._read_executor = None
+        if readers > 0 and path != ":memory:":
+            self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._readers: list[Database] = []
+        # Reads wait for a commit only if their channel has writes not yet
+        # committed, so reads of other channels never queue behind the writer
+        self._submitted = 0  # writes submitted so far
+        self._last_write: dict[str, int] = {}  # channel_id -> number of its latest write
+        self._in_flight: dict[str, int] = {}  # channel_id -> writes submitted but not yet run
+        self._barrier = None  # (writes submitted before it, flush that reads wait on)
+
+    # ---------------- EXECUTORS ----------------
+
+    async def _write(self, channel_id, fn, *args):
+        self._submitted += 1
+        self._last_write[channel_id] = self._submitted
+        self._in_flight[channel_id] = self._in_flight.get(channel_id, 0) + 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._write_executor, fn, *args)
+        finally:
+            if self._in_flight[channel_id] == 1:
+                del self._in_flight[channel_id]
+            else:
+                self._in_flight[channel_id] -= 1
+
+    async def _read(self, method, *args, channel_id=None):
+        """channel_id: the channel whose writes the read must see; None for all of them"""
+        loop = asyncio.get_running_loop()
+        if self._read_executor is None:
+            return await loop.run_in_executor(self._write_executor, getattr(self.writer, method), *args)
+
+        if self._unsynced(channel_id):
+            needed = self._submitted if channel_id is None else self._last_write[channel_id]
+            if self._barrier is None or self._barrier[0] < needed:
+                # The writer thread is FIFO, so this flush lands after every earlier write
+                self._barrier = (self._submitted, loop.run_in_executor(self._write_executor, self.writer.flush))
+            await asyncio.shield(self._barrier[1])
+        return await loop.run_in_executor(self._read_executor, self._run_read, method, args)
+
+    def _unsynced(self, channel_id) -> bool:
+        """Whether writes to channel_id (any if None) may not be committed yet"""
+        if channel_id is None:
+            return bool(self._in_flight) or self.writer.has_pending()
+        return channel_id in self._in_flight or self.writer.has_pending(channel_id)
+
+    def _run_read(self, method, args):
+        reader = getattr(self._local, "db", None)
+        if reader is None:
+            reader = Database(self.path, read_only=True, metrics=self.metrics)
+            self._local.db = reader
+            self._readers.append(reader)
+        return getattr(reader, method)(*args)
+
+    # ---------------- CHANNELS ----------------
+
+    async def save_channel(self, server_id, channel):
+        await self._write(channel.id, self.writer.save_channel, server_id, channel)
+
+    async def delete_channel(self, channel_id):
+        await self._write(channel_id, self.writer.delete_channel, channel_id)
+
+    async def load_channels(self, server_id):
+        return await self._read("load_channels", server_id)
+
+    # ---------------- MESSAGES ----------------
+
+    async def save_message(self, channel_id, message):
+        # Snapshot on the loop thread; handlers keep mutating reactions while the write is queued
+        snapshot = copy.copy(message)
+        snapshot.reactions = {emoji: set(users) for emoji, users in message.reactions.items()}
+        await self._write(channel_id, self.writer.save_message, channel_id, snapshot)
+
+    async def load_messages(self, channel_id):
+        return await self._read("load_messages", channel_id, channel_id=channel_id)
+
+    async def load_message_page(self, channel_id, before=None, after=None, limit=50):
+        return await self._read("load_message_page", channel_id, before, after, limit, channel_id=channel_id)
+
+    # ---------------- LIFECYCLE ----------------
+
+    async def flush(self):
+        await asyncio.get_running_loop().run_in_executor(self._write_executor, self.writer.flush)
+
+    async def close(self):
+        if self._read_executor:
+            self._read_executor.shutdown(wait=True)
+        for reader in self._readers:
+            reader.close()
+        await asyncio.get_running_loop().run_in_executor(self._write_executor, self.writer.close)
+        self._write_executor.shutdown(wait=True)
@@ -1,10 +1,58 @@
 import sqlite3
 import json
+import threading
+import time
+from pathlib import Path
+from core.models.message import Message
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def _is_transient(error):
+    """Worth retrying: another connection holds a lock"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
 
 class Database:
-    def __init__(self, path="server.db"):
-        self.conn = sqlite3.connect(path)
-        self._create_tables()
+    def __init__(self, path="server.db", write_behind=False, flush_interval=0.05, batch_size=256,
+                 synchronous="NORMAL", read_only=False, metrics=None):
+        """
+        write_behind=False commits every write immediately (one fsync each).
+        write_behind=True queues writes and commits them as one transaction every
+        flush_interval seconds or once batch_size writes are pending; a crash can
+        lose at most that window. synchronous is SQLite's PRAGMA synchronous level.
+        read_only opens an extra connection for readers of an existing database.
+        metrics, if given, records statement and commit latency (see ServerMetrics).
+        """
+        if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"synchronous must be one of {SYNCHRONOUS_LEVELS}")
+        if read_only and write_behind:
+            raise ValueError("a read-only connection cannot queue writes")
+
+        if read_only:
+            uri = Path(path).absolute().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(f"PRAGMA synchronous={synchronous.upper()}")
+            self._create_tables()
+
+        self.metrics = metrics
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        # (kind, id) -> (channel_id, statements); repeated writes to a row replace
+        # the queued statements in place so insertion order is kept
+        self._pending: dict[tuple[str, str], tuple[str, list]] = {}
+        self._pending_channels: dict[str, int] = {}  # channel_id -> queued writes, see has_pending
+        self._stop = threading.Event()
+        self._flusher = None
+        if write_behind:
+            self._flusher = threading.Thread(target=self._flush_loop, name="db-flusher", daemon=True)
+            self._flusher.start()
 
     def _create_tables(self):
         cursor = self.conn.cursor()
@@ -29,66 +77,222 @@ class Database:
             )
         """)
 
+        # History pages walk a channel in rowid (insertion) order
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_channel
+            ON messages (channel_id)
+        """)
+
         self.conn.commit()
 
+    # ---------------- WRITE QUEUE ----------------
+
+    def _transaction(self, batches):
+        """Run [(op, statements)] in one transaction"""
+        metrics = self.metrics
+        with self.conn:
+            for op, statements in batches:
+                start = time.perf_counter()
+                for sql, params in statements:
+                    self.conn.execute(sql, params)
+                if metrics:
+                    metrics.db_statement_seconds.observe(time.perf_counter() - start, op)
+            start = time.perf_counter()
+        # The with block commits on exit
+        if metrics:
+            metrics.db_commit_seconds.observe(time.perf_counter() - start)
+
+    def _query(self, op, sql, params):
+        start = time.perf_counter()
+        rows = self.conn.execute(sql, params).fetchall()
+        if self.metrics:
+            self.metrics.db_statement_seconds.observe(time.perf_counter() - start, op)
+        return rows
+
+    def _commit(self, items):
+        """
+        Commit [(key, (channel_id, statements))] in one transaction and return
+        the items still to be written. A write that fails for good is dropped
+        and logged, and the rest of the batch goes in around it; if the
+        database is busy or locked, the items from there on are returned so
+        they are retried in order.
+        """
+        try:
+            self._transaction([(key[0], statements) for key, (_, statements) in items])
+            return []
+        except sqlite3.Error as e:
+            if _is_transient(e):
+                return items
+            if len(items) == 1:
+                kind, row_id = items[0][0]
+                print(f"[Database] Dropping {kind} write for {row_id}: {e}")
+                return []
+        middle = len(items) // 2
+        retry = self._commit(items[:middle])
+        if retry:
+            return retry + items[middle:]
+        return self._commit(items[middle:])
+
+    def _write(self, key, channel_id, statements):
+        with self._lock:
+            if not self.write_behind:
+                # sqlite3 already waited out its busy timeout, so a busy write is given up
+                if self._commit([(key, (channel_id, statements))]):
+                    print(f"[Database] Database is busy, dropping {key[0]} write for {key[1]}")
+                return
+
+            if key not in self._pending:
+                self._pending_channels[channel_id] = self._pending_channels.get(channel_id, 0) + 1
+            self._pending[key] = (channel_id, statements)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Commit all queued writes in a single transaction. Writes the database
+        was too busy for stay queued; returns True once the queue is empty.
+        """
+        with self._lock:
+            if self._pending:
+                self._pending = dict(self._commit(list(self._pending.items())))
+                pending_channels = {}
+                for channel_id, _ in self._pending.values():
+                    pending_channels[channel_id] = pending_channels.get(channel_id, 0) + 1
+                self._pending_channels = pending_channels
+            return not self._pending
+
+    def has_pending(self, channel_id=None) -> bool:
+        """
+        Whether writes to channel_id (any channel if None) are queued but not
+        committed. Safe to call from other threads without the lock.
+        """
+        if channel_id is None:
+            return bool(self._pending_channels)
+        return channel_id in self._pending_channels
+
+    def _flush_loop(self):
+        busy = False
+        while not self._stop.wait(self.flush_interval):
+            flushed = self.flush()
+            if busy != (not flushed):
+                busy = not flushed
+                print(f"[Database] {'Database is busy, holding' if busy else 'Caught up on'} queued writes")
+
+    def _sync_reads(self, channel_id=None):
+        # Reads see every write to their channel issued before them, unless the database is busy
+        if self.has_pending(channel_id):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+        with self._lock:
+            if not self.flush():
+                print(f"[Database] Database is busy, {len(self._pending)} queued writes lost")
+            self.conn.close()
+
     # ---------------- CHANNELS ----------------
 
     def save_channel(self, server_id, channel):
-        cursor = self.conn.cursor()
-        cursor.execute(
+        self._write(("channel", channel.id), channel.id, [(
             "INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?)",
             (channel.id, server_id, channel.name, channel.type.name),
-        )
-        self.conn.commit()
+        )])
 
     def delete_channel(self, channel_id):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM channels WHERE id=?", (channel_id,))
-        cursor.execute("DELETE FROM messages WHERE channel_id=?", (channel_id,))
-        self.conn.commit()
+        with self._lock:
+            # Anything still queued for this channel would be deleted anyway
+            for key in [k for k, (ch_id, _) in self._pending.items() if ch_id == channel_id]:
+                del self._pending[key]
+            self._pending_channels.pop(channel_id, None)
+            self._write(("channel_delete", channel_id), channel_id, [
+                ("DELETE FROM channels WHERE id=?", (channel_id,)),
+                ("DELETE FROM messages WHERE channel_id=?", (channel_id,)),
+            ])
 
     def load_channels(self, server_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT id, name, type FROM channels WHERE server_id=?",
-            (server_id,),
-        )
-        return cursor.fetchall()
+        with self._lock:
+            self._sync_reads()
+            return self._query(
+                "load_channels",
+                "SELECT id, name, type FROM channels WHERE server_id=?",
+                (server_id,),
+            )
 
     # ---------------- MESSAGES ----------------
 
     def save_message(self, channel_id, message):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)
+        # Upsert instead of REPLACE so edits keep the row's rowid (history order)
+        self._write(("message", message.id), channel_id, [("""
+            INSERT INTO messages (id, channel_id, author_id, timestamp, content, reactions)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                content=excluded.content,
+                reactions=excluded.reactions
         """, (
             message.id,
             channel_id,
             message.author_id,
             message.timestamp,
             message.content,
-            json.dumps(message.reactions)
-        ))
-        self.conn.commit()
+            json.dumps({emoji: sorted(users) for emoji, users in message.reactions.items()})
+        ))])
 
     def load_messages(self, channel_id):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT id, author_id, timestamp, content, reactions 
-            FROM messages 
-            WHERE channel_id=? 
-            ORDER BY timestamp ASC
-        """, (channel_id,))
-        rows = cursor.fetchall()
-        result = []
-        for row in rows:
-            msg_id, author_id, timestamp, content, reactions_json = row
-            from core.models.message import Message
-            msg = Message(author_id, content)
-            msg.id = msg_id
-            msg.timestamp = timestamp
-            msg.reactions = json.loads(reactions_json) if reactions_json else {}
-            if not content:
-                msg.deleted = True
-            result.append(msg)
-        return result
+        with self._lock:
+            self._sync_reads(channel_id)
+            rows = self._query("load_messages", """
+                SELECT id, author_id, timestamp, content, reactions
+                FROM messages
+                WHERE channel_id=?
+                ORDER BY rowid ASC
+            """, (channel_id,))
+        return [self._row_to_message(row) for row in rows]
+
+    def load_message_page(self, channel_id, before=None, after=None, limit=50):
+        """
+        One page of a channel's history, oldest first.
+        before/after are message ids used as exclusive cursors; with neither,
+        the newest page is returned. Returns (messages, has_more).
+        """
+        conditions = ["channel_id=?"]
+        params = [channel_id]
+        if before:
+            conditions.append("rowid < (SELECT rowid FROM messages WHERE id=?)")
+            params.append(before)
+        if after:
+            conditions.append("rowid > (SELECT rowid FROM messages WHERE id=?)")
+            params.append(after)
+
+        # Walk forward from an after-cursor, otherwise backwards from the newest end
+        order = "ASC" if after else "DESC"
+        params.append(limit + 1)
+
+        with self._lock:
+            self._sync_reads(channel_id)
+            rows = self._query("load_message_page", f"""
+                SELECT id, author_id, timestamp, content, reactions
+                FROM messages
+                WHERE {" AND ".join(conditions)}
+                ORDER BY rowid {order}
+                LIMIT ?
+            """, params)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == "DESC":
+            rows.reverse()
+        return [self._row_to_message(row) for row in rows], has_more
+
+    @staticmethod
+    def _row_to_message(row):
+        msg_id, author_id, timestamp, content, reactions_json = row
+        msg = Message(author_id, content)
+        msg.id = msg_id
+        msg.timestamp = timestamp
+        reactions = json.loads(reactions_json) if reactions_json else {}
+        msg.reactions = {emoji: set(users) for emoji, users in reactions.items()}
+        if not content:
+            msg.deleted = True
+        return msg
@@ -0,0 +1,31 @@
+# run_bus_broker.py
+#
+# Standalone bus broker for event servers on several machines:
+#
+#   export EVENT_BUS_SECRET=$(python -c "import secrets; print(secrets.token_hex(16))")   # same on every machine
+#   python run_bus_broker.py --listen 10.0.0.5:8790
+#   python run_event_server.py --bus 10.0.0.5:8790 --node-id 0 --nodes 2   # machine A
+#   python run_event_server.py --bus 10.0.0.5:8790 --node-id 1 --nodes 2   # machine B
+#
+# Listen on a private network address: nodes are let in by the shared secret
+# and the bus itself is not encrypted.
+#
+# The broker relays every envelope in arrival order and numbers broadcasts,
+# so it is a single point of failure: servers stop when they lose it.
+import argparse
+import asyncio
+import os
+from networking.bus import BUS_SECRET_ENV, BusBroker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Message bus broker for clustered event servers")
+    parser.add_argument("--listen", default="127.0.0.1:8790", help="host:port, or a Unix socket path")
+    args = parser.parse_args()
+    secret = os.environ.get(BUS_SECRET_ENV)
+    if not secret:
+        parser.error(f"set {BUS_SECRET_ENV} to the secret shared with the event servers")
+
+    try:
+        asyncio.run(BusBroker(args.listen, secret).serve())
+    except KeyboardInterrupt:
+        pass
@@ -1,51 +1,77 @@
 # run_event_server.py
+#
+#   python run_event_server.py               # one process
+#   python run_event_server.py --workers 4   # four worker processes sharing port 8765
+#   EVENT_BUS_SECRET=... python run_event_server.py --bus 10.0.0.5:8790 --node-id 0 --nodes 2   # one of two machines
+#
+# With --bus the nodes meet through a broker started with run_bus_broker.py,
+# proving themselves with the secret in EVENT_BUS_SECRET.
+import argparse
 import asyncio
+import os
+import uuid
 from auth.auth_manager import AuthManager
 from networking.event_server import EventServer
 from networking.voice_server import VoiceServer
+from networking.bus import BUS_SECRET_ENV, new_secret
+from networking.cluster import default_bus_path, start_workers, watch_workers
 from core.models.server import Server
 from core.models.role import Role
 from core.models.channel import Channel
 from core.enums import ChannelType, RoleType, Permission
 from persistence.database import Database
 
-db = Database()
+METRICS_PORT = 9108
+VOICE_OPTIONS = dict(port=5000, mix_threshold=8)  # rooms of 8 or more are mixed on the server
 
-def setup_demo():
+def setup_demo(fixed_ids=False):
+    db = Database()
     auth = AuthManager()
     community = Server("Demo Community")
 
+    def named(obj, name):
+        # Every machine in a cluster must build the same community
+        if fixed_ids:
+            obj.id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"demo/{type(obj).__name__}/{name}"))
+        return obj
+
+    named(community, community.name)
+
     # Create roles
-    owner_role = Role("Owner", RoleType.OWNER)
+    owner_role = named(Role("Owner", RoleType.OWNER), "Owner")
     owner_role.grant(Permission.SEND_MESSAGE)
     owner_role.grant(Permission.SPEAK)
     community.add_role(owner_role)
 
     # Create users
-    alice = auth.create_user("alice", "password123")
+    alice = named(auth.create_user("alice", "password123"), "alice")
     alice.assign_role(owner_role.id)
     community.add_member(alice)
 
-    caleb = auth.create_user("caleb", "12345")
+    caleb = named(auth.create_user("caleb", "12345"), "caleb")
     caleb.assign_role(owner_role.id)
     community.add_member(caleb)
 
     # Create channels
-    general = Channel("general", ChannelType.TEXT)
-    voice = Channel("voice", ChannelType.VOICE)
+    general = named(Channel("general", ChannelType.TEXT), "general")
+    voice = named(Channel("voice", ChannelType.VOICE), "voice")
     community.add_channel(general)
     community.add_channel(voice)
 
     db.save_channel(community.id, general)
     db.save_channel(community.id, voice)
+    # Servers open their own connections (worker processes must not share this one)
+    db.close()
 
     return auth, community, general, voice
 
 async def main():
     auth, community, text_channel, voice_channel = setup_demo()
 
-    event_server = EventServer(auth=auth, community=community)
-    voice_server = VoiceServer(channel=voice_channel)
+    # Every voice channel shares one UDP port
+    voice_server = VoiceServer(**VOICE_OPTIONS)
+    # Prometheus scrape target on localhost only
+    event_server = EventServer(auth=auth, community=community, metrics_port=METRICS_PORT, voice=voice_server)
 
     await asyncio.gather(
         event_server.start(),
@@ -53,4 +79,27 @@ async def main():
     )
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Event and voice server")
+    parser.add_argument("--workers", type=int, default=1, help="event server processes sharing the port")
+    parser.add_argument("--bus", help="join an external broker (host:port or socket path) instead of running one")
+    parser.add_argument("--node-id", type=int, default=0, help="with --bus: node id of this machine's first worker")
+    parser.add_argument("--nodes", type=int, help="with --bus: worker processes across the whole cluster")
+    args = parser.parse_args()
+
+    if args.bus:
+        bus_secret = os.environ.get(BUS_SECRET_ENV)
+        if not bus_secret:
+            parser.error(f"--bus needs the broker's secret in {BUS_SECRET_ENV}")
+        auth, community, text_channel, voice_channel = setup_demo(fixed_ids=True)
+        processes = start_workers(args.workers, auth, community, args.bus, bus_secret, first_node=args.node_id,
+                                  nodes=args.nodes, voice_options=VOICE_OPTIONS, metrics_port=METRICS_PORT)
+        asyncio.run(watch_workers(processes))
+    elif args.workers > 1:
+        auth, community, text_channel, voice_channel = setup_demo()
+        bus_path, bus_secret = default_bus_path(), new_secret()
+        # Fork before any event loop exists in this process
+        processes = start_workers(args.workers, auth, community, bus_path, bus_secret,
+                                  voice_options=VOICE_OPTIONS, metrics_port=METRICS_PORT)
+        asyncio.run(watch_workers(processes, bus_path, bus_secret))
+    else:
+        asyncio.run(main())
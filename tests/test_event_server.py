@@ -0,0 +1,84 @@
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+
+import bcrypt
+
+from auth.auth_manager import AuthManager
+from core.enums import ChannelType
+from core.models.channel import Channel
+from core.models.server import Server
+from core.models.user import User
+from networking.event_server import EventServer
+from networking.protocol import LineFraming
+
+PASSWORD = "secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class HistoryFetchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.community = Server("test")
+        self.user = User("alice", bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode())
+        self.community.add_member(self.user)
+        self.channel = Channel("general", ChannelType.TEXT)
+        self.community.add_channel(self.channel)
+        self.port = free_port()
+        self.server = EventServer(host="127.0.0.1", port=self.port, auth=AuthManager(), community=self.community,
+                                  db_path=os.path.join(self.tmp.name, "server.db"))
+        self.task = asyncio.create_task(self.server.start())
+        await self.server.channel_controller.post_message(self.channel.id, self.user.id, "hello")
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.tmp.cleanup()
+
+    async def connect(self):
+        for _ in range(50):
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                break
+            except ConnectionRefusedError:
+                await asyncio.sleep(0.05)
+        self.addAsyncCleanup(self._close, writer)
+        return reader, writer, LineFraming()
+
+    @staticmethod
+    async def _close(writer):
+        writer.close()
+
+    async def next_event(self, reader, framing):
+        return await asyncio.wait_for(framing.read(reader), 5)
+
+    def fetch(self):
+        return {"event": "HISTORY_FETCH", "payload": {"channel_id": self.channel.id}}
+
+    async def test_unauthenticated_fetch_gets_nothing(self):
+        reader, writer, framing = await self.connect()
+        writer.write(framing.encode(self.fetch()))
+        # Anything the fetch produced would arrive before the reply to this
+        writer.write(framing.encode({"event": "AUTH", "payload": {"username": "alice", "password": "wrong"}}))
+        reply = await self.next_event(reader, framing)
+        self.assertEqual(reply["event"], "AUTH_FAILED")
+
+    async def test_authenticated_fetch_gets_a_page(self):
+        reader, writer, framing = await self.connect()
+        writer.write(framing.encode({"event": "AUTH", "payload": {"username": "alice", "password": PASSWORD}}))
+        self.assertEqual((await self.next_event(reader, framing))["event"], "AUTH_SUCCESS")
+        writer.write(framing.encode(self.fetch()))
+        reply = await self.next_event(reader, framing)
+        self.assertEqual(reply["event"], "HISTORY_PAGE")
+        self.assertEqual([m["content"] for m in reply["payload"]["messages"]], ["hello"])
+
+
+if __name__ == "__main__":
+    unittest.main()